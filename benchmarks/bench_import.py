@@ -0,0 +1,55 @@
+'''
+Import-time benchmark for `import narrative_mapper`.
+
+Each run imports the package in a fresh interpreter, reports the median wall time, and
+checks that none of the heavy dependencies were pulled in. Exits non-zero if a heavy
+module is imported or the median exceeds --max-seconds, so it can guard against regressions.
+
+Usage:
+    python benchmarks/bench_import.py --runs 5 --max-seconds 2.0
+'''
+from common import REPO_ROOT
+import subprocess
+import statistics
+import argparse
+import json
+import sys
+
+HEAVY_MODULES = ["torch", "transformers", "umap", "hdbscan", "openai", "tiktoken", "numba"]
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import narrative_mapper
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark `import narrative_mapper`.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if the median import time is above this.")
+    args = parser.parse_args()
+
+    timings = []
+    loaded = set()
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True, check=True, cwd=REPO_ROOT) #-c puts the cwd first on sys.path, so this is the checkout's package
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        loaded.update(result["loaded"])
+
+    median = statistics.median(timings)
+    print(f"import narrative_mapper: median {median:.3f}s, min {min(timings):.3f}s over {args.runs} runs")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: heavy modules imported eagerly: {sorted(loaded)}")
+        failed = True
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"FAIL: median import time above {args.max_seconds:.3f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
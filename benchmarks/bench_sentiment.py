@@ -0,0 +1,77 @@
+'''
+Sentiment throughput benchmark: the per-text pipeline loop vs. the batched, deduplicated engine,
+and the CPU backends (int8-quantized PyTorch, ONNX Runtime fp32/int8) against fp32 PyTorch.
+
+Backends are compared at --backend-batch-size with the same thread settings. Label agreement and
+mean absolute score difference are measured against the fp32 'torch' results; the ONNX backends
+need NarrativeMapper[onnx] and are skipped with a note if it is missing.
+
+Usage:
+    python benchmarks/bench_sentiment.py --n 2000 --batch-sizes 8 32 64
+    python benchmarks/bench_sentiment.py --n 2000 --batch-sizes --backends int8 onnx onnx-int8 --threads 4 --interop-threads 1
+'''
+from common import load_texts
+from narrative_mapper.narrative_analyzer import sentiment
+import argparse
+import time
+
+def per_text(texts):
+    #the original analyze_sentiments_for_texts loop
+    sentiment_analyzer = sentiment.get_sentiment_analyzer()
+    return [sentiment_analyzer(text, truncation=True)[0] for text in texts]
+
+def compare_backends(texts, args):
+    #fp32 torch first: it is the reference for speed and agreement
+    reference, torch_time = None, None
+    for backend in ["torch"] + [backend for backend in args.backends if backend != "torch"]:
+        try:
+            sentiment.warm_up(backend)
+        except ImportError as e:
+            print(f"{backend:<10} skipped: {e}")
+            continue
+        start = time.perf_counter()
+        results = sentiment.score_texts(texts, batch_size=args.backend_batch_size, backend=backend)
+        elapsed = time.perf_counter() - start
+
+        line = f"{backend:<10} {len(texts) / elapsed:8.1f} texts/s  ({elapsed:.2f}s)"
+        if reference is None:
+            reference, torch_time = results, elapsed
+        else:
+            agreement = sum(a['label'] == b['label'] for a, b in zip(reference, results)) / len(texts)
+            score_diff = sum(abs(a['score'] - b['score']) for a, b in zip(reference, results)) / len(texts)
+            line += f"  speedup {torch_time / elapsed:.2f}x  label agreement {agreement:.3f}  mean |score diff| {score_diff:.4f}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sentiment inference paths.")
+    parser.add_argument("--n", type=int, default=2000, help="Number of texts to score.")
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=[8, 32, 64], help="Batch sizes compared with the per-text loop (none skips the comparison).")
+    parser.add_argument("--backends", type=str, nargs="*", default=[], choices=sentiment.SENTIMENT_BACKENDS, help="Backends compared with fp32 torch.")
+    parser.add_argument("--backend-batch-size", type=int, default=32, help="Batch size of the backend comparison.")
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads for every backend.")
+    parser.add_argument("--interop-threads", type=int, default=None, help="Inter-op threads for every backend.")
+    args = parser.parse_args()
+
+    texts = load_texts(args.n, sample=True)
+    sentiment.set_sentiment_backend("torch", intra_op_threads=args.threads, inter_op_threads=args.interop_threads)
+    if args.backends:
+        compare_backends(texts, args)
+    if not args.batch_sizes:
+        return
+
+    sentiment.warm_up()
+
+    start = time.perf_counter()
+    baseline = per_text(texts)
+    base_time = time.perf_counter() - start
+    print(f"per-text       {len(texts) / base_time:8.1f} texts/s  ({base_time:.2f}s)")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        batched = sentiment.score_texts(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        agreement = sum(a['label'] == b['label'] for a, b in zip(baseline, batched)) / len(texts)
+        print(f"batched bs={batch_size:<4} {len(texts) / elapsed:8.1f} texts/s  ({elapsed:.2f}s)  speedup {base_time / elapsed:.2f}x  label agreement {agreement:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+'''
+Shared setup for the benchmark scripts.
+
+Importing this module puts the repository root first on sys.path, so the scripts import the
+package from the checkout they live in and run without installing it. Import it before anything
+from narrative_mapper.
+'''
+import glob
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(REPO_ROOT, "sample_data", "comment_data")
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+def load_texts(n, sample=False):
+    '''
+    Returns n texts from the comment files in sample_data/comment_data.
+
+    By default every text is distinct: the de-duplicated pool is used in file order, and once it
+    runs out, repeats get a numeric suffix. With sample=True, n texts are drawn at random (seeded)
+    and keep the repeats the data already has, which is what deduplicating code paths should see.
+    '''
+    import pandas as pd
+
+    frames = [pd.read_csv(path) for path in sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.csv")))]
+    texts = pd.concat(frames)['text'].dropna().astype(str)
+    if sample:
+        return texts.sample(n=n, replace=len(texts) < n, random_state=42).tolist()
+
+    pool = texts.drop_duplicates().tolist()
+    return [pool[i % len(pool)] if i < len(pool) else f"{pool[i % len(pool)]} #{i // len(pool)}" for i in range(n)]
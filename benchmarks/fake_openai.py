@@ -0,0 +1,233 @@
+'''
+Local OpenAI-compatible stand-in for offline benchmarks.
+
+Serves POST /v1/embeddings and POST /v1/chat/completions, so the pipeline can run end to end
+without an API key or network access. Embeddings are drawn from planted clusters: each text is
+assigned to one of --clusters random unit centers by a hash of its content, plus deterministic
+per-text noise, so the same text always gets the same vector. Chat completions return a short
+deterministic summary. Both report token usage (estimated as characters / 4).
+
+Latency and rate limits are configurable. Requests over --rpm or --tpm within a 60 second
+window get a 429 with a Retry-After header, like the real API. --window enforces the limits over
+a shorter sliding window instead (scaled to it), so throttling shows up within seconds. GET /stats returns request,
+throttle and token counters.
+
+Usage:
+    python benchmarks/fake_openai.py --port 8765 --latency 0.05 --rpm 3000
+    export OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake
+'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import deque
+import numpy as np
+import threading
+import argparse
+import hashlib
+import base64
+import random
+import json
+import time
+
+def text_seed(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class PlantedClusters:
+    """
+    Deterministic synthetic embeddings: n_clusters unit centers plus Gaussian noise of scale noise.
+    """
+    def __init__(self, dim=1536, n_clusters=20, noise=0.35, seed=0):
+        centers = np.random.default_rng(seed).normal(size=(n_clusters, dim)).astype(np.float32)
+        self.centers = centers / np.linalg.norm(centers, axis=1, keepdims=True)
+        self.dim = dim
+        self.noise = noise / np.sqrt(dim) #noise scale relative to the unit centers
+
+    def cluster_of(self, text: str) -> int:
+        return text_seed(text) % len(self.centers)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = text_seed(text)
+            out[i] = self.centers[seed % len(self.centers)]
+            out[i] += self.noise * np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        return out
+
+class RateLimiter:
+    """
+    Sliding window of window seconds over requests and tokens, admitting rpm and tpm scaled to the
+    window. check() returns the seconds to wait before the request would fit, or 0 if it is
+    admitted (and counted).
+    """
+    def __init__(self, rpm=None, tpm=None, window=60.0):
+        self.window = window
+        self.rpm = rpm * window / 60 if rpm else None
+        self.tpm = tpm * window / 60 if tpm else None
+        self._window = deque() #(timestamp, tokens)
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def check(self, tokens: int) -> float:
+        if not self.rpm and not self.tpm:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            while self._window and now - self._window[0][0] >= self.window:
+                self._tokens -= self._window.popleft()[1]
+
+            over_rpm = self.rpm and len(self._window) >= self.rpm
+            over_tpm = self.tpm and self._window and self._tokens + tokens > self.tpm
+            if over_rpm or over_tpm:
+                return max(0.01, self.window - (now - self._window[0][0]))
+
+            self._window.append((now, tokens))
+            self._tokens += tokens
+            return 0.0
+
+class FakeOpenAIServer:
+    """
+    Threaded HTTP server implementing the embedding and chat completion endpoints used by the pipeline.
+
+    Parameters:
+        host (str), port (int): Address to bind. Port 0 picks a free port.
+        latency (float): Seconds added to every request.
+        jitter (float): Extra uniform random latency in [0, jitter) seconds.
+        rpm (int), tpm (int): Requests / tokens per minute before 429s are returned. None disables.
+        window (float): Seconds of the sliding window the limits are enforced over.
+        dim (int), clusters (int), noise (float), seed (int): Planted cluster embedding settings.
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, rpm=None, tpm=None, window=60.0, dim=1536, clusters=20, noise=0.35, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.limiter = RateLimiter(rpm=rpm, tpm=tpm, window=window)
+        self.embedder = PlantedClusters(dim=dim, n_clusters=clusters, noise=noise, seed=seed)
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+        handler = type("FakeOpenAIHandler", (_Handler,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {"requests": 0, "throttled": 0, "embedding_requests": 0, "chat_requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def count(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class _Handler(BaseHTTPRequestHandler):
+    server_state = None
+    protocol_version = "HTTP/1.1" #keep-alive, like the real API
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server_state.stats)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        state = self.server_state
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        path = self.path.rstrip("/")
+
+        if path.endswith("/embeddings"):
+            texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+            prompt_tokens = sum(estimate_tokens(text) for text in texts)
+        elif path.endswith("/chat/completions"):
+            prompt = "\n".join(message["content"] for message in request["messages"])
+            prompt_tokens = estimate_tokens(prompt)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        state.count(requests=1)
+        retry_after = state.limiter.check(prompt_tokens)
+        if retry_after:
+            state.count(throttled=1)
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                            headers={"Retry-After": f"{retry_after:.2f}"})
+            return
+
+        delay = state.latency + (random.random() * state.jitter if state.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+        if path.endswith("/embeddings"):
+            vectors = state.embedder.embed(texts)
+            if request.get("encoding_format") == "base64":
+                data = [base64.b64encode(vector.tobytes()).decode("ascii") for vector in vectors]
+            else:
+                data = vectors.tolist()
+            state.count(embedding_requests=1, prompt_tokens=prompt_tokens)
+            self._send_json(200, {
+                "object": "list",
+                "data": [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(data)],
+                "model": request.get("model"),
+                "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+            })
+        else:
+            content = f"Synthetic summary {hashlib.md5(prompt.encode('utf-8')).hexdigest()[:8]}."
+            completion_tokens = estimate_tokens(content)
+            state.count(chat_requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+            })
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local OpenAI-compatible stand-in.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds.")
+    parser.add_argument("--rpm", type=int, default=None, help="Requests per minute before 429s.")
+    parser.add_argument("--tpm", type=int, default=None, help="Tokens per minute before 429s.")
+    parser.add_argument("--window", type=float, default=60.0, help="Seconds of the sliding rate limit window. Default is 60.")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension.")
+    parser.add_argument("--clusters", type=int, default=20, help="Number of planted clusters.")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.host, args.port, latency=args.latency, jitter=args.jitter, rpm=args.rpm, tpm=args.tpm, window=args.window, dim=args.dim, clusters=args.clusters)
+    print(f"Serving fake OpenAI API at {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
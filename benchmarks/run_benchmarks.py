@@ -0,0 +1,222 @@
+'''
+Offline scaling benchmark of the whole pipeline: get_embeddings -> cluster_embeddings ->
+summarize_clusters -> formatters, at several dataset sizes.
+
+OpenAI calls go to the local stand-in in fake_openai.py (planted cluster embeddings, configurable
+latency and rate limits), so no API key or network is needed. Texts are drawn from
+sample_data/comment_data; once the pool runs out, repeats get a numeric suffix so every text is unique.
+Each size runs in a fresh interpreter, so the process peak RSS is per size. Per-stage records come
+from PipelineMetrics (wall/CPU time, RSS at stage start and end, process peak RSS so far, rows
+in/out, requests and tokens).
+
+--landmarks N additionally clusters the same embeddings in landmark mode (fit on N landmark rows,
+assign the rest) and reports its clustering time and agreement with full clustering (adjusted Rand
+index over all rows, noise included) under "landmark".
+
+--fake-sentiment swaps the Hugging Face model for a trivial scorer, for machines without the
+model weights. Sentiment timings are then meaningless but every other stage is unaffected.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --output bench.json
+    python benchmarks/run_benchmarks.py --sizes 100000 --landmarks 5000 --fake-sentiment
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 --compare bench.json --max-regression 0.25
+'''
+from common import load_texts
+import subprocess
+import platform
+import argparse
+import tempfile
+import json
+import time
+import sys
+import os
+
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+MIN_COMPARE_SECONDS = 0.05 #stages faster than this are too noisy to flag as regressions
+
+def fake_sentiment_analyzer(texts, truncation=True, batch_size=None):
+    #same call signature and output shape as the transformers pipeline
+    single = isinstance(texts, str)
+    return [{"label": "POSITIVE" if len(text) % 2 else "NEGATIVE", "score": 0.9} for text in ([texts] if single else texts)]
+
+def run_one(n, args):
+    '''
+    Runs the pipeline once on n texts and returns its metrics. Called inside a fresh interpreter.
+    '''
+    import pandas as pd
+    from narrative_mapper import get_embeddings, cluster_embeddings, summarize_clusters, format_to_dict, format_by_cluster, format_by_text, PipelineMetrics
+    from narrative_mapper.narrative_analyzer import sentiment
+
+    if args.fake_sentiment:
+        sentiment._sentiment_analyzers[sentiment.get_sentiment_backend()] = fake_sentiment_analyzer
+
+    df = pd.DataFrame({'text': load_texts(n)})
+    metrics = PipelineMetrics()
+
+    embeddings = get_embeddings(df, max_concurrency=args.max_concurrency, metrics=metrics)
+    clustered = cluster_embeddings(embeddings, pca_kwargs={'n_components': min(100, embeddings.dim), 'random_state': 42}, metrics=metrics)
+    summary_df = summarize_clusters(clustered, max_sample_size=args.max_samples, max_concurrency=args.max_concurrency, metrics=metrics, sampling=args.summary_sampling)
+
+    for name, formatter in [("format_to_dict", format_to_dict), ("format_by_cluster", format_by_cluster), ("format_by_text", format_by_text)]:
+        with metrics.stage(name, rows_in=len(summary_df)) as record:
+            output = formatter(summary_df, "benchmark")
+            record["rows_out"] = len(output["clusters"]) if isinstance(output, dict) else len(output)
+
+    result = metrics.to_dict()
+    result["n"] = n
+    result["clusters"] = int(len(summary_df))
+    if args.landmarks:
+        result["landmark"] = landmark_agreement(embeddings, clustered, args.landmarks)
+    return result
+
+def landmark_agreement(embeddings, clustered, landmark_size):
+    '''
+    Clusters the embeddings again in landmark mode and compares the labels with the full run.
+    '''
+    import numpy as np
+    from sklearn.metrics import adjusted_rand_score
+    from narrative_mapper import cluster_embeddings, PipelineMetrics
+
+    metrics = PipelineMetrics()
+    landmark = cluster_embeddings(embeddings, pca_kwargs={'n_components': min(100, embeddings.dim), 'random_state': 42},
+                                  landmark_size=landmark_size, metrics=metrics)
+
+    #rows dropped as noise get label -1 on both sides
+    def labels(result):
+        out = np.full(len(embeddings), -1)
+        out[embeddings.df.index.get_indexer(result.df.index)] = result.df['cluster'].to_numpy()
+        return out
+
+    return {
+        "landmark_size": landmark_size,
+        "stages": metrics.stages,
+        "clustering_wall_time_s": sum(stage["wall_time_s"] for stage in metrics.stages),
+        "clusters": int(landmark.df['cluster'].nunique()),
+        "adjusted_rand_index": float(adjusted_rand_score(labels(clustered), labels(landmark)))
+    }
+
+def run_size(n, args, server):
+    '''
+    Runs one size in a subprocess pointed at the fake server and returns its result record.
+    '''
+    server.reset_stats()
+    env = dict(os.environ, OPENAI_BASE_URL=server.url, OPENAI_API_KEY="fake-benchmark-key")
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "result.json")
+        command = [sys.executable, os.path.abspath(__file__), "--run-one", str(n), "--run-one-output", out_path,
+                   "--max-concurrency", str(args.max_concurrency), "--max-samples", str(args.max_samples),
+                   "--summary-sampling", args.summary_sampling]
+        if args.fake_sentiment:
+            command.append("--fake-sentiment")
+        if args.landmarks:
+            command += ["--landmarks", str(args.landmarks)]
+        subprocess.run(command, env=env, check=True)
+        with open(out_path, encoding="utf-8") as f:
+            result = json.load(f)
+    result["server"] = dict(server.stats)
+    return result
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(results):
+    for run in results["runs"]:
+        print(f"\nN={run['n']}  clusters={run['clusters']}  requests={run['server']['requests']}  throttled={run['server']['throttled']}")
+        print(f"  {'stage':<18}{'wall s':>10}{'cpu s':>10}{'rss in MB':>11}{'rss out MB':>12}{'peak so far':>13}{'rows in':>10}{'rows out':>10}")
+        for stage in run["stages"]:
+            rss = [stage[key] if stage[key] is not None else float("nan") for key in ("rss_start_mb", "rss_end_mb", "process_peak_rss_mb")]
+            print(f"  {stage['stage']:<18}{stage['wall_time_s']:>10.3f}{stage['cpu_time_s']:>10.3f}{rss[0]:>11.1f}{rss[1]:>12.1f}{rss[2]:>13.1f}{str(stage['rows_in']):>10}{str(stage['rows_out']):>10}")
+        if "landmark" in run:
+            landmark = run["landmark"]
+            full_time = sum(stage["wall_time_s"] for stage in run["stages"] if stage["stage"] in ("pca", "umap", "hdbscan", "merge"))
+            print(f"  landmarks={landmark['landmark_size']}  clusters={landmark['clusters']}  ARI vs full={landmark['adjusted_rand_index']:.3f}"
+                  f"  clustering {full_time:.2f}s -> {landmark['clustering_wall_time_s']:.2f}s")
+
+def compare(results, baseline, max_regression=None):
+    '''
+    Prints per-stage wall time against a baseline results file. Returns the stages that got slower
+    than max_regression (relative), if given.
+    '''
+    regressions = []
+    base_runs = {run["n"]: run for run in baseline["runs"]}
+    print(f"\nComparison against {baseline['meta'].get('commit')} (wall time, current / baseline)")
+    for run in results["runs"]:
+        base = base_runs.get(run["n"])
+        if base is None:
+            continue
+        base_stages = {stage["stage"]: stage for stage in base["stages"]}
+        print(f"N={run['n']}")
+        for stage in run["stages"]:
+            before = base_stages.get(stage["stage"])
+            if before is None:
+                continue
+            ratio = stage["wall_time_s"] / before["wall_time_s"] if before["wall_time_s"] > 0 else float("inf")
+            print(f"  {stage['stage']:<18}{before['wall_time_s']:>10.3f} -> {stage['wall_time_s']:>10.3f}  x{ratio:.2f}")
+            if max_regression is not None and ratio > 1 + max_regression and stage["wall_time_s"] >= MIN_COMPARE_SECONDS:
+                regressions.append((run["n"], stage["stage"], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline scaling benchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Dataset sizes to run.")
+    parser.add_argument("--output", type=str, default=None, help="Write results JSON here.")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline results JSON to compare against.")
+    parser.add_argument("--max-regression", type=float, default=None, help="Exit non-zero if a stage is this much slower than the baseline (0.25 = 25%%).")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake API latency per request in seconds.")
+    parser.add_argument("--rpm", type=int, default=None, help="Fake API requests per minute limit.")
+    parser.add_argument("--tpm", type=int, default=None, help="Fake API tokens per minute limit.")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension.")
+    parser.add_argument("--clusters", type=int, default=20, help="Number of planted clusters.")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--max-samples", type=int, default=500)
+    parser.add_argument("--summary-sampling", type=str, choices=["random", "mmr"], default="random", help="summarize_clusters sampling mode.")
+    parser.add_argument("--landmarks", type=int, default=None, help="Also cluster with this many landmarks and report agreement with full clustering.")
+    parser.add_argument("--fake-sentiment", action="store_true", help="Replace the sentiment model with a trivial scorer.")
+    parser.add_argument("--run-one", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--run-one-output", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        result = run_one(args.run_one, args)
+        with open(args.run_one_output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    from fake_openai import FakeOpenAIServer
+
+    server = FakeOpenAIServer(latency=args.latency, rpm=args.rpm, tpm=args.tpm, dim=args.dim, clusters=args.clusters).start()
+    try:
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": {key: value for key, value in vars(args).items() if not key.startswith("run_one")}
+            },
+            "runs": [run_size(n, args, server) for n in args.sizes]
+        }
+    finally:
+        server.stop()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            for n, stage, ratio in regressions:
+                print(f"REGRESSION: N={n} {stage} is {ratio:.2f}x the baseline")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,50 @@
 from .narrative_analyzer.embeddings import get_embeddings
-from .narrative_analyzer.clustering import cluster_embeddings
+from .narrative_analyzer.embedders import Embedder, OpenAIEmbedder, LocalEmbedder
+from .narrative_analyzer.clustering import cluster_embeddings, ClusterModel
+from .narrative_analyzer.sweep import sweep_clustering, SweepResult
 from .narrative_analyzer.summarize import summarize_clusters
-from .narrative_analyzer.formatters import format_by_text, format_by_cluster, format_to_dict
+from .narrative_analyzer.formatters import format_by_text, format_by_cluster, format_to_dict, write_by_text
 from .narrative_analyzer.narrative_mapper import NarrativeMapper
+from .narrative_analyzer.cache import EmbeddingCache, SummaryCache, SentimentCache
+from .narrative_analyzer.checkpoint import RunCheckpoint
+from .narrative_analyzer.embedding_set import EmbeddingSet
+from .narrative_analyzer.artifacts import save_embedding_set, load_embedding_set
+from .narrative_analyzer.streaming import embed_csv
+from .narrative_analyzer.dedup import collapse_duplicates, expand_duplicates
+from .narrative_analyzer.sentiment import warm_up as warm_up_sentiment_model, set_sentiment_backend
+from .narrative_analyzer.metrics import PipelineMetrics
+from .narrative_analyzer.utils import set_openai_rate_limit, get_openai_scheduler
+from .narrative_analyzer.scheduler import RequestScheduler
 
 __all__ = [
     "NarrativeMapper",
     "get_embeddings",
+    "Embedder",
+    "OpenAIEmbedder",
+    "LocalEmbedder",
     "cluster_embeddings",
+    "ClusterModel",
+    "sweep_clustering",
+    "SweepResult",
     "summarize_clusters",
     "format_by_text",
     "format_by_cluster",
-    "format_to_dict"
+    "format_to_dict",
+    "write_by_text",
+    "EmbeddingSet",
+    "save_embedding_set",
+    "load_embedding_set",
+    "embed_csv",
+    "collapse_duplicates",
+    "expand_duplicates",
+    "EmbeddingCache",
+    "SummaryCache",
+    "SentimentCache",
+    "RunCheckpoint",
+    "warm_up_sentiment_model",
+    "set_sentiment_backend",
+    "PipelineMetrics",
+    "set_openai_rate_limit",
+    "get_openai_scheduler",
+    "RequestScheduler"
 ]
@@ -0,0 +1,174 @@
+from .embedding_set import EmbeddingSet
+import pandas as pd
+import numpy as np
+import struct
+import json
+import os
+
+ARTIFACT_FORMAT = "narrative_mapper.embeddings"
+ARTIFACT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+ROWS_FILE = "rows.jsonl"
+MATRIX_FILE = "embeddings.npy"
+
+NPY_HEADER_BYTES = 128 #fixed-size .npy header, so the row count can be rewritten in place
+ROWS_CHUNK_SIZE = 50000 #rows.jsonl lines parsed at a time on load
+
+def is_embedding_artifact(path) -> bool:
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+def save_embedding_set(embedding_set: EmbeddingSet, path):
+    """
+    Writes an EmbeddingSet to a versioned artifact directory:
+
+        manifest.json    format version, model name, dimension, row count, columns
+        rows.jsonl       text/metadata table, one JSON record per row
+        embeddings.npy   raw float32 (rows x dim) matrix
+
+    Unlike a pickle, the artifact can be loaded without executing code, and the matrix can be
+    memory-mapped instead of read whole.
+
+    Parameters:
+        embedding_set (EmbeddingSet): Texts and embeddings to write.
+        path (str): Directory to write to. Created if missing; existing artifact files are replaced.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    df = embedding_set.df.reset_index(drop=True)
+    df.to_json(os.path.join(path, ROWS_FILE), orient="records", lines=True, force_ascii=False)
+    np.save(os.path.join(path, MATRIX_FILE), np.ascontiguousarray(embedding_set.matrix, dtype=np.float32))
+
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "version": ARTIFACT_VERSION,
+        "model": embedding_set.model,
+        "dim": int(embedding_set.dim),
+        "rows": int(len(df)),
+        "dtype": "float32",
+        "columns": [str(col) for col in df.columns]
+    }
+    #manifest is written last, so a partially written directory is never mistaken for an artifact
+    with open(os.path.join(path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    #.npy v1.0 header: magic, version, header length, then a padded dict literal ending in newline
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    header = header.ljust(NPY_HEADER_BYTES - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+class EmbeddingArtifactWriter:
+    """
+    Writes an embedding artifact incrementally, one EmbeddingSet chunk at a time.
+
+    Rows are appended to rows.jsonl and vectors to embeddings.npy as they arrive, so only one chunk
+    is ever held in memory. The .npy header has a fixed size and is rewritten with the final row
+    count on close(), which also writes the manifest. The result is read by load_embedding_set
+    like any other artifact.
+
+    Parameters:
+        path (str): Directory to write to. Created if missing; existing artifact files are replaced.
+        model (str): Name of the embedding model, recorded in the manifest.
+    """
+    def __init__(self, path, model=None):
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path) #the directory is not a valid artifact until close()
+
+        self.path = path
+        self.model = model
+        self.rows = 0
+        self.dim = None
+        self.columns = None
+        self._rows_file = open(os.path.join(path, ROWS_FILE), "w", encoding="utf-8")
+        self._matrix_file = open(os.path.join(path, MATRIX_FILE), "wb")
+        self._matrix_file.write(_npy_header(0, 0)) #placeholder until the final shape is known
+
+    def append(self, embedding_set: EmbeddingSet):
+        if self.dim is None:
+            self.dim = embedding_set.dim
+            self.columns = [str(col) for col in embedding_set.df.columns]
+        elif embedding_set.dim != self.dim:
+            raise ValueError(f"Cannot append embeddings of dimension {embedding_set.dim} to an artifact of dimension {self.dim}.")
+        if not len(embedding_set):
+            return
+
+        records = embedding_set.df.to_json(orient="records", lines=True, force_ascii=False)
+        self._rows_file.write(records if records.endswith("\n") else records + "\n")
+        self._matrix_file.write(np.ascontiguousarray(embedding_set.matrix, dtype="<f4").tobytes())
+        self.rows += len(embedding_set)
+
+    def close(self):
+        self._rows_file.close()
+        self._matrix_file.seek(0)
+        self._matrix_file.write(_npy_header(self.rows, self.dim or 0))
+        self._matrix_file.close()
+
+        manifest = {
+            "format": ARTIFACT_FORMAT,
+            "version": ARTIFACT_VERSION,
+            "model": self.model,
+            "dim": int(self.dim or 0),
+            "rows": int(self.rows),
+            "dtype": "float32",
+            "columns": self.columns or []
+        }
+        with open(os.path.join(self.path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            #leave no manifest behind, so the partial directory is never loaded as an artifact
+            self._rows_file.close()
+            self._matrix_file.close()
+
+def load_embedding_set(path, mmap=True, model=None, dim=None) -> EmbeddingSet:
+    """
+    Loads an artifact directory written by save_embedding_set.
+
+    Parameters:
+        path (str): Artifact directory.
+        mmap (bool): Open the matrix read-only with np.memmap instead of reading it into RAM.
+        model (str): If given, raise if the artifact was produced by a different model.
+        dim (int): If given, raise if the artifact has a different embedding dimension.
+
+    Returns:
+        EmbeddingSet: rows and embedding matrix (a np.memmap when mmap is True).
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        raise ValueError(f"'{path}' is not an embedding artifact (missing {MANIFEST_FILE}).")
+
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format") != ARTIFACT_FORMAT:
+        raise ValueError(f"'{path}' is not an embedding artifact (format {manifest.get('format')!r}).")
+    if manifest.get("version", 0) > ARTIFACT_VERSION:
+        raise ValueError(f"Embedding artifact version {manifest['version']} is newer than supported version {ARTIFACT_VERSION}.")
+    if model is not None and manifest["model"] != model:
+        raise ValueError(f"Embedding artifact was produced by model '{manifest['model']}', expected '{model}'.")
+    if dim is not None and manifest["dim"] != dim:
+        raise ValueError(f"Embedding artifact has dimension {manifest['dim']}, expected {dim}.")
+
+    matrix = np.load(os.path.join(path, MATRIX_FILE), mmap_mode="r" if mmap else None, allow_pickle=False)
+    if matrix.shape != (manifest["rows"], manifest["dim"]) or matrix.dtype != np.float32:
+        raise ValueError(f"Embedding matrix {matrix.shape} {matrix.dtype} does not match manifest ({manifest['rows']}, {manifest['dim']}) float32.")
+
+    if manifest["rows"]:
+        #read in chunks, so the whole file is never parsed at once on top of the finished frame
+        with pd.read_json(os.path.join(path, ROWS_FILE), orient="records", lines=True, dtype=False, convert_dates=False, chunksize=ROWS_CHUNK_SIZE) as reader:
+            df = pd.concat(reader, ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=manifest["columns"])
+    if len(df) != manifest["rows"]:
+        raise ValueError(f"Embedding artifact has {len(df)} rows but manifest records {manifest['rows']}.")
+
+    return EmbeddingSet(df, matrix, model=manifest["model"])
@@ -0,0 +1,253 @@
+import numpy as np
+import hashlib
+import sqlite3
+import struct
+import threading
+import time
+import os
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "narrative_mapper")
+
+def hash_key(*parts) -> str:
+    '''
+    Content-addressed key: sha256 over the given parts, separated by a NUL byte.
+    '''
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+class DiskCache:
+    """
+    Small sqlite-backed key/value store with least-recently-used eviction.
+
+    Subclasses decide how values are serialized to and from bytes. The store is safe to
+    share between threads of one process.
+
+    Parameters:
+        path (str): sqlite file to use. Parent directories are created if missing.
+        max_bytes (int): Evict least recently used entries once stored values exceed this size.
+        max_entries (int): Evict least recently used entries once the entry count exceeds this.
+    """
+    _lookup_chunk = 500 #stays under sqlite's host parameter limit
+
+    def __init__(self, path, max_bytes=None, max_entries=None):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON entries(last_used)")
+        self._conn.commit()
+
+    def _encode(self, value) -> bytes:
+        return value
+
+    def _decode(self, blob):
+        return blob
+
+    def get_many(self, keys) -> dict:
+        '''
+        Returns {key: value} for every key found. Found keys are marked as recently used.
+        '''
+        unique_keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for start in range(0, len(unique_keys), self._lookup_chunk):
+                chunk = unique_keys[start:start + self._lookup_chunk]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self._decode(blob)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+        return found
+
+    def set_many(self, items: dict):
+        '''
+        Inserts or replaces the given {key: value} pairs, then evicts if over the size limits.
+        '''
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            blob = self._encode(value)
+            rows.append((key, blob, len(blob), now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        #caller holds the lock
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                #walk oldest first until enough space has been freed
+                excess = total - self.max_bytes
+                stale = []
+                for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_used ASC"):
+                    stale.append((key,))
+                    excess -= size
+                    if excess <= 0:
+                        break
+                self._conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def stats(self) -> dict:
+        '''
+        Hit/miss counters for this instance plus the current size of the store.
+        '''
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class EmbeddingCache(DiskCache):
+    """
+    Persistent embedding store keyed by a hash of the cleaned text and the embedding model name.
+
+    Vectors are stored as raw float32 bytes.
+
+    Parameters:
+        path (str): sqlite file to use. Defaults to ~/.cache/narrative_mapper/embeddings.sqlite
+        max_bytes (int): Size limit for stored vectors. Default is 2 GB.
+        max_entries (int): Optional entry count limit.
+    """
+    def __init__(self, path=None, max_bytes=2 * 1024**3, max_entries=None):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "embeddings.sqlite")
+        super().__init__(path, max_bytes=max_bytes, max_entries=max_entries)
+
+    def _encode(self, value) -> bytes:
+        return np.asarray(value, dtype=np.float32).tobytes()
+
+    def _decode(self, blob):
+        return np.frombuffer(blob, dtype=np.float32)
+
+    def lookup(self, texts: list[str], model: str) -> list:
+        '''
+        Returns a list aligned with texts holding the cached vector, or None for a miss.
+        '''
+        keys = [hash_key(model, text) for text in texts]
+        found = self.get_many(keys)
+        return [found.get(key) for key in keys]
+
+    def store(self, texts: list[str], model: str, vectors):
+        self.set_many({hash_key(model, text): vector for text, vector in zip(texts, vectors)})
+
+class SummaryCache(DiskCache):
+    """
+    Persistent store of chat completion results for cluster summaries.
+
+    Keyed by a hash of the full prompt (so both the batch contents and the prompt template),
+    the model name and the temperature. Covers both the per-batch partial summaries and the
+    final summary of each cluster.
+
+    Parameters:
+        path (str): sqlite file to use. Defaults to ~/.cache/narrative_mapper/summaries.sqlite
+        max_bytes (int): Size limit for stored summaries. Default is 256 MB.
+        max_entries (int): Optional entry count limit.
+    """
+    def __init__(self, path=None, max_bytes=256 * 1024**2, max_entries=None):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "summaries.sqlite")
+        super().__init__(path, max_bytes=max_bytes, max_entries=max_entries)
+
+    def _encode(self, value) -> bytes:
+        return value.encode("utf-8")
+
+    def _decode(self, blob):
+        return blob.decode("utf-8")
+
+    def lookup(self, prompt: str, model: str, temperature: float):
+        '''
+        Returns the cached completion for this prompt, or None for a miss.
+        '''
+        key = hash_key(model, temperature, prompt)
+        return self.get_many([key]).get(key)
+
+    def store(self, prompt: str, model: str, temperature: float, completion: str):
+        self.set_many({hash_key(model, temperature, prompt): completion})
+
+class SentimentCache(DiskCache):
+    """
+    Persistent per-text sentiment store keyed by a hash of the text and the sentiment model ID
+    (see sentiment_model_id, so each backend has its own entries).
+
+    A text's sentiment never changes for a fixed model, so overlapping pulls and parameter sweeps
+    only send texts that were never scored to the model. Values are the score as a float64
+    followed by the label.
+
+    Parameters:
+        path (str): sqlite file to use. Defaults to ~/.cache/narrative_mapper/sentiments.sqlite
+        max_bytes (int): Size limit for stored results. Default is 256 MB.
+        max_entries (int): Optional entry count limit.
+    """
+    def __init__(self, path=None, max_bytes=256 * 1024**2, max_entries=None):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "sentiments.sqlite")
+        super().__init__(path, max_bytes=max_bytes, max_entries=max_entries)
+
+    def _encode(self, value) -> bytes:
+        return struct.pack("<d", float(value["score"])) + value["label"].encode("utf-8")
+
+    def _decode(self, blob):
+        return {"label": blob[8:].decode("utf-8"), "score": struct.unpack("<d", blob[:8])[0]}
+
+    def lookup(self, texts: list[str], model: str) -> list:
+        '''
+        Returns a list aligned with texts holding the cached {'label', 'score'} dict, or None for a miss.
+        '''
+        keys = [hash_key(model, text) for text in texts]
+        found = self.get_many(keys)
+        return [dict(found[key]) if key in found else None for key in keys]
+
+    def store(self, texts: list[str], model: str, results: list[dict]):
+        self.set_many({hash_key(model, text): result for text, result in zip(texts, results)})
@@ -0,0 +1,282 @@
+from .cache import hash_key
+from datetime import datetime
+import numpy as np
+import threading
+import sqlite3
+import json
+import os
+
+CHECKPOINT_FORMAT = "narrative_mapper.run"
+CHECKPOINT_VERSION = 1
+
+RUN_FILE = "run.json"
+EMBEDDING_INDEX_FILE = "embeddings.jsonl"
+EMBEDDING_DATA_FILE = "embeddings.f32"
+SUMMARIES_FILE = "summaries.jsonl"
+SENTIMENTS_FILE = "sentiments.jsonl"
+INDEX_FILE = "index.sqlite"
+
+INDEX_COLUMNS = {"embeddings": 3, "summaries": 2, "sentiments": 3}
+
+def is_run_dir(path) -> bool:
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, RUN_FILE))
+
+def _open_log(path):
+    #start on a fresh line if the last write was torn, so the next record parses
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+        if torn:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n")
+    return open(path, "a", encoding="utf-8")
+
+def _read_records_from(path, position: int):
+    #(record, end position) for every complete JSON line after position; torn lines are skipped
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        f.seek(position)
+        while True:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                return
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            yield record, f.tell()
+
+INDEX_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS logs (name TEXT PRIMARY KEY, position INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, offset INTEGER NOT NULL, dim INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, completion TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS sentiments (key TEXT PRIMARY KEY, label TEXT NOT NULL, score REAL NOT NULL)"
+)
+LOOKUP_CHUNK = 500 #stays under sqlite's host parameter limit
+
+class RunCheckpoint:
+    """
+    Append-only run directory that records completed work of one pipeline run, batch by batch,
+    so a run that fails part-way can be resumed without paying again for finished API calls.
+
+        run.json           format version, creation time and the run's config (e.g. CLI options)
+        embeddings.jsonl   one line per finished embedding batch: model, dim, offset, text hashes
+        embeddings.f32     the batches' vectors, raw float32, appended in the same order
+        summaries.jsonl    one line per finished chat completion (map or reduce call)
+        sentiments.jsonl   one line per finished sentiment batch
+        index.sqlite       lookup index over the .jsonl logs, rebuilt from them if missing
+
+    Files are only ever appended to and every record is flushed before the call returns. Vectors
+    are written before their index line, so a crash mid-batch leaves at most unindexed bytes or a
+    torn last line, which are ignored on load. Lookups are keyed like the caches: embeddings by
+    (model, cleaned text), summaries by (model, temperature, prompt) and sentiments by (model, text).
+    Keys live in index.sqlite rather than in memory, so a long (e.g. streamed) run does not hold
+    one entry per text; the index records how far into each log it has read and catches up on
+    open. Because sampling is seeded, a resumed run rebuilds the same batches and prompts and
+    only the unfinished ones go to the API. Safe to share between threads of one process.
+
+    Parameters:
+        path (str): Run directory. Created if missing; an existing run is opened and resumed.
+        config (dict): JSON-serializable settings recorded in run.json when the run is created.
+            An existing run keeps its recorded config (see self.config).
+    """
+    def __init__(self, path, config=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+        run_path = os.path.join(path, RUN_FILE)
+        if os.path.exists(run_path):
+            with open(run_path, encoding="utf-8") as f:
+                run = json.load(f)
+            if run.get("format") != CHECKPOINT_FORMAT:
+                raise ValueError(f"{path} is not a NarrativeMapper run directory.")
+            if run.get("version", 0) > CHECKPOINT_VERSION:
+                raise ValueError(f"Run directory version {run['version']} is newer than supported version {CHECKPOINT_VERSION}.")
+            self.resumed = True
+        else:
+            run = {
+                "format": CHECKPOINT_FORMAT,
+                "version": CHECKPOINT_VERSION,
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "config": config or {}
+            }
+            with open(run_path, "w", encoding="utf-8") as f:
+                json.dump(run, f, indent=2)
+            self.resumed = False
+        self.config = run.get("config", {})
+
+        self.reused = {"embeddings": 0, "summaries": 0, "sentiments": 0}
+        self._data_path = os.path.join(path, EMBEDDING_DATA_FILE)
+        self._data = None #memmap of embeddings.f32, reopened when the file has grown
+        #logs are opened (and torn last lines closed off) before the index reads them
+        self._index_file = _open_log(os.path.join(path, EMBEDDING_INDEX_FILE))
+        self._data_file = open(self._data_path, "ab")
+        torn_bytes = self._data_file.tell() % 4
+        if torn_bytes:
+            self._data_file.write(b"\x00" * (4 - torn_bytes)) #realign after a vector torn mid-write
+        self._summaries_file = _open_log(os.path.join(path, SUMMARIES_FILE))
+        self._sentiments_file = _open_log(os.path.join(path, SENTIMENTS_FILE))
+        self._db = self._open_index()
+
+    def _open_index(self):
+        db_path = os.path.join(self.path, INDEX_FILE)
+        try:
+            db = self._connect_index(db_path)
+        except sqlite3.DatabaseError:
+            #the index only mirrors the logs, so a damaged one is rebuilt from them
+            os.remove(db_path)
+            db = self._connect_index(db_path)
+        return db
+
+    def _connect_index(self, db_path):
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        db.execute("PRAGMA synchronous = OFF") #the logs are the durable record
+        for statement in INDEX_SCHEMA:
+            db.execute(statement)
+        self._catch_up(db, EMBEDDING_INDEX_FILE, "embeddings", self._embedding_rows)
+        self._catch_up(db, SUMMARIES_FILE, "summaries", lambda record: [(record["key"], record["completion"])])
+        self._catch_up(db, SENTIMENTS_FILE, "sentiments", lambda record: record["results"])
+        db.commit()
+        return db
+
+    @staticmethod
+    def _embedding_rows(record):
+        return [(key, record["offset"] + row * record["dim"], record["dim"]) for row, key in enumerate(record["keys"])]
+
+    def _catch_up(self, db, log_name, table, to_rows):
+        #indexes the records appended to a log since the index last read it
+        log_path = os.path.join(self.path, log_name)
+        found = db.execute("SELECT position FROM logs WHERE name = ?", (log_name,)).fetchone()
+        position = found[0] if found else 0
+        if position > (os.path.getsize(log_path) if os.path.exists(log_path) else 0):
+            db.execute(f"DELETE FROM {table}") #the log was replaced, so index it from the start
+            position = 0
+        placeholders = ",".join("?" * INDEX_COLUMNS[table])
+        for record, end in _read_records_from(log_path, position):
+            if record is not None:
+                db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", to_rows(record))
+            position = end
+        db.execute("INSERT OR REPLACE INTO logs (name, position) VALUES (?, ?)", (log_name, position))
+
+    def _index_rows(self, log, log_name, table, rows):
+        #caller holds the lock and has flushed the log line the rows come from
+        placeholders = ",".join("?" * INDEX_COLUMNS[table])
+        self._db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows)
+        self._db.execute("INSERT OR REPLACE INTO logs (name, position) VALUES (?, ?)", (log_name, os.fstat(log.fileno()).st_size))
+        self._db.commit()
+
+    def _select(self, table, keys) -> dict:
+        #caller holds the lock; {key: row values} for the keys found
+        unique_keys = list(dict.fromkeys(keys))
+        found = {}
+        for start in range(0, len(unique_keys), LOOKUP_CHUNK):
+            chunk = unique_keys[start:start + LOOKUP_CHUNK]
+            rows = self._db.execute(f"SELECT * FROM {table} WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            for key, *values in rows:
+                found[key] = values
+        return found
+
+    def _vectors(self):
+        #caller holds the lock
+        size = os.path.getsize(self._data_path) // 4
+        if self._data is None or len(self._data) < size:
+            self._data = np.memmap(self._data_path, dtype=np.float32, mode="r", shape=(size,)) if size else np.empty(0, dtype=np.float32)
+        return self._data
+
+    def lookup_embeddings(self, texts: list[str], model: str) -> list:
+        '''
+        Returns a list aligned with texts holding the checkpointed vector, or None if not done yet.
+        '''
+        keys = [hash_key(model, text) for text in texts]
+        with self._lock:
+            index = self._select("embeddings", keys)
+            locations = [index.get(key) for key in keys]
+            if not index:
+                return [None] * len(texts)
+            data = self._vectors()
+            found = [None if location is None else np.array(data[location[0]:location[0] + location[1]]) for location in locations]
+            self.reused["embeddings"] += sum(vector is not None for vector in found)
+        return found
+
+    def store_embeddings(self, texts: list[str], model: str, vectors):
+        '''
+        Appends one finished batch of vectors (rows aligned with texts).
+        '''
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        if not len(texts):
+            return
+        keys = [hash_key(model, text) for text in texts]
+        dim = int(vectors.shape[1])
+        with self._lock:
+            self._data_file.seek(0, os.SEEK_END)
+            offset = self._data_file.tell() // 4
+            self._data_file.write(vectors.tobytes())
+            self._data_file.flush()
+            #index line last: a batch counts as done only once its vectors are on disk
+            self._index_file.write(json.dumps({"model": model, "dim": dim, "offset": offset, "keys": keys}) + "\n")
+            self._index_file.flush()
+            self._index_rows(self._index_file, EMBEDDING_INDEX_FILE, "embeddings", [(key, offset + row * dim, dim) for row, key in enumerate(keys)])
+
+    def lookup_summary(self, prompt: str, model: str, temperature: float):
+        '''
+        Returns the checkpointed completion for this prompt, or None if not done yet.
+        '''
+        key = hash_key(model, temperature, prompt)
+        with self._lock:
+            found = self._select("summaries", [key])
+            completion = found[key][0] if key in found else None
+            if completion is not None:
+                self.reused["summaries"] += 1
+        return completion
+
+    def store_summary(self, prompt: str, model: str, temperature: float, completion: str):
+        key = hash_key(model, temperature, prompt)
+        with self._lock:
+            self._summaries_file.write(json.dumps({"key": key, "completion": completion}, ensure_ascii=False) + "\n")
+            self._summaries_file.flush()
+            self._index_rows(self._summaries_file, SUMMARIES_FILE, "summaries", [(key, completion)])
+
+    def lookup_sentiments(self, texts: list[str], model: str) -> list:
+        '''
+        Returns a list aligned with texts holding the checkpointed {'label', 'score'} dict, or None.
+        '''
+        keys = [hash_key(model, text) for text in texts]
+        with self._lock:
+            index = self._select("sentiments", keys)
+            self.reused["sentiments"] += sum(key in index for key in keys)
+        return [{"label": index[key][0], "score": index[key][1]} if key in index else None for key in keys]
+
+    def store_sentiments(self, texts: list[str], model: str, results: list[dict]):
+        '''
+        Appends one finished sentiment batch (results aligned with texts).
+        '''
+        keys = [hash_key(model, text) for text in texts]
+        rows = [[key, result["label"], float(result["score"])] for key, result in zip(keys, results)]
+        with self._lock:
+            self._sentiments_file.write(json.dumps({"model": model, "results": rows}) + "\n")
+            self._sentiments_file.flush()
+            self._index_rows(self._sentiments_file, SENTIMENTS_FILE, "sentiments", rows)
+
+    def stats(self) -> dict:
+        '''
+        Completed items on disk and how many were reused by this instance.
+        '''
+        with self._lock:
+            counts = {table: self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in INDEX_COLUMNS}
+            return {**counts, "reused": dict(self.reused)}
+
+    def close(self):
+        with self._lock:
+            for f in (self._index_file, self._data_file, self._summaries_file, self._sentiments_file):
+                f.close()
+            self._db.close()
+            self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
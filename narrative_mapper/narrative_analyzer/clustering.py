@@ -1,24 +1,24 @@
-from sklearn.metrics.pairwise import pairwise_distances, cosine_distances
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import normalize
 from .utils import progress_bars
+from .embedding_set import EmbeddingSet
+from .metrics import stage
+from concurrent.futures import ThreadPoolExecutor
 from math import sqrt, log2
-import umap.umap_ as umap
-import hdbscan
-import pandas as pd
 import numpy as np
 import warnings
+import os
 
-def get_param_calcs(df, umap_kwargs=None, hdbscan_kwargs=None, verbose=False):
+def get_param_calcs(df, umap_kwargs=None, hdbscan_kwargs=None, verbose=False, sample_size=None):
     '''
     Autocalculates some UMAP and HDBSCAN parameters based on dataset size.
 
+    When UMAP and HDBSCAN are only fit on a landmark sample, pass its size as sample_size:
+    the parameters are then scaled to the rows the models actually see.
+
     Parameters autocalculated:
         HDBSCAN: min_cluster_size, min_samples
         UMAP: n_components, n_neighbors
     '''
-    text_list = df['text'].tolist()
-    num_texts = len(text_list)
+    num_texts = len(df) if sample_size is None else min(sample_size, len(df))
     base_num_texts = 500
     N = max(1, num_texts / base_num_texts)
 
@@ -44,94 +44,298 @@ def get_param_calcs(df, umap_kwargs=None, hdbscan_kwargs=None, verbose=False):
 
     if verbose:
         print(f"[CLUSTERING PARAMS]")
-        print(f"Text count: {num_texts}")
+        print(f"Text count: {num_texts}" if sample_size is None else f"Text count: {num_texts} landmarks of {len(df)}")
         print(f"UMAP n_components: {umap_kwargs['n_components']}")
         print(f"UMAP n_neighbors: {umap_kwargs['n_neighbors']}")
         print(f"HDBSCAN min_cluster_size: {hdbscan_kwargs['min_cluster_size']}")
         print(f"HDBSCAN min_samples: {hdbscan_kwargs['min_samples']}")
 
-def merge_clusters_union_find(df, threshold=0.2, embedding_col='embeddings', cluster_col='cluster'):
+def compute_centroids(embeddings, labels, weights=None):
     '''
-    Union Find algorithm to merge alike clusters. The algorithm requires state to be held, so
-    using a class makes it cleaner.
+    Mean embedding per cluster label in one grouped pass over a contiguous float32 matrix.
+
+    Returns (ids, centroids) where ids are the sorted unique labels and centroids[i] is the
+    mean of the rows labelled ids[i], weighted by weights (e.g. duplicate counts) if given.
     '''
-    class UnionFind:
-        def __init__(self, items):
-            #each item is its own parent initially
-            self.parent = {item: item for item in items}
-        
-        def find(self, x):
-            #path compression
-            if self.parent[x] != x:
-                self.parent[x] = self.find(self.parent[x])
-            return self.parent[x]
-        
-        def union(self, x, y):
-            rootX = self.find(x)
-            rootY = self.find(y)
-            if rootX != rootY:
-                #attach one's root to the other's root
-                self.parent[rootY] = rootX
-        
-    #compute centroids
-    centroids = {}
-    for c_id in df[cluster_col].unique():
-        emb = np.vstack(df.loc[df[cluster_col] == c_id, embedding_col])
-        centroids[c_id] = emb.mean(axis=0)
-    
-    #compute pairwise distances
-    ids = list(centroids.keys())
-    vectors = [centroids[cid] for cid in ids]
-    dists = cosine_distances(vectors)
-    
-    #initialize Union-Find structure
-    uf = UnionFind(ids)
-    
-    #for each close pair, union them
-    n = len(ids)
-    for i in range(n):
-        for j in range(i+1, n):
-            if dists[i, j] < threshold:
-                uf.union(ids[i], ids[j])
-    
-    #reassign cluster IDs based on the union-find root
-    new_labels = {}
-    for c_id in ids:
-        new_labels[c_id] = uf.find(c_id)
-    
-    df[cluster_col] = [new_labels[c] for c in df[cluster_col]]
+    from scipy.sparse import csr_matrix
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    ids, inverse = np.unique(np.asarray(labels), return_inverse=True)
+    weights = np.ones(len(inverse), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+    counts = np.bincount(inverse, weights=weights, minlength=len(ids)).astype(np.float32)
+
+    #sparse (K x N) membership matrix times (N x D) embeddings sums every cluster at once
+    membership = csr_matrix(
+        (weights, (inverse, np.arange(len(inverse)))),
+        shape=(len(ids), len(inverse))
+    )
+    centroids = np.asarray(membership @ embeddings, dtype=np.float32) / counts[:, None]
+    return ids, centroids
+
+def find_merge_pairs(centroids, threshold, block_size=2048):
+    '''
+    Returns (i, j) index arrays with i < j for every centroid pair whose cosine distance is
+    below threshold. The distance matrix is computed in row blocks of block_size, so memory
+    stays at O(block_size * K) for very large K.
+    '''
+    from sklearn.preprocessing import normalize
+
+    unit = normalize(centroids, norm='l2') #cosine distance = 1 - dot product of unit vectors
+    min_similarity = 1.0 - threshold
+    rows, cols = [], []
+    for start in range(0, len(unit), block_size):
+        block = unit[start:start + block_size] @ unit.T
+        i, j = np.nonzero(block > min_similarity)
+        i += start
+        upper = j > i
+        rows.append(i[upper])
+        cols.append(j[upper])
+
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+def merge_clusters_union_find(df, threshold=0.2, embedding_col='embeddings', cluster_col='cluster', embeddings=None, block_size=2048):
+    '''
+    Merges alike clusters: any two clusters whose centroids are closer than threshold (cosine
+    distance) end up in the same group, transitively, like a union-find over all close pairs.
+
+    Centroids are computed in one grouped pass, close pairs are found by thresholding the
+    (blocked) distance matrix, and groups are the connected components of those pairs. Each
+    group takes the smallest cluster id among its members.
+
+    Parameters:
+        df (DataFrame): Clustered rows.
+        threshold (float): Cosine distance below which two clusters are merged.
+        embedding_col (str): List column to read embeddings from when embeddings is None.
+        cluster_col (str): Cluster label column.
+        embeddings (np.ndarray): Optional (len(df), dim) matrix aligned with df.
+        block_size (int): Rows of the centroid distance matrix computed at a time.
+
+    Rows are weighted by a 'weight' column (duplicate counts from collapse_duplicates) if present.
+    '''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    if embeddings is None:
+        embeddings = np.array(df[embedding_col].tolist(), dtype=np.float32)
+
+    labels = df[cluster_col].to_numpy()
+    if len(labels) == 0:
+        return df
+
+    weights = df['weight'].to_numpy() if 'weight' in df.columns else None
+    ids, centroids = compute_centroids(embeddings, labels, weights)
+    rows, cols = find_merge_pairs(centroids, threshold, block_size=block_size)
+
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(len(ids), len(ids)))
+    _, component = connected_components(graph, directed=False)
+
+    #ids are sorted, so the first member seen for each component is its smallest id
+    root = {}
+    for c_id, comp in zip(ids, component):
+        root.setdefault(comp, c_id)
+    new_labels = {c_id: root[comp] for c_id, comp in zip(ids, component)}
+
+    df[cluster_col] = df[cluster_col].map(new_labels)
     return df
 
+def select_landmarks(points, size: int, random_state=42, n_strata: int=None) -> np.ndarray:
+    '''
+    Picks about size rows of points to fit UMAP/HDBSCAN on, stratified by a quick MiniBatchKMeans
+    partition. Each stratum's quota grows with the square root of its size, so small, sparse
+    topics keep more of their rows than a uniform sample would give them. Returns sorted positions.
+    '''
+    from sklearn.cluster import MiniBatchKMeans
+
+    n = len(points)
+    if size >= n:
+        return np.arange(n)
+
+    n_strata = n_strata or min(100, max(10, size // 500))
+    strata = MiniBatchKMeans(n_clusters=n_strata, random_state=random_state, batch_size=4096, n_init=3).fit_predict(points)
+    counts = np.bincount(strata, minlength=n_strata)
+
+    share = np.sqrt(counts)
+    quotas = np.minimum(counts, np.ceil(size * share / share.sum()).astype(np.int64))
+    spare = size - quotas.sum()
+    if spare > 0:
+        #strata capped at their size leave room; hand it to the rest by remaining capacity
+        room = counts - quotas
+        quotas += np.minimum(room, np.ceil(spare * room / max(1, room.sum())).astype(np.int64))
+
+    rng = np.random.default_rng(random_state)
+    order = np.argsort(strata, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    picks = [rng.choice(order[bounds[s]:bounds[s + 1]], quotas[s], replace=False) for s in range(n_strata) if quotas[s]]
+    return np.sort(np.concatenate(picks))
+
+def assign_in_chunks(points, umap_reducer, clusterer, chunk_size: int=10000, n_jobs: int=None) -> np.ndarray:
+    '''
+    Raw HDBSCAN labels for points (already normalized/PCA-projected like the fitted rows): each
+    chunk is projected with UMAP.transform and labelled with approximate_predict, with chunks
+    running in parallel threads.
+    '''
+    import hdbscan
+
+    def assign(start):
+        reduced = umap_reducer.transform(points[start:start + chunk_size])
+        labels, _ = hdbscan.approximate_predict(clusterer, reduced)
+        return labels
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        results = list(executor.map(assign, range(0, len(points), chunk_size)))
+    return np.concatenate(results) if results else np.empty(0, dtype=np.int64)
+
+def fit_pca_kwargs(pca_kwargs: dict, n_rows: int, dim: int):
+    '''
+    pca_kwargs with an integer n_components capped at the rows PCA is fit on, or None when
+    n_components is at least the embedding dimension (PCA would keep every dimension and can be
+    skipped). Lets one default work for any embedding backend.
+    '''
+    n_components = pca_kwargs.get('n_components')
+    if isinstance(n_components, (int, np.integer)) and not isinstance(n_components, bool):
+        if n_components >= dim:
+            return None
+        if n_components > n_rows:
+            return {**pca_kwargs, 'n_components': n_rows}
+    return pca_kwargs
+
+def _preprocess(embeddings, pca=None):
+    #L2 normalization plus the optional fitted PCA, as applied before UMAP
+    from sklearn.preprocessing import normalize
+
+    reduced = normalize(np.asarray(embeddings, dtype=np.float32), norm='l2')
+    return pca.transform(reduced) if pca is not None else reduced
+
+class ClusterModel:
+    """
+    The fitted models behind one cluster_embeddings run: optional L2 normalization and PCA,
+    UMAP and HDBSCAN, plus the mapping from raw HDBSCAN labels to merged cluster ids.
+
+    Used to place new embeddings into the existing clusters without refitting.
+
+    Attributes:
+        umap_reducer: Fitted UMAP model.
+        clusterer: Fitted HDBSCAN model (fit with prediction_data=True).
+        pca: Fitted PCA model, or None if PCA was skipped.
+        normalize (bool): Whether embeddings were L2 normalized before PCA/UMAP.
+        label_map (dict): Raw HDBSCAN label -> merged cluster id.
+        noise_fraction (float): Share of the fitted rows HDBSCAN labelled as noise.
+        centroids (np.ndarray): Unit-length centroid per merged cluster, in raw embedding space.
+        outlier_distance (float): Cosine distance to their own centroid that 95% of fitted rows stay within.
+    """
+    def __init__(self, umap_reducer, clusterer, pca=None, normalize=True, label_map=None, noise_fraction=0.0, centroids=None, outlier_distance=None):
+        self.umap_reducer = umap_reducer
+        self.clusterer = clusterer
+        self.pca = pca
+        self.normalize = normalize
+        self.label_map = label_map if label_map is not None else {}
+        self.noise_fraction = noise_fraction
+        self.centroids = centroids
+        self.outlier_distance = outlier_distance
+
+    def transform(self, embeddings) -> np.ndarray:
+        '''
+        Projects raw embeddings into the fitted UMAP space using the stored transforms.
+        '''
+        from sklearn.preprocessing import normalize
+
+        reduced = np.asarray(embeddings, dtype=np.float32)
+        if self.normalize:
+            reduced = normalize(reduced, norm='l2')
+        if self.pca is not None:
+            reduced = self.pca.transform(reduced)
+        return self.umap_reducer.transform(reduced)
+
+    def predict(self, embeddings):
+        '''
+        Assigns raw embeddings to the existing (merged) clusters with HDBSCAN approximate
+        prediction. Returns (labels, strengths); noise points get label -1.
+        '''
+        import hdbscan
+
+        raw_labels, strengths = hdbscan.approximate_predict(self.clusterer, self.transform(embeddings))
+        labels = np.array([self.label_map.get(label, -1) for label in raw_labels.tolist()], dtype=np.int64)
+        return labels, strengths
+
+    def outlier_fraction(self, embeddings) -> float:
+        '''
+        Share of embeddings farther from every cluster centroid than outlier_distance. About 5% or
+        less for data like what was fitted; a larger share means new topics the map doesn't cover.
+        UMAP.transform tends to pull such points onto the fitted manifold, so this is measured in
+        the raw embedding space instead.
+        '''
+        from sklearn.preprocessing import normalize
+
+        if self.centroids is None or len(embeddings) == 0:
+            return 0.0
+        nearest = (normalize(np.asarray(embeddings, dtype=np.float32), norm='l2') @ self.centroids.T).max(axis=1)
+        return float(np.mean(1.0 - nearest > self.outlier_distance))
+
 def cluster_embeddings(
     df, 
     verbose=False,
     umap_kwargs=None,
     hdbscan_kwargs=None,
     pca_kwargs=None,
-    use_pca=True
-    ) -> pd.DataFrame:
+    use_pca=True,
+    merge_threshold=0.25,
+    return_model=False,
+    metrics=None,
+    landmark_size=None,
+    landmark_chunk_size=10000,
+    n_jobs=None
+    ):
     """
     Preprocesses using L2 normalization and PCA.
 
     Reduces dimensionality of embedding vectors using UMAP and clusters them using HDBSCAN.
 
-    Each DataFrame must include an 'embedding_vector' col. After clustering, a 'cluster' label is added
-    to each DataFrame. The function returns a DataFrame with all original cols
-    and the assigned 'cluster' label, excluding the noise cluster (cluster = -1).
+    Takes the EmbeddingSet returned by get_embeddings (or a DataFrame with an 'embeddings' list
+    column). After clustering, a 'cluster' label is added to each row. The function returns the
+    same kind of object it was given, with all original cols and the assigned 'cluster' label,
+    excluding the noise cluster (cluster = -1).
+
+    With landmark_size, large inputs are clustered from a sample: PCA is fit on a random sample,
+    UMAP and HDBSCAN on about landmark_size stratified landmark rows (see select_landmarks), and
+    all other rows are projected with UMAP.transform and labelled with HDBSCAN approximate
+    prediction in parallel chunks. Fitting then costs the same however large the input is.
 
     Parameters:
-        df (DataFrame): DataFrame with embeddings column.
+        df (EmbeddingSet or DataFrame): Embedded texts.
         verbose (bool): Shows progress timer if true.
         umap_kwargs (dict): Allows for more UMAP input parameters
         hdbscan_kwargs (dict): Allows for more HDBSCAN input parameters
         pca_kwargs (dict): Allows for more PCA input parameters
         use_pca (bool): Allows user to not use PCA and go straight to UMAP
+        merge_threshold (float): Clusters whose centroids are closer than this cosine distance are merged
+        return_model (bool): Also return the fitted ClusterModel (HDBSCAN is fit with prediction data)
+        metrics (PipelineMetrics): Records the 'pca', 'umap', 'hdbscan' and 'merge' stages if given
+            (plus 'landmarks' and 'assignment' in landmark mode).
+        landmark_size (int): Fit on this many landmark rows when the input is larger. None fits on every row.
+        landmark_chunk_size (int): Rows per UMAP.transform/approximate_predict chunk in landmark mode.
+        n_jobs (int): Threads for chunked assignment. Defaults to the CPU count.
 
     Returns:
-        DataFrame: DataFrame of clustered items with a 'cluster' column.
+        EmbeddingSet or DataFrame: Clustered items with a 'cluster' column.
+        (EmbeddingSet or DataFrame, ClusterModel) if return_model is True.
     """
     
-    embeddings = np.array(df['embeddings'].tolist(), dtype=np.float32) #convert to np.array with float32 vals for less mem usage
+    #imported lazily: scikit-learn, umap and hdbscan (numba) are slow to import
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import normalize
+    import umap.umap_ as umap
+    import hdbscan
+
+    embedding_set = None
+    if isinstance(df, EmbeddingSet):
+        embedding_set = df
+        df = embedding_set.df
+        embeddings = embedding_set.matrix #already contiguous float32, no conversion needed
+    else:
+        embeddings = np.array(df['embeddings'].tolist(), dtype=np.float32) #convert to np.array with float32 vals for less mem usage
+    raw_embeddings = embeddings #kept for centroid merging, preprocessing below makes new arrays
 
     #set base params
     if umap_kwargs == None: umap_kwargs={'min_dist': 0.0, 'random_state': 42, 'metric': 'euclidean'}
@@ -142,8 +346,20 @@ def cluster_embeddings(
     umap_metric = umap_kwargs.get('metric', 'euclidean') #since UMAP default sets euclidean
     hdbscan_metric = hdbscan_kwargs.get('metric', 'euclidean') #since HDBSCAN default sets euclidean
 
+    use_landmarks = landmark_size is not None and len(embeddings) > landmark_size
+    random_state = umap_kwargs.get('random_state', 42)
+
+    #PCA adapts to the embedding dimension of whatever backend produced the vectors
+    if use_pca:
+        pca_kwargs = fit_pca_kwargs(pca_kwargs, landmark_size if use_landmarks else len(embeddings), embeddings.shape[1])
+        use_pca = pca_kwargs is not None
+
     #autocalculate some import UMAP and HDBSCAN parameters
-    get_param_calcs(df, umap_kwargs=umap_kwargs, hdbscan_kwargs=hdbscan_kwargs, verbose=verbose)
+    get_param_calcs(df, umap_kwargs=umap_kwargs, hdbscan_kwargs=hdbscan_kwargs, verbose=verbose, sample_size=landmark_size if use_landmarks else None)
+
+    if return_model or use_landmarks:
+        hdbscan_kwargs.setdefault('prediction_data', True) #needed for approximate_predict on new points
+    pca = None
 
     #'rich' progress bar
     progress_context = progress_bars(verbose, bars=False)
@@ -158,47 +374,124 @@ def cluster_embeddings(
         if umap_metric != hdbscan_metric:
             raise ValueError("UMAP and HDBSCAN must use the same distance metric.")
 
-        if hdbscan_metric != 'euclidean': #PCA and L2 are preprocessing steps for euclidean
+        use_l2 = hdbscan_metric == 'euclidean'
+        if not use_l2: #PCA and L2 are preprocessing steps for euclidean
             warnings.warn(f"PCA and L2 Normalization not supported for metric '{hdbscan_kwargs['metric']}'. Skipping both.")
         
-        else:
-            embeddings = normalize(embeddings, norm='l2') #since both UMAP + HDBSCAN are setup for euclidean
-            if use_pca:
+        elif use_landmarks:
+            #fit PCA on a sample, then normalize and project chunk by chunk (no full-size normalized copy)
+            with stage(metrics, "pca", rows_in=len(embeddings)) as record:
                 try:
-                    pca = PCA(**pca_kwargs)
-                    embeddings = pca.fit_transform(embeddings) #returns float32 when float32 is input
+                    if use_pca:
+                        fit_rows = np.sort(np.random.default_rng(random_state).choice(len(embeddings), landmark_size, replace=False))
+                        pca = PCA(**pca_kwargs).fit(normalize(embeddings[fit_rows], norm='l2'))
+                    embeddings = np.concatenate([
+                        _preprocess(embeddings[start:start + landmark_chunk_size], pca)
+                        for start in range(0, len(embeddings), landmark_chunk_size)
+                    ])
 
                 except Exception as e:
                     raise RuntimeError(f"Error during PCA") from e
+                record["rows_out"] = len(embeddings)
+
+        else:
+            embeddings = normalize(embeddings, norm='l2') #since both UMAP + HDBSCAN are setup for euclidean
+            if use_pca:
+                with stage(metrics, "pca", rows_in=len(embeddings)) as record:
+                    try:
+                        pca = PCA(**pca_kwargs)
+                        embeddings = pca.fit_transform(embeddings) #returns float32 when float32 is input
+
+                    except Exception as e:
+                        raise RuntimeError(f"Error during PCA") from e
+                    record["rows_out"] = len(embeddings)
+
+        landmarks = None
+        fit_embeddings = embeddings
+        if use_landmarks:
+            with stage(metrics, "landmarks", rows_in=len(embeddings)) as record:
+                landmarks = select_landmarks(embeddings, landmark_size, random_state=random_state)
+                fit_embeddings = embeddings[landmarks]
+                record["rows_out"] = len(landmarks)
 
         #UMAP dimensionality:
-        try:
-            warnings.filterwarnings("ignore", message=".*n_jobs value 1 overridden.*")
-            umap_reducer = umap.UMAP(
-                **umap_kwargs       
-            )
-            embeddings = umap_reducer.fit_transform(embeddings)
+        with stage(metrics, "umap", rows_in=len(fit_embeddings)) as record:
+            try:
+                warnings.filterwarnings("ignore", message=".*n_jobs value 1 overridden.*")
+                umap_reducer = umap.UMAP(
+                    **umap_kwargs       
+                )
+                reduced = umap_reducer.fit_transform(fit_embeddings)
 
-        except Exception as e:
-            raise RuntimeError(f"Error during UMAP") from e
+            except Exception as e:
+                raise RuntimeError(f"Error during UMAP") from e
+            record["rows_out"] = len(reduced)
 
         #HDBSCAN clustering:
-        try:
-            clusterer = hdbscan.HDBSCAN(
-                **hdbscan_kwargs
-            )
-            cluster_labels = clusterer.fit_predict(embeddings)
+        with stage(metrics, "hdbscan", rows_in=len(reduced)) as record:
+            try:
+                clusterer = hdbscan.HDBSCAN(
+                    **hdbscan_kwargs
+                )
+                cluster_labels = clusterer.fit_predict(reduced)
+
+            except Exception as e:
+                raise RuntimeError(f"Error during HDBSCAN") from e
+            record["rows_out"] = int((cluster_labels != -1).sum()) #noise rows are dropped
 
-        except Exception as e:
-            raise RuntimeError(f"Error during HDBSCAN") from e
+        if use_landmarks:
+            #project and label every non-landmark row with the fitted models
+            with stage(metrics, "assignment", rows_in=len(embeddings) - len(landmarks)) as record:
+                rest = np.setdiff1d(np.arange(len(embeddings)), landmarks, assume_unique=True)
+                fit_labels = cluster_labels
+                cluster_labels = np.empty(len(embeddings), dtype=fit_labels.dtype)
+                cluster_labels[landmarks] = fit_labels
+                try:
+                    cluster_labels[rest] = assign_in_chunks(embeddings[rest], umap_reducer, clusterer, chunk_size=landmark_chunk_size, n_jobs=n_jobs)
+
+                except Exception as e:
+                    raise RuntimeError(f"Error during landmark assignment") from e
+                record["rows_out"] = int((cluster_labels[rest] != -1).sum())
 
         if verbose:
             progress.update(task, advance=1)
 
     df = df.copy() #may not need this
     df['cluster'] = cluster_labels.tolist()
-    df = df[df['cluster'] != -1] #drop noise cluster
+    keep = cluster_labels != -1
+    df = df[keep] #drop noise cluster
 
-    merged_df = merge_clusters_union_find(df, threshold=0.25)  #similarity cutoff 
-    
-    return merged_df
\ No newline at end of file
+    kept_embeddings = raw_embeddings[keep]
+    raw_kept_labels = cluster_labels[keep]
+    with stage(metrics, "merge", rows_in=len(df)) as record:
+        merged_df = merge_clusters_union_find(df, threshold=merge_threshold, embeddings=kept_embeddings)  #similarity cutoff 
+        record["rows_out"] = len(merged_df)
+        record["clusters"] = int(merged_df['cluster'].nunique())
+
+    result = merged_df
+    if embedding_set is not None:
+        result = EmbeddingSet(merged_df, kept_embeddings, model=embedding_set.model)
+
+    if return_model:
+        from sklearn.preprocessing import normalize
+
+        centroids, member_distances = None, [] #everything was noise: no clusters to measure against
+        if len(merged_df):
+            weights = merged_df['weight'].to_numpy() if 'weight' in merged_df.columns else None
+            ids, centroids = compute_centroids(kept_embeddings, merged_df['cluster'].to_numpy(), weights)
+            centroids = normalize(centroids, norm='l2')
+            own = np.searchsorted(ids, merged_df['cluster'].to_numpy())
+            member_distances = 1.0 - np.einsum('ij,ij->i', normalize(kept_embeddings, norm='l2'), centroids[own])
+
+        model = ClusterModel(
+            umap_reducer,
+            clusterer,
+            pca=pca,
+            normalize=use_l2,
+            label_map=dict(zip(raw_kept_labels.tolist(), merged_df['cluster'].tolist())),
+            noise_fraction=float(1 - keep.mean()) if len(keep) else 0.0,
+            centroids=centroids,
+            outlier_distance=float(np.quantile(member_distances, 0.95)) if len(member_distances) else None
+        )
+        return result, model
+    return result
\ No newline at end of file
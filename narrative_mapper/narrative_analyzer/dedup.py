@@ -0,0 +1,198 @@
+from .embeddings import clean_texts
+from .embedding_set import EmbeddingSet
+import pandas as pd
+import numpy as np
+
+MINHASH_PRIME = 4294967291 #largest prime below 2**32, so (a*h + b) fits in uint64
+
+def _shingle_hashes(texts: list[str], shingle_size: int):
+    '''
+    Polynomial hashes of every character shingle of every text, computed on one concatenated
+    array. Returns (hashes, starts) where the shingles of text i are hashes[starts[i]:starts[i+1]].
+    Texts shorter than shingle_size are padded, so each text has at least one shingle.
+    '''
+    padded = [text.ljust(shingle_size, "\0") for text in texts]
+    codes = np.frombuffer("".join(padded).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    lengths = np.fromiter((len(text) for text in padded), dtype=np.int64, count=len(padded))
+    text_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    #rolling hash of each window of shingle_size characters over the whole array
+    hashes = np.zeros(len(codes) - shingle_size + 1, dtype=np.uint64)
+    for offset in range(shingle_size):
+        hashes = (hashes * np.uint64(1000003) + codes[offset:len(codes) - shingle_size + 1 + offset]) & np.uint64(0xFFFFFFFF)
+
+    #keep only windows that lie inside one text
+    num_windows = lengths - shingle_size + 1
+    keep = np.concatenate([np.arange(start, start + count) for start, count in zip(text_starts, num_windows)])
+    starts = np.concatenate([[0], np.cumsum(num_windows)[:-1]])
+    return hashes[keep], starts
+
+def minhash_signatures(texts: list[str], num_perm: int=128, shingle_size: int=5, seed: int=42, chunk_size: int=20000) -> np.ndarray:
+    '''
+    MinHash signature of each text's character shingles, as a (len(texts), num_perm) uint32 matrix.
+    The fraction of equal entries between two rows estimates the Jaccard similarity of the texts.
+    '''
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), chunk_size):
+        hashes, starts = _shingle_hashes(texts[start:start + chunk_size], shingle_size)
+        for p in range(num_perm):
+            permuted = (a[p] * hashes + b[p]) % np.uint64(MINHASH_PRIME)
+            signatures[start:start + len(starts), p] = np.minimum.reduceat(permuted, starts)
+    return signatures
+
+def _lsh_bands(num_perm: int, threshold: float) -> int:
+    #number of bands whose S-curve midpoint (1/bands)**(bands/num_perm) is closest to threshold
+    options = [bands for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda bands: abs((1 / bands) ** (bands / num_perm) - threshold))
+
+def near_duplicate_groups(texts: list[str], threshold: float=0.8, num_perm: int=128, shingle_size: int=5, seed: int=42) -> np.ndarray:
+    '''
+    Groups texts whose estimated Jaccard similarity (MinHash over character shingles) is at least
+    threshold, transitively. Candidates come from LSH banding and are kept only if their
+    signatures agree on at least threshold of the permutations.
+
+    Returns:
+        np.ndarray: Group label of each text. Labels are the position of the group's first text.
+    '''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n = len(texts)
+    if n < 2:
+        return np.arange(n)
+
+    signatures = minhash_signatures(texts, num_perm=num_perm, shingle_size=shingle_size, seed=seed)
+    bands = _lsh_bands(num_perm, threshold)
+    rows_per_band = num_perm // bands
+
+    edge_rows, edge_cols = [], []
+    for band in range(bands):
+        band_keys = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        band_keys = band_keys.view(np.dtype((np.void, band_keys.dtype.itemsize * rows_per_band))).ravel()
+        _, first, bucket = np.unique(band_keys, return_index=True, return_inverse=True)
+
+        #link each text to the first text in its bucket, if their signatures really are similar
+        representative = first[bucket.ravel()]
+        candidates = np.flatnonzero(representative != np.arange(n))
+        if not len(candidates):
+            continue
+        agreement = (signatures[candidates] == signatures[representative[candidates]]).mean(axis=1)
+        similar = agreement >= threshold
+        edge_rows.append(candidates[similar])
+        edge_cols.append(representative[candidates[similar]])
+
+    if not edge_rows:
+        return np.arange(n)
+    rows, cols = np.concatenate(edge_rows), np.concatenate(edge_cols)
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+
+    #label each group by its first member, like the exact groups
+    first_member = np.full(component.max() + 1, n)
+    np.minimum.at(first_member, component, np.arange(n))
+    return first_member[component]
+
+def collapse_duplicates(df, near_duplicates=False, threshold: float=0.8, num_perm: int=128, shingle_size: int=5, existing=None):
+    """
+    Collapses repeated texts into one row each, before embedding.
+
+    Exact duplicates are texts that are identical after clean_texts. With near_duplicates=True,
+    texts whose character shingles have an estimated Jaccard similarity of at least threshold
+    (MinHash/LSH) are grouped as well. Each group keeps its first row and gets a 'weight' column
+    with the number of rows it stands for (the sum of an existing 'weight' column, if any), so
+    centroid merging, summary sampling, sentiment votes and formatter counts still reflect every
+    original row. A 'dedup_id' column numbers the kept rows.
+
+    Parameters:
+        df (DataFrame or EmbeddingSet): Rows with a 'text' column.
+        near_duplicates (bool): Also group near-duplicate texts.
+        threshold (float): Jaccard similarity at which two texts count as near-duplicates.
+        num_perm (int): MinHash permutations. More is more accurate and slower.
+        shingle_size (int): Characters per shingle.
+        existing (DataFrame or EmbeddingSet): Rows kept by an earlier call (with 'text' and
+            'dedup_id'), e.g. when adding texts to a map. Rows of df that duplicate one of them
+            get its dedup_id and no row of their own; new groups are numbered after the largest
+            existing dedup_id. Existing groups are never merged with each other.
+
+    Returns:
+        (DataFrame, np.ndarray): the collapsed rows, and the dedup_id of every original row
+        (use expand_duplicates to fan results back out).
+    """
+    if isinstance(df, EmbeddingSet):
+        df = df.df
+    if isinstance(existing, EmbeddingSet):
+        existing = existing.df
+    if 'text' not in df.columns:
+        raise ValueError("Input DataFrame must contain a 'text' column.")
+
+    #existing rows go first, so a group that contains one is represented by it
+    texts = df['text'].astype(str).tolist()
+    num_existing = 0 if existing is None else len(existing)
+    if num_existing:
+        texts = existing['text'].astype(str).tolist() + texts
+
+    cleaned = [text.strip() for text in clean_texts(texts)]
+    exact, _ = pd.factorize(pd.Series(cleaned), sort=False) #exact group ids in order of first appearance
+    groups = exact
+
+    if near_duplicates:
+        first_rows = np.unique(exact, return_index=True)[1]
+        near = near_duplicate_groups([cleaned[i] for i in first_rows], threshold=threshold, num_perm=num_perm, shingle_size=shingle_size)
+        groups = pd.factorize(near[exact], sort=False)[0]
+
+    if num_existing:
+        first_member = np.full(groups.max() + 1, len(groups))
+        np.minimum.at(first_member, groups, np.arange(len(groups)))
+        new_first = first_member[groups[num_existing:]]
+        matched = new_first < num_existing
+        #new groups keep their order of first appearance, numbered after the existing ids
+        new_ids, new_groups = np.unique(new_first[~matched], return_inverse=True)
+        next_id = int(existing['dedup_id'].max()) + 1
+        groups = np.empty(len(df), dtype=np.int64)
+        groups[matched] = existing['dedup_id'].to_numpy()[new_first[matched]]
+        groups[~matched] = next_id + new_groups.ravel()
+        representatives = new_ids - num_existing
+        weight_groups = new_groups.ravel()
+        rows = ~matched
+    else:
+        _, representatives = np.unique(groups, return_index=True)
+        weight_groups = groups
+        rows = slice(None)
+        next_id = 0
+
+    if 'weight' in df.columns:
+        weights = np.bincount(weight_groups, weights=df['weight'].to_numpy(dtype=np.float64)[rows], minlength=len(representatives))
+    else:
+        weights = np.bincount(weight_groups, minlength=len(representatives))
+
+    collapsed = df.iloc[representatives].reset_index(drop=True)
+    collapsed['weight'] = weights
+    collapsed['dedup_id'] = next_id + np.arange(len(collapsed))
+    return collapsed, groups
+
+def expand_duplicates(result, original_df, groups, columns=('cluster',)) -> pd.DataFrame:
+    '''
+    Fans per-unique-text results back out to every original row.
+
+    Parameters:
+        result (DataFrame or EmbeddingSet): Rows with a 'dedup_id' column, e.g. cluster_embeddings output.
+        original_df (DataFrame): The DataFrame that was passed to collapse_duplicates.
+        groups (np.ndarray): dedup_id of every original row, as returned by collapse_duplicates.
+        columns (list[str]): Columns of result to copy onto the original rows.
+
+    Returns:
+        DataFrame: original_df with the given columns added. Rows whose text is missing from
+        result (e.g. dropped as noise) get NaN.
+    '''
+    if isinstance(result, EmbeddingSet):
+        result = result.df
+    lookup = result.set_index('dedup_id')[list(columns)].reindex(groups)
+
+    expanded = original_df.reset_index(drop=True).copy()
+    for col in columns:
+        expanded[col] = lookup[col].to_numpy()
+    return expanded
@@ -0,0 +1,212 @@
+from .utils import get_openai_client, get_openai_scheduler, batch_list
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import threading
+import base64
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+def embed_batch(client, batch: list[str], metrics=None, model: str=EMBEDDING_MODEL) -> np.ndarray:
+    '''
+    Embeds one batch and returns a (len(batch), dim) float32 matrix. Vectors are requested as
+    base64 and decoded straight into float32, so no Python float lists are built.
+    '''
+    response = client.embeddings.create(
+        input=batch,
+        model=model,
+        encoding_format="base64"
+    )
+    if metrics is not None:
+        metrics.record_usage(response)
+    rows = []
+    for item in response.data:
+        if isinstance(item.embedding, str):
+            rows.append(np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32))
+        else: #endpoints that ignore encoding_format return floats
+            rows.append(np.asarray(item.embedding, dtype=np.float32))
+    return np.vstack(rows)
+
+def embed_batches(client, batches: list[list[str]], max_concurrency=1, on_batch_done=None, metrics=None, model: str=EMBEDDING_MODEL, on_batch_result=None, batch_texts=None) -> np.ndarray:
+    '''
+    Embeds every batch and returns one float32 matrix with rows in batch order.
+
+    With max_concurrency > 1, up to that many requests are in flight at once on a bounded
+    thread pool. Batches that fail are collected and retried one at a time once the pool
+    has drained, so a single bad request does not throw away the rest of the run.
+    on_batch_done(batch_len) and on_batch_result(batch, vectors) are always called from the
+    calling thread, once per finished batch. batch_texts, aligned with batches, replaces the texts
+    passed to on_batch_result (e.g. the originals of texts that were truncated before sending).
+    '''
+    results = [None] * len(batches)
+    failed = []
+    if batch_texts is None:
+        batch_texts = batches
+
+    def finished(i):
+        if on_batch_result:
+            on_batch_result(batch_texts[i], results[i])
+        if on_batch_done:
+            on_batch_done(len(batches[i]))
+
+    if max_concurrency <= 1:
+        for i, batch in enumerate(batches):
+            try:
+                results[i] = embed_batch(client, batch, metrics, model)
+            except Exception:
+                failed.append(i)
+                continue
+            finished(i)
+    else:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {executor.submit(embed_batch, client, batch, metrics, model): i for i, batch in enumerate(batches)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception:
+                    failed.append(i)
+                    continue
+                finished(i)
+
+    for i in sorted(failed):
+        results[i] = embed_batch(client, batches[i], metrics, model) #second failure is raised to the caller
+        finished(i)
+
+    return np.vstack(results)
+
+class Embedder:
+    """
+    Turns cleaned texts into vectors for get_embeddings.
+
+    Subclasses set model, a name that identifies the vector space (embedding caches and artifacts
+    are keyed and checked by it), and implement embed. Vectors can have any dimension; the rest
+    of the pipeline adapts to it.
+    """
+    model = None
+
+    def embed(self, texts: list[str], max_concurrency: int=1, on_batch_done=None, metrics=None, on_batch_result=None) -> np.ndarray:
+        '''
+        Returns a (len(texts), dim) float32 matrix, rows in text order. on_batch_done(batch_len) and
+        on_batch_result(batch_texts, batch_vectors) are called from the calling thread as batches
+        finish; the latter lets get_embeddings checkpoint finished batches of a long run.
+        '''
+        raise NotImplementedError
+
+class OpenAIEmbedder(Embedder):
+    """
+    OpenAI embeddings API backend (the default). Texts are packed into requests of up to max_tokens
+    tokens; a single text over the limit is truncated. max_concurrency requests are sent at once.
+    With a tpm limit set (set_openai_rate_limit), requests are made smaller to suit the budget,
+    while texts are still only truncated at max_tokens.
+
+    Parameters:
+        model (str): OpenAI embedding model.
+        max_tokens (int): Token budget per request.
+    """
+    def __init__(self, model: str=EMBEDDING_MODEL, max_tokens: int=8000):
+        self.model = model
+        self.max_tokens = max_tokens
+
+    def embed(self, texts: list[str], max_concurrency: int=1, on_batch_done=None, metrics=None, on_batch_result=None) -> np.ndarray:
+        #one vector per text, so a single text over the limit is truncated rather than split
+        batch_tokens = get_openai_scheduler().batch_tokens(self.max_tokens)
+        batches = batch_list(texts, model=self.model, max_tokens=batch_tokens, oversized="truncate", max_text_tokens=self.max_tokens) #used to send multiple requests to bypass token limit. This works because the vector space is the same each call.
+        #truncation keeps one text per input in order, so batches map back onto consecutive slices of texts
+        originals, start = [], 0
+        for batch in batches:
+            originals.append(texts[start:start + len(batch)])
+            start += len(batch)
+        return embed_batches(get_openai_client(), batches, max_concurrency=max_concurrency, on_batch_done=on_batch_done, metrics=metrics, model=self.model, on_batch_result=on_batch_result, batch_texts=originals)
+
+class LocalEmbedder(Embedder):
+    """
+    Local sentence-transformers backend, for machines without API access. Runs on CPU by default,
+    with PyTorch or an ONNX Runtime export of the model.
+
+    Texts are sorted by length and cut into batches of batch_size, so each forward pass pads to a
+    similar length, and the vectors are put back in the original order. The model is loaded on
+    first use and shared by every call on this instance.
+
+    Parameters:
+        model_name (str): sentence-transformers model name or local path.
+        backend (str): 'torch' or 'onnx' (needs sentence-transformers[onnx]).
+        batch_size (int): Texts per forward pass.
+        num_threads (int): CPU threads for inference. None keeps the library default.
+        device (str): Torch device, 'cpu' by default.
+        normalize (bool): L2-normalize the vectors.
+    """
+    def __init__(self, model_name: str=LOCAL_EMBEDDING_MODEL, backend: str="torch", batch_size: int=64, num_threads: int=None, device: str="cpu", normalize=True):
+        if backend not in ("torch", "onnx"):
+            raise ValueError(f"backend must be 'torch' or 'onnx', got {backend!r}.")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.device = device
+        self.normalize = normalize
+        self.model = model_name if backend == "torch" else f"{model_name}:onnx" #ONNX vectors differ slightly, so they are cached apart
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''
+        Returns the sentence-transformers model, loading it on first use.
+        '''
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                    except ImportError as e:
+                        raise ImportError("LocalEmbedder needs sentence-transformers: pip install 'NarrativeMapper[local]'") from e
+
+                    model_kwargs = None
+                    if self.backend == "onnx":
+                        import onnxruntime
+
+                        options = onnxruntime.SessionOptions()
+                        if self.num_threads:
+                            options.intra_op_num_threads = self.num_threads
+                        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+                    elif self.num_threads:
+                        import torch
+                        torch.set_num_threads(self.num_threads)
+
+                    self._model = SentenceTransformer(self.model_name, device=self.device, backend=self.backend, model_kwargs=model_kwargs)
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        return self.load().get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str], max_concurrency: int=1, on_batch_done=None, metrics=None, on_batch_result=None) -> np.ndarray:
+        model = self.load()
+        order = np.argsort([len(text) for text in texts], kind="stable") #length buckets: little padding per batch
+        matrix = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            matrix[idx] = model.encode(
+                [texts[i] for i in idx],
+                batch_size=len(idx),
+                convert_to_numpy=True,
+                normalize_embeddings=self.normalize,
+                show_progress_bar=False
+            )
+            if on_batch_result:
+                on_batch_result([texts[i] for i in idx], matrix[idx])
+            if on_batch_done:
+                on_batch_done(len(idx))
+        return matrix
+
+def get_embedder(backend: str="openai", model: str=None, **kwargs) -> Embedder:
+    '''
+    Embedder by backend name: 'openai', 'local' (sentence-transformers on PyTorch) or 'onnx'
+    (sentence-transformers on ONNX Runtime). model overrides the backend's default model; other
+    keyword arguments go to the embedder.
+    '''
+    if backend == "openai":
+        return OpenAIEmbedder(model or EMBEDDING_MODEL, **kwargs)
+    if backend in ("local", "onnx"):
+        return LocalEmbedder(model or LOCAL_EMBEDDING_MODEL, backend="torch" if backend == "local" else "onnx", **kwargs)
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected 'openai', 'local' or 'onnx'.")
@@ -0,0 +1,76 @@
+import pandas as pd
+import numpy as np
+
+class EmbeddingSet:
+    """
+    Texts and their embeddings, carried as one contiguous float32 matrix.
+
+    Row i of matrix is the embedding of row i of df. This is what get_embeddings returns and what
+    cluster_embeddings passes along, so the pipeline never holds a Python list per row. Use
+    to_frame() when the old 'embeddings' list column is needed.
+
+    Attributes:
+        df (DataFrame): Text and metadata columns (no 'embeddings' column).
+        matrix (np.ndarray): (len(df), dim) float32 matrix. May be a np.memmap.
+        model (str): Name of the embedding model that produced the matrix.
+    """
+    def __init__(self, df: pd.DataFrame, matrix, model: str=None):
+        if not isinstance(matrix, np.memmap):
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("Embedding matrix must be 2-dimensional.")
+        if len(df) != matrix.shape[0]:
+            raise ValueError(f"DataFrame has {len(df)} rows but embedding matrix has {matrix.shape[0]}.")
+
+        self.df = df
+        self.matrix = matrix
+        self.model = model
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def __len__(self):
+        return len(self.df)
+
+    def __repr__(self):
+        return f"EmbeddingSet(rows={len(self)}, dim={self.dim}, model={self.model!r})"
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, embedding_col: str='embeddings', model: str=None) -> "EmbeddingSet":
+        '''
+        Builds an EmbeddingSet from a DataFrame with a list-per-row embeddings column.
+        '''
+        if embedding_col not in df.columns:
+            raise ValueError(f"Input DataFrame must contain a '{embedding_col}' column.")
+        matrix = np.array(df[embedding_col].tolist(), dtype=np.float32)
+        return cls(df.drop(columns=[embedding_col]), matrix, model=model)
+
+    @classmethod
+    def concat(cls, embedding_sets: list) -> "EmbeddingSet":
+        '''
+        Stacks EmbeddingSets row-wise. All sets must share the same dimension.
+        '''
+        dims = {es.dim for es in embedding_sets}
+        if len(dims) != 1:
+            raise ValueError(f"Cannot concatenate embeddings of different dimensions: {sorted(dims)}")
+        df = pd.concat([es.df for es in embedding_sets], ignore_index=True)
+        matrix = np.concatenate([es.matrix for es in embedding_sets], axis=0)
+        return cls(df, matrix, model=embedding_sets[0].model)
+
+    def to_frame(self, embedding_col: str='embeddings') -> pd.DataFrame:
+        '''
+        Compatibility view: a copy of df with embeddings as a list-per-row column.
+        '''
+        df = self.df.copy()
+        df[embedding_col] = self.matrix.tolist()
+        return df
+
+    def subset(self, rows) -> "EmbeddingSet":
+        '''
+        Returns a new EmbeddingSet with the selected rows (boolean mask or positions).
+        '''
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        return EmbeddingSet(self.df.iloc[rows], self.matrix[rows], model=self.model)
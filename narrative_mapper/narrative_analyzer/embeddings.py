@@ -1,7 +1,10 @@
-from openai import OpenAI
-from openai._exceptions import OpenAIError
-from .utils import get_openai_key, batch_list, progress_bars
-import pandas as pd
+from .utils import progress_bars
+from .cache import EmbeddingCache
+from .checkpoint import RunCheckpoint
+from .embedding_set import EmbeddingSet
+from .embedders import OpenAIEmbedder
+from .metrics import stage
+import numpy as np
 import re
 
 def clean_texts(text_list: list[str]):
@@ -11,55 +14,132 @@ def clean_texts(text_list: list[str]):
         for text in text_list
     ]
 
-def get_embeddings(df, verbose=False) -> pd.DataFrame:
+def get_embeddings(df, verbose=False, cache=None, max_concurrency=1, list_column=False, metrics=None, embedder=None, checkpoint=None) -> EmbeddingSet:
     """
-    Generates OpenAI text embeddings.
+    Generates text embeddings (OpenAI by default, or any Embedder).
 
     The input DataFrame must contain 'text' column. The function sends
-    each 'text' value to the OpenAI embedding API in batches and then adds a new 'embeddings' 
-    column to output DataFrame containing the 1536-dimensional semantic embedding.
+    each 'text' value to the OpenAI embedding API in batches and returns an EmbeddingSet: the
+    original rows plus one contiguous (rows x dim) float32 matrix of semantic embeddings
+    (1536 dims for the default model). With embedder, e.g. a LocalEmbedder, texts are embedded by
+    that backend instead and dim is whatever it produces.
+    With list_column=True the older DataFrame with an 'embeddings' list column is returned instead.
+
+    Batches can be sent concurrently with max_concurrency; results always line up with
+    df['text']. The client honours the OPENAI_BASE_URL environment variable, so the function
+    can be pointed at a local OpenAI-compatible endpoint.
+
+    Texts that are identical after cleaning are embedded once and share the vector. When a
+    cache is given, texts are looked up by a hash of their cleaned content and the
+    model name first. Only texts the cache has never seen are sent to the API, and their
+    embeddings are written back to the cache (as are embeddings restored from a checkpoint).
+
+    With a checkpoint (RunCheckpoint), every finished request batch is appended to the run
+    directory as soon as it arrives. Rerunning with the same checkpoint after a failure reuses
+    those batches and only embeds the texts that were not done yet. Custom embedders must accept
+    on_batch_result for this (see Embedder.embed).
 
     Parameters:
         DataFrame: Must include 'text' column
         verbose (bool): Shows progress bar and timer if True.
+        cache (EmbeddingCache or str): Optional embedding cache, or a path to its sqlite file.
+        max_concurrency (int): Max embedding requests in flight at once. Default is 1 (sequential).
+        list_column (bool): Return a DataFrame with an 'embeddings' list column (compatibility view).
+        metrics (PipelineMetrics): Records the 'embedding' stage if given.
+        embedder (Embedder): Embedding backend. Defaults to OpenAIEmbedder().
+        checkpoint (RunCheckpoint or str): Run directory to checkpoint batches to and resume from.
 
     Returns:
-        DataFrame: contains origin columns in file_name, but with the added 'embeddings' column
+        EmbeddingSet: original rows (.df) and their float32 embedding matrix (.matrix), or a
+        DataFrame with the added 'embeddings' column if list_column is True.
     """
     if 'text' not in df.columns:
         raise ValueError("Input DataFrame must contain a 'text' column.")
 
-    try:
-        client = OpenAI(api_key=get_openai_key())
-        df = df.copy()
-        text_list = df['text'].tolist()
-
-        if not text_list:
-            raise RuntimeError("The 'text' column is empty.")
-
-        embeddings_list = []
-        batches = batch_list(text_list, model="text-embedding-3-small", max_tokens=8000) #used to send multiple requests to bypass token limit. This works because the vector space is the same each call.
-
-        progress_context = progress_bars(verbose, bars=True)
-        with progress_context as progress:
-            if verbose:
-                task = progress.add_task("[cyan]Embedding texts...", total=len(text_list))
-            for batch in batches:
-                batch = clean_texts(batch) #clean text input
-                response = client.embeddings.create(
-                    input=batch,
-                    model="text-embedding-3-small"
-                )
-                for item in response.data:
-                    embeddings_list.append(item.embedding)
-                if verbose:
-                    progress.update(task, advance=len(batch))
-        
-        df['embeddings'] = embeddings_list
-        return df
-
-    except OpenAIError as e:
-        raise RuntimeError(f"OpenAI request failed") from e
-
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error during embedding generation") from e
\ No newline at end of file
+    if isinstance(cache, str):
+        cache = EmbeddingCache(cache)
+    if isinstance(checkpoint, str):
+        checkpoint = RunCheckpoint(checkpoint)
+    if embedder is None:
+        embedder = OpenAIEmbedder()
+
+    from openai import OpenAIError #imported lazily to keep package import cheap
+
+    with stage(metrics, "embedding", rows_in=len(df)) as record:
+        try:
+            text_list = df['text'].tolist()
+
+            if not text_list:
+                raise RuntimeError("The 'text' column is empty.")
+
+            cleaned_texts = clean_texts(text_list) #clean text input
+            cached = [None] * len(cleaned_texts)
+
+            if cache is not None:
+                cached = cache.lookup(cleaned_texts, embedder.model)
+
+            missing_idx = [i for i, vector in enumerate(cached) if vector is None]
+            new_embeddings = None
+            if cache is not None:
+                record["cache_hits"] = len(text_list) - len(missing_idx)
+                record["cache_misses"] = len(missing_idx)
+
+            if checkpoint is not None and missing_idx:
+                #batches finished by an earlier, interrupted run
+                done = checkpoint.lookup_embeddings([cleaned_texts[i] for i in missing_idx], embedder.model)
+                for i, vector in zip(missing_idx, done):
+                    cached[i] = vector
+                record["checkpoint_hits"] = sum(vector is not None for vector in done)
+                if cache is not None and record["checkpoint_hits"]:
+                    restored = [i for i, vector in zip(missing_idx, done) if vector is not None]
+                    cache.store([cleaned_texts[i] for i in restored], embedder.model, [cached[i] for i in restored])
+                missing_idx = [i for i, vector in enumerate(cached) if vector is None]
+
+            if verbose and cache is not None:
+                print(f"[EMBEDDING CACHE]")
+                print(f"Hits: {record['cache_hits']}")
+                print(f"Misses: {record['cache_misses']}")
+
+            if verbose and checkpoint is not None:
+                print(f"[CHECKPOINT]")
+                print(f"Embeddings reused: {record.get('checkpoint_hits', 0)}")
+
+            if missing_idx:
+                missing_texts = [cleaned_texts[i] for i in missing_idx]
+                unique_texts = list(dict.fromkeys(missing_texts)) #repeated texts are embedded once
+
+                progress_context = progress_bars(verbose, bars=True)
+                with progress_context as progress:
+                    on_batch_done = None
+                    if verbose:
+                        task = progress.add_task("[cyan]Embedding texts...", total=len(unique_texts))
+                        on_batch_done = lambda batch_len: progress.update(task, advance=batch_len)
+                    embed_kwargs = {}
+                    if checkpoint is not None:
+                        embed_kwargs["on_batch_result"] = lambda batch, vectors: checkpoint.store_embeddings(batch, embedder.model, vectors)
+                    unique_embeddings = embedder.embed(unique_texts, max_concurrency=max_concurrency, on_batch_done=on_batch_done, metrics=metrics, **embed_kwargs)
+
+                if cache is not None:
+                    cache.store(unique_texts, embedder.model, unique_embeddings)
+
+                position = {text: i for i, text in enumerate(unique_texts)}
+                new_embeddings = unique_embeddings[[position[text] for text in missing_texts]]
+
+            #assemble one contiguous matrix in the original row order
+            dim = new_embeddings.shape[1] if new_embeddings is not None else len(cached[0])
+            matrix = np.empty((len(cleaned_texts), dim), dtype=np.float32)
+            hit_idx = [i for i, vector in enumerate(cached) if vector is not None]
+            if hit_idx:
+                matrix[hit_idx] = np.vstack([cached[i] for i in hit_idx])
+            if missing_idx:
+                matrix[missing_idx] = new_embeddings
+
+            embedding_set = EmbeddingSet(df.copy(), matrix, model=embedder.model)
+            record["rows_out"] = len(embedding_set)
+            return embedding_set.to_frame() if list_column else embedding_set
+
+        except OpenAIError as e:
+            raise RuntimeError(f"OpenAI request failed") from e
+
+        except Exception as e:
+            raise RuntimeError(f"Unexpected error during embedding generation") from e
@@ -1,9 +1,24 @@
 import pandas as pd
+import numpy as np
+import os
+
+EXPORT_FORMATS = {'.parquet': 'parquet', '.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+def _text_counts(df) -> np.ndarray:
+    #comments represented by each cluster's sampled texts: duplicate weights if present, else one each
+    counts = df['text'].str.len().to_numpy(copy=True)
+    if 'weights' in df.columns:
+        weights = df['weights'].reset_index(drop=True)
+        has_weights = weights.map(lambda w: isinstance(w, list)).to_numpy()
+        summed = pd.to_numeric(weights[has_weights].explode()).groupby(level=0).sum()
+        counts[has_weights] = summed.to_numpy().astype(int)
+    return counts
 
 def format_by_cluster(df, online_group_name="") -> pd.DataFrame:
     """
     Formats the summarized cluster output into a compact DataFrame where each row represents a cluster.
     Includes the cluster label, sentiment info, and total comment count for each cluster.
+    With duplicate weights (a 'weights' column), each sampled text counts as many comments as its weight.
 
     Parameters:
         df (pd.DataFrame): Output from summarize_clusters().
@@ -12,20 +27,14 @@ def format_by_cluster(df, online_group_name="") -> pd.DataFrame:
     Returns:
         pd.DataFrame: Cluster-level summary with one row per cluster.
     """
-    df = df.copy()
-    text_count = []
-    for _, row in df.iterrows():
-        text_count.append(len(row['text']))
-    df['text_count'] = text_count   
-    df['online_group_name'] = online_group_name
-    df = df[['online_group_name', 'cluster', 'cluster_summary', 'text_count', 'aggregated_sentiment', 'text', 'all_sentiments']]
-    
-    return df
+    df = df.assign(text_count=_text_counts(df), online_group_name=online_group_name)
+    return df[['online_group_name', 'cluster', 'cluster_summary', 'text_count', 'aggregated_sentiment', 'text', 'all_sentiments']]
 
 def format_by_text(df, online_group_name="") -> pd.DataFrame:
     """
     Flattens the summarized cluster output into a DataFrame where each row is an individual comment.
-    Includes the comment text, its cluster label, and associated sentiment.
+    Includes the comment text, its cluster label, and associated sentiment (and a 'weight'
+    column with each text's duplicate count, if the summary has weights).
 
     Parameters:
         df (pd.DataFrame): Output from summarize_clusters().
@@ -34,33 +43,16 @@ def format_by_text(df, online_group_name="") -> pd.DataFrame:
     Returns:
         pd.DataFrame: Text-level DataFrame with one row per message.
     """
-    text_col = []
-    sentiment_col = []
-    online_group_name_col = []
-    cluster_col = []
-    cluster_summary_col = []
-
-    for _, row in df.iterrows():
-        texts = row['text']
-
-        sentiments = row['all_sentiments']
+    list_columns = ['text', 'all_sentiments'] + (['weights'] if 'weights' in df.columns else [])
 
-        text_col += texts
-        sentiment_col += sentiments
+    #explode the per-cluster lists together; cluster and summary are repeated by pandas, not in Python
+    flat = df.loc[df['text'].str.len() > 0, ['cluster', 'cluster_summary'] + list_columns].explode(list_columns, ignore_index=True)
+    flat = flat.rename(columns={'all_sentiments': 'sentiment', 'weights': 'weight'})
+    flat.insert(0, 'online_group_name', online_group_name)
+    if 'weight' in flat.columns:
+        flat['weight'] = pd.to_numeric(flat['weight'])
 
-        tmp = len(texts) #since these columns need to match the length of the others
-        online_group_name_col += [online_group_name] * tmp
-        cluster_col += [row['cluster']] * tmp
-        cluster_summary_col += [row['cluster_summary']] * tmp
-
-    return_df = pd.DataFrame({
-        'online_group_name': online_group_name_col, 
-        'cluster': cluster_col, 
-        'cluster_summary': cluster_summary_col,
-        'text': text_col,
-        'sentiment': sentiment_col})
-
-    return return_df
+    return flat
 
 def format_to_dict(df, online_group_name="") -> dict:
     """
@@ -74,14 +66,108 @@ def format_to_dict(df, online_group_name="") -> dict:
     Returns:
         dict: A structured dictionary with cluster summaries.
     """
-    df = df.copy()
-    final = {"online_group_name": online_group_name, "clusters": []}
+    clusters = [
+        {"cluster": cluster, "cluster_summary": cluster_summary, "sentiment": sentiment, "text_count": text_count}
+        for cluster, cluster_summary, sentiment, text_count in zip(
+            df["cluster"].tolist(), df["cluster_summary"].tolist(), df["aggregated_sentiment"].tolist(), _text_counts(df).tolist()
+        )
+    ]
+    return {"online_group_name": online_group_name, "clusters": clusters}
+
+def iter_text_chunks(df, online_group_name="", chunk_rows: int=50000):
+    '''
+    Yields format_by_text output a few whole clusters at a time, each chunk holding about
+    chunk_rows texts (a single larger cluster is yielded on its own).
+    '''
+    sizes = df['text'].str.len().to_numpy()
+    start, rows = 0, 0
+    for end, size in enumerate(sizes, start=1):
+        rows += size
+        if rows >= chunk_rows:
+            yield format_by_text(df.iloc[start:end], online_group_name)
+            start, rows = end, 0
+    if start < len(df):
+        yield format_by_text(df.iloc[start:], online_group_name)
+
+def _export_format(path, file_format):
+    if file_format is not None:
+        if file_format not in set(EXPORT_FORMATS.values()):
+            raise ValueError(f"Unknown export format '{file_format}'. Use one of: parquet, csv, jsonl.")
+        return file_format
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"Cannot infer export format from '{path}'. Use a .parquet, .csv or .jsonl path, or pass file_format.")
+    return EXPORT_FORMATS[extension]
+
+def _parquet_schema(weighted: bool):
+    import pyarrow as pa
+
+    fields = [
+        ('online_group_name', pa.string()),
+        ('cluster', pa.int64()),
+        ('cluster_summary', pa.string()),
+        ('text', pa.string()),
+        ('sentiment', pa.struct([('label', pa.string()), ('score', pa.float64())]))
+    ]
+    if weighted:
+        fields.append(('weight', pa.float64()))
+    return pa.schema(fields)
+
+def _flatten_sentiment(chunk) -> pd.DataFrame:
+    #CSV has no nested values: the sentiment dict becomes sentiment_label and sentiment_score columns
+    position = chunk.columns.get_loc('sentiment')
+    sentiments = chunk['sentiment']
+    flat = chunk.drop(columns=['sentiment'])
+    flat.insert(position, 'sentiment_label', sentiments.map(lambda result: result.get('label') if isinstance(result, dict) else None))
+    flat.insert(position + 1, 'sentiment_score', pd.to_numeric(sentiments.map(lambda result: result.get('score') if isinstance(result, dict) else None)))
+    return flat
+
+def write_by_text(df, path, online_group_name="", file_format=None, chunk_rows: int=50000) -> int:
+    """
+    Writes the format_by_text rows of the summarized cluster output to a Parquet, CSV or JSON
+    Lines file, a few clusters at a time, so the whole flattened frame is never held in memory.
 
-    for _, row in df.iterrows():
-        cluster_summary = row["cluster_summary"]
-        sentiment = row["aggregated_sentiment"]
-        text_count = len(row['text'])
-        cluster = row["cluster"]
-        final["clusters"].append({"cluster": cluster, "cluster_summary": cluster_summary, "sentiment": sentiment, "text_count": text_count})
+    Parquet gets one row group per chunk and a 'sentiment' struct column (label, score); it
+    needs pyarrow. CSV writes the header once, with the sentiment as 'sentiment_label' and
+    'sentiment_score' columns, and JSON Lines one object per text.
 
-    return final
+    Parameters:
+        df (pd.DataFrame): Output from summarize_clusters().
+        path (str): File to write. Overwritten if it exists.
+        online_group_name (str): Label identifying the source community.
+        file_format (str): 'parquet', 'csv' or 'jsonl'. Inferred from the path's extension if None.
+        chunk_rows (int): Approximate number of texts flattened and written at a time.
+
+    Returns:
+        int: Number of text rows written.
+    """
+    file_format = _export_format(path, file_format)
+    chunks = iter_text_chunks(df, online_group_name, chunk_rows=chunk_rows)
+    written = 0
+
+    if file_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet export needs pyarrow: pip install NarrativeMapper[parquet]") from e
+
+        schema = _parquet_schema('weights' in df.columns)
+        with pq.ParquetWriter(path, schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                written += len(chunk)
+        return written
+
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for chunk in chunks:
+            if file_format == 'csv':
+                _flatten_sentiment(chunk).to_csv(f, header=written == 0, index=False)
+            else:
+                lines = chunk.to_json(orient='records', lines=True, force_ascii=False, double_precision=15)
+                f.write(lines if lines.endswith("\n") else lines + "\n")
+            written += len(chunk)
+
+        if written == 0 and file_format == 'csv':
+            _flatten_sentiment(format_by_text(df.iloc[:0], online_group_name)).to_csv(f, index=False) #header only
+    return written
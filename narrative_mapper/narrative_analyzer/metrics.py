@@ -0,0 +1,131 @@
+from contextlib import contextmanager, nullcontext
+import threading
+import json
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of this process so far, in MB (None where unsupported).
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def current_rss_mb():
+    '''
+    Resident set size of this process right now, in MB (None where unsupported).
+    '''
+    try:
+        #second field of /proc/self/statm is resident pages (Linux only)
+        with open("/proc/self/statm") as f:
+            resident = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+class PipelineMetrics:
+    """
+    Records per-stage metrics of a pipeline run.
+
+    Each stage records wall time, CPU time, RSS when it started and ended, rows in and out, and
+    the OpenAI requests and tokens sent/received while it was open. process_peak_rss_mb is the
+    peak RSS of the whole process up to the end of the stage, not of the stage alone: a stage
+    that stays under an earlier peak reports that earlier peak. Pass one instance as metrics= to get_embeddings,
+    cluster_embeddings and summarize_clusters (NarrativeMapper does this for you).
+
+    Parameters:
+        callback (callable): Optional hook called with each stage record when the stage ends.
+
+    Attributes:
+        stages (list[dict]): Finished stage records, in the order they ended.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = []
+        self._active = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int=None):
+        '''
+        Context manager that measures one stage. Yields the stage record, so the caller can
+        set record['rows_out'] (or add other fields) before it closes.
+        '''
+        record = {
+            "stage": name,
+            "rows_in": rows_in,
+            "rows_out": None,
+            "wall_time_s": 0.0,
+            "cpu_time_s": 0.0,
+            "rss_start_mb": current_rss_mb(),
+            "rss_end_mb": None,
+            "process_peak_rss_mb": None,
+            "api_requests": 0,
+            "tokens_sent": 0,
+            "tokens_received": 0
+        }
+        with self._lock:
+            self._active.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_time_s"] = time.perf_counter() - wall_start
+            record["cpu_time_s"] = time.process_time() - cpu_start
+            record["rss_end_mb"] = current_rss_mb()
+            record["process_peak_rss_mb"] = peak_rss_mb()
+            with self._lock:
+                self._active.remove(record)
+                self.stages.append(record)
+            if self.callback:
+                self.callback(record)
+
+    def record_api_call(self, tokens_sent: int=0, tokens_received: int=0):
+        '''
+        Counts one API request (and its token usage) toward every open stage. Thread-safe.
+        '''
+        with self._lock:
+            for record in self._active:
+                record["api_requests"] += 1
+                record["tokens_sent"] += tokens_sent
+                record["tokens_received"] += tokens_received
+
+    def record_usage(self, response):
+        '''
+        Counts one OpenAI response, reading token usage from response.usage when present.
+        '''
+        usage = getattr(response, "usage", None)
+        self.record_api_call(
+            tokens_sent=getattr(usage, "prompt_tokens", 0) or 0,
+            tokens_received=getattr(usage, "completion_tokens", 0) or 0
+        )
+
+    def to_dict(self) -> dict:
+        totals = {
+            key: sum(record[key] for record in self.stages)
+            for key in ["wall_time_s", "cpu_time_s", "api_requests", "tokens_sent", "tokens_received"]
+        }
+        totals["process_peak_rss_mb"] = peak_rss_mb()
+        return {"stages": list(self.stages), "totals": totals}
+
+    def to_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+def stage(metrics, name: str, rows_in: int=None):
+    '''
+    metrics.stage(...) when metrics is given, otherwise a no-op context yielding a throwaway record.
+    '''
+    if metrics is None:
+        return nullcontext({})
+    return metrics.stage(name, rows_in=rows_in)
@@ -1,8 +1,27 @@
 from .embeddings import get_embeddings
+from .streaming import embed_csv
+from .dedup import collapse_duplicates
 from .clustering import cluster_embeddings
 from .summarize import summarize_clusters
-from .formatters import format_by_text, format_by_cluster, format_to_dict
+from .formatters import format_by_text, format_by_cluster, format_to_dict, write_by_text
+from .embedding_set import EmbeddingSet
+from .metrics import PipelineMetrics
+from .checkpoint import RunCheckpoint
 import pandas as pd
+import numpy as np
+
+def _cluster_sizes(df) -> pd.Series:
+    #rows per cluster, counting duplicate weights if present
+    if 'weight' in df.columns:
+        return df.groupby('cluster')['weight'].sum()
+    return df['cluster'].value_counts()
+
+def _add_repeats(df, repeats: pd.Series):
+    #adds the weight of new texts that repeat a kept text (repeats: dedup_id -> weight) onto its row
+    if repeats.empty or 'dedup_id' not in df.columns:
+        return df
+    added = df['dedup_id'].map(repeats).fillna(0).to_numpy(dtype=np.result_type(df['weight'].dtype, repeats.dtype))
+    return df.assign(weight=df['weight'].to_numpy() + added)
 
 class NarrativeMapper:
     """
@@ -12,7 +31,7 @@ class NarrativeMapper:
     generate cluster summaries, and format the results into various output structures.
     """
     
-    def __init__(self, df, online_group_name: str, verbose=False):
+    def __init__(self, df, online_group_name: str, verbose=False, metrics_callback=None, embedder=None, checkpoint=None):
         """
         Initializes the NarrativeMapper instance.
         
@@ -20,9 +39,18 @@ class NarrativeMapper:
             online_group_name (str): Name of the online community (e.g. subreddit) to label outputs.
             df (DataFrame): The DataFrame of the original file.
             verbose (bool): Shows all progress bars and timers for all parts of the pipeline.
-            embeddings_df (DataFrame): Contains DataFrame after embeddings.
-            cluster_df (DataFrame): Contains DataFrame after clustering.
+            metrics_callback (callable): Called with each stage record as the stage finishes.
+            embedder (Embedder): Embedding backend, e.g. LocalEmbedder() for offline use. Defaults to OpenAI.
+            checkpoint (RunCheckpoint or str): Run directory that embedding batches, summary calls and
+                sentiment batches are checkpointed to, so an interrupted run can be resumed by
+                running it again with the same directory.
+            embeddings_df (EmbeddingSet): Contains texts and their float32 embedding matrix after embeddings.
+            cluster_df (EmbeddingSet): Contains clustered texts and their embeddings after clustering.
             summary_df (DataFrame): Contains DataFrame after summarizing.
+            cluster_model (ClusterModel): Fitted PCA/UMAP/HDBSCAN models from the last clustering.
+            last_update (dict): Statistics from the last update() call.
+            metrics (PipelineMetrics): Per-stage time, memory, row counts and API usage of every step run so far.
+            duplicate_groups (np.ndarray): With dedup, the 'dedup_id' of every file_df row (see expand_duplicates).
         """
         self.file_df = df
         self.online_group_name = online_group_name
@@ -30,15 +58,93 @@ class NarrativeMapper:
         self.embeddings_df = None
         self.cluster_df = None
         self.summary_df = None
+        self.cluster_model = None
+        self.last_update = None
+        self.metrics = PipelineMetrics(callback=metrics_callback)
+        self.duplicate_groups = None
+        self.embedder = embedder
+        self.checkpoint = RunCheckpoint(checkpoint) if isinstance(checkpoint, str) else checkpoint
+
+        #settings of each step, reused by update()
+        self._dedup_kwargs = None
+        self._embedding_kwargs = {}
+        self._cluster_kwargs = {}
+        self._summary_kwargs = {}
+
+    @classmethod
+    def from_csv(
+        cls,
+        path,
+        online_group_name: str,
+        embeddings_dir,
+        chunk_size: int=10000,
+        verbose=False,
+        cache=None,
+        max_concurrency=1,
+        metrics_callback=None,
+        embedder=None,
+        checkpoint=None
+        ) -> "NarrativeMapper":
+        """
+        Builds a NarrativeMapper from a CSV too large to load at once. The file is read and
+        embedded in chunks (see embed_csv) into an artifact at embeddings_dir, and the embeddings
+        are memory-mapped from there. The returned instance is ready for cluster().
 
-    def load_embeddings(self) -> "NarrativeMapper":
+        Parameters:
+            path (str): CSV file with a 'text' column.
+            online_group_name (str): Name of the online community (e.g. subreddit) to label outputs.
+            embeddings_dir (str): Artifact directory the embeddings are written to.
+            chunk_size (int): Rows read and embedded at a time.
+            verbose (bool): Shows all progress bars and timers for all parts of the pipeline.
+            cache (EmbeddingCache or str): Optional embedding cache, or a path to its sqlite file.
+            max_concurrency (int): Max embedding requests in flight at once.
+            metrics_callback (callable): Called with each stage record as the stage finishes.
+            embedder (Embedder): Embedding backend. Defaults to OpenAI.
+            checkpoint (RunCheckpoint or str): Run directory to checkpoint to and resume from.
+
+        Returns:
+            NarrativeMapper: New instance, with embeddings loaded.
         """
-        Loads and processes text data to obtain OpenAI embeddings.
+        mapper = cls(None, online_group_name, verbose=verbose, metrics_callback=metrics_callback, embedder=embedder, checkpoint=checkpoint)
+        mapper._embedding_kwargs = {'cache': cache, 'max_concurrency': max_concurrency, 'embedder': embedder}
+        mapper.embeddings_df = embed_csv(
+            path,
+            embeddings_dir,
+            chunk_size=chunk_size,
+            verbose=verbose,
+            metrics=mapper.metrics,
+            checkpoint=mapper.checkpoint,
+            **mapper._embedding_kwargs
+        )
+        mapper.file_df = mapper.embeddings_df.df
+        return mapper
+
+    def load_embeddings(self, cache=None, max_concurrency=1, dedup=None, near_duplicate_threshold: float=0.8) -> "NarrativeMapper":
+        """
+        Loads and processes text data to obtain embeddings (with the instance's embedder).
+
+        Parameters:
+            cache (EmbeddingCache or str): Optional embedding cache, or a path to its sqlite file.
+            max_concurrency (int): Max embedding requests in flight at once.
+            dedup (str): 'exact' or 'near' collapses repeated texts first (see collapse_duplicates),
+                so each is embedded, clustered and scored once with a 'weight' column.
+            near_duplicate_threshold (float): Jaccard similarity for dedup='near'.
         
         Returns:
             NarrativeMapper: Self, with embeddings loaded.
         """
-        self.embeddings_df = get_embeddings(self.file_df, self.verbose)
+        if dedup not in (None, 'exact', 'near'):
+            raise ValueError(f"dedup must be None, 'exact' or 'near', got {dedup!r}.")
+
+        df = self.file_df
+        self._dedup_kwargs = None
+        self.duplicate_groups = None
+        if dedup is not None:
+            self._dedup_kwargs = {'near_duplicates': dedup == 'near', 'threshold': near_duplicate_threshold}
+            df, self.duplicate_groups = collapse_duplicates(self.file_df, **self._dedup_kwargs)
+
+        self._embedding_kwargs = {'cache': cache, 'max_concurrency': max_concurrency, 'embedder': self.embedder}
+        self.embeddings_df = get_embeddings(df, self.verbose, metrics=self.metrics, checkpoint=self.checkpoint, **self._embedding_kwargs)
         return self
 
     def cluster(
@@ -46,42 +152,167 @@ class NarrativeMapper:
         umap_kwargs=None,
         hdbscan_kwargs=None,
         pca_kwargs=None,
-        use_pca=True
+        use_pca=True,
+        merge_threshold=0.25,
+        landmark_size=None
         ) -> "NarrativeMapper":
         """
         Applies PCA + UMAP for dimensionality reduction and HDBSCAN for clustering
-        on the loaded embeddings.
+        on the loaded embeddings. The fitted models are kept in cluster_model for update().
         
         Parameters:
             umap_kwargs (dict): Allows for more UMAP input parameters
             hdbscan_kwargs (dict): Allows for more HDBSCAN input parameters
             pca_kwargs (dict): Allows for more PCA input parameters
             use_pca (bool): Allows user to not use PCA and go straight to UMAP
+            merge_threshold (float): Cosine distance below which cluster centroids are merged
+            landmark_size (int): Fit UMAP/HDBSCAN on this many landmark texts and assign the rest (for very large corpora)
         
         Returns:
             NarrativeMapper: Self, with clustering results stored.
         """
-        self.cluster_df = cluster_embeddings(
+        self._cluster_kwargs = {
+            'umap_kwargs': umap_kwargs,
+            'hdbscan_kwargs': hdbscan_kwargs,
+            'pca_kwargs': pca_kwargs,
+            'use_pca': use_pca,
+            'merge_threshold': merge_threshold,
+            'landmark_size': landmark_size
+        }
+        self.cluster_df, self.cluster_model = cluster_embeddings(
             self.embeddings_df,
             verbose=self.verbose,
-            umap_kwargs=umap_kwargs,
-            hdbscan_kwargs=hdbscan_kwargs,
+            umap_kwargs=None if umap_kwargs is None else dict(umap_kwargs), #copies, since params get autocalculated in place
+            hdbscan_kwargs=None if hdbscan_kwargs is None else dict(hdbscan_kwargs),
             pca_kwargs=pca_kwargs,
-            use_pca=use_pca
+            use_pca=use_pca,
+            merge_threshold=merge_threshold,
+            landmark_size=landmark_size,
+            return_model=True,
+            metrics=self.metrics
         )
         return self
 
-    def summarize(self, max_sample_size: int=500) -> "NarrativeMapper":
+    def summarize(self, max_sample_size: int=500, max_concurrency: int=1, summary_cache=None, sampling="random", sentiment_backend: str=None, sentiment_cache=None) -> "NarrativeMapper":
         """
         Summarizes each cluster using GPT-based keyword extraction and sentiment analysis.
 
         Parameters:
             max_sample_size (int): max length of text list for each cluster being sampled
+            max_concurrency (int): max chat completion requests in flight at once
+            summary_cache (SummaryCache or str): reuse partial/final summaries of identical prompts
+            sampling (str): 'mmr' summarizes a token-budgeted, representative subset of each sample (usually one call per cluster)
+            sentiment_backend (str): 'torch', 'int8', 'onnx' or 'onnx-int8'; default is the process-wide backend (see set_sentiment_backend)
+            sentiment_cache (SentimentCache or str): reuse sentiment results of texts scored by earlier runs
         
         Returns:
             NarrativeMapper: Self, with summarized clusters stored.
         """
-        self.summary_df = summarize_clusters(self.cluster_df, max_sample_size, verbose=self.verbose)
+        self._summary_kwargs = {
+            'max_sample_size': max_sample_size,
+            'max_concurrency': max_concurrency,
+            'summary_cache': summary_cache,
+            'sampling': sampling,
+            'sentiment_backend': sentiment_backend,
+            'sentiment_cache': sentiment_cache
+        }
+        self.summary_df = summarize_clusters(self.cluster_df, verbose=self.verbose, metrics=self.metrics, checkpoint=self.checkpoint, **self._summary_kwargs)
+        return self
+
+    def update(self, new_df, drift_threshold: float=0.25, resummarize_threshold: float=0.1) -> "NarrativeMapper":
+        """
+        Adds new texts to the existing narrative map without rerunning the whole pipeline.
+
+        Only the new texts are embedded. They are projected with the stored PCA/UMAP transforms and
+        assigned to existing clusters with HDBSCAN approximate prediction. With dedup, new texts
+        are first matched against the texts already in the map: a repeat is not embedded again but
+        adds to the weight of the text it repeats (and so to that text's cluster). Clusters that
+        grew by at least resummarize_threshold (relative to their size) are re-summarized; the rest
+        keep their summaries.
+
+        Drift is the larger of: the share of new texts far from every existing cluster (see
+        ClusterModel.outlier_fraction), and how much more of the new texts HDBSCAN labels as noise
+        than it did for the fitted texts. Above drift_threshold the map no longer fits the data and
+        everything is refit instead.
+
+        Parameters:
+            new_df (DataFrame): New rows, with a 'text' column.
+            drift_threshold (float): Drift above which a full refit happens.
+            resummarize_threshold (float): Relative cluster growth that triggers re-summarizing it.
+
+        Returns:
+            NarrativeMapper: Self, with embeddings, clusters and summaries updated.
+        """
+        if self.cluster_model is None:
+            raise RuntimeError("update() requires a fitted map. Call load_embeddings() and cluster() first.")
+
+        new_rows = new_df
+        repeats = pd.Series(dtype=np.int64)
+        repeated_texts = 0
+        if self._dedup_kwargs is not None:
+            #matched against the texts already in the map, then among themselves; new ids continue after the existing ones
+            new_rows, new_groups = collapse_duplicates(new_df, existing=self.embeddings_df, **self._dedup_kwargs)
+            self.duplicate_groups = np.concatenate([self.duplicate_groups, new_groups])
+            repeated = ~np.isin(new_groups, new_rows['dedup_id'].to_numpy())
+            row_weights = new_df['weight'].to_numpy() if 'weight' in new_df.columns else np.ones(len(new_df), dtype=np.int64)
+            repeats = pd.Series(row_weights[repeated]).groupby(new_groups[repeated]).sum()
+            repeated_texts = int(repeated.sum())
+
+        if len(new_rows):
+            new_embeddings = get_embeddings(new_rows, self.verbose, metrics=self.metrics, checkpoint=self.checkpoint, **{'embedder': self.embedder, **self._embedding_kwargs})
+            with self.metrics.stage("assignment", rows_in=len(new_embeddings)) as record:
+                labels, _ = self.cluster_model.predict(new_embeddings.matrix)
+                record["rows_out"] = int(np.sum(labels != -1))
+            noise_fraction = float(np.mean(labels == -1))
+            outlier_fraction = self.cluster_model.outlier_fraction(new_embeddings.matrix)
+        else:
+            #every new text repeats one already in the map
+            new_embeddings = self.embeddings_df.subset(np.zeros(len(self.embeddings_df), dtype=bool))
+            labels = np.empty(0, dtype=np.int64)
+            noise_fraction = outlier_fraction = 0.0
+
+        self.file_df = pd.concat([self.file_df, new_df], ignore_index=True)
+        self.embeddings_df.df = _add_repeats(self.embeddings_df.df, repeats)
+        self.embeddings_df = EmbeddingSet.concat([self.embeddings_df, new_embeddings])
+
+        drift = max(noise_fraction - self.cluster_model.noise_fraction, outlier_fraction)
+        self.last_update = {
+            'new_texts': len(new_df),
+            'repeated_texts': repeated_texts,
+            'assigned': int(np.sum(labels != -1)),
+            'noise_fraction': noise_fraction,
+            'outlier_fraction': outlier_fraction,
+            'drift': drift,
+            'refit': drift > drift_threshold,
+            'resummarized_clusters': []
+        }
+
+        if drift > drift_threshold:
+            self.cluster(**self._cluster_kwargs)
+            if self.summary_df is not None:
+                self.summarize(**self._summary_kwargs)
+            return self
+
+        keep = labels != -1
+        assigned = new_embeddings.subset(keep)
+        assigned.df = assigned.df.assign(cluster=labels[keep])
+
+        old_counts = _cluster_sizes(self.cluster_df.df)
+        self.cluster_df.df = _add_repeats(self.cluster_df.df, repeats)
+        self.cluster_df = EmbeddingSet.concat([self.cluster_df, assigned])
+        new_counts = _cluster_sizes(self.cluster_df.df).sub(old_counts, fill_value=0)
+        new_counts = new_counts[new_counts > 0]
+
+        growth = new_counts / old_counts.reindex(new_counts.index)
+        changed = sorted(growth[growth >= resummarize_threshold].index.tolist())
+        self.last_update['resummarized_clusters'] = changed
+
+        if self.summary_df is not None and changed:
+            changed_rows = self.cluster_df.subset(self.cluster_df.df['cluster'].isin(changed).to_numpy())
+            resummarized = summarize_clusters(changed_rows, verbose=self.verbose, metrics=self.metrics, checkpoint=self.checkpoint, **self._summary_kwargs)
+            unchanged = self.summary_df[~self.summary_df['cluster'].isin(changed)]
+            self.summary_df = pd.concat([unchanged, resummarized]).sort_values('cluster').reset_index(drop=True)
+
         return self
 
     def format_by_text(self) -> pd.DataFrame:
@@ -110,3 +341,18 @@ class NarrativeMapper:
             dict: A dictionary with cluster summaries, suitable for JSON export.
         """
         return format_to_dict(self.summary_df, self.online_group_name)
+
+    def write_by_text(self, path, file_format=None, chunk_rows: int=50000) -> int:
+        """
+        Writes the format_by_text rows to a Parquet, CSV or JSON Lines file, a few clusters at a
+        time, without building the whole text-level DataFrame.
+
+        Parameters:
+            path (str): Output file. The format is inferred from its extension unless file_format is given.
+            file_format (str): 'parquet', 'csv' or 'jsonl'.
+            chunk_rows (int): Approximate number of texts written at a time.
+
+        Returns:
+            int: Number of text rows written.
+        """
+        return write_by_text(self.summary_df, path, self.online_group_name, file_format=file_format, chunk_rows=chunk_rows)
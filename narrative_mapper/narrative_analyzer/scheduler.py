@@ -0,0 +1,206 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import threading
+import random
+import time
+
+RETRYABLE_STATUS = (408, 409, 429)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at per_minute / 60 per second, holding at most
+    burst_seconds worth of refill.
+
+    reserve() takes what a request needs right away and returns how long the caller must wait
+    before sending it, so waiting happens outside the lock and callers are served in order. A
+    request larger than the whole bucket waits for a full bucket and leaves a debt that later
+    requests pay off, so the long-run rate still holds.
+    """
+    def __init__(self, per_minute: float, burst_seconds: float=1.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        #caller holds the lock
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (min(amount, self.capacity) - self._level) / self.rate)
+            self._level -= amount
+        return wait
+
+    def adjust(self, amount: float):
+        '''
+        Gives back (positive) or takes (negative) tokens, e.g. once a request's real usage is known.
+        '''
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level = min(self.capacity, self._level + amount)
+
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._level
+
+def _retry_after(error):
+    #seconds the server asked us to wait (retry-after-ms, retry-after in seconds or as an HTTP date), or None
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+def _is_retryable(error) -> bool:
+    from openai import APIConnectionError, APIStatusError #imported lazily to keep package import cheap
+
+    if isinstance(error, APIConnectionError): #includes timeouts
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+class RequestScheduler:
+    """
+    Paces and retries every OpenAI request of the process (see get_openai_client).
+
+    Each request takes an in-flight slot, one token from the request bucket (rpm) and its
+    estimated tokens from the token bucket (tpm), waiting as long as the buckets need. Once the
+    response arrives the token estimate is corrected with the reported usage. Rate limits (429),
+    timeouts, connection errors and 5xx responses are retried up to max_retries times with
+    jittered exponential backoff (full jitter, base_delay * 2**attempt, at most max_delay). A
+    Retry-After header is honoured instead, and after a 429 every caller holds off until then,
+    not only the one that was throttled. Other errors are raised right away.
+
+    Parameters:
+        max_in_flight (int): Requests allowed at once across all callers.
+        rpm (int): Requests per minute. None does not pace requests.
+        tpm (int): Tokens per minute (prompt plus expected completion). None does not pace tokens.
+        max_retries (int): Retries per request before the error is raised.
+        base_delay (float): First backoff ceiling in seconds.
+        max_delay (float): Largest backoff in seconds.
+        burst_seconds (float): How many seconds of budget may be spent at once after an idle spell.
+    """
+    def __init__(self, max_in_flight: int=64, rpm: int=None, tpm: int=None, max_retries: int=6, base_delay: float=0.5, max_delay: float=60.0, burst_seconds: float=1.0):
+        self.max_in_flight = max_in_flight
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self._tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "throttled": 0, "wait_s": 0.0}
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _backoff(self, error, attempt: int) -> float:
+        delay = _retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return min(self.max_delay, max(0.0, delay))
+
+    def call(self, fn, tokens: int=0, usage_tokens=None, **kwargs):
+        '''
+        Calls fn(**kwargs) within the limits, retrying transient failures.
+
+        Parameters:
+            fn (callable): The request, e.g. client.embeddings.create.
+            tokens (int): Estimated tokens of the request, taken from the tpm budget.
+            usage_tokens (callable): Returns the real token count from the response, to correct the estimate.
+        '''
+        attempt = 0
+        while True:
+            while True:
+                #checked again after sleeping, since another 429 may have pushed the pause further out
+                with self._lock:
+                    pause = self._paused_until - time.monotonic()
+                if pause <= 0:
+                    break
+                pause += random.uniform(0, self.base_delay) #so the callers held off do not all resume at once
+                self._count(wait_s=pause)
+                time.sleep(pause)
+
+            with self._slots:
+                wait = 0.0
+                if self._requests is not None:
+                    wait = self._requests.reserve(1)
+                if self._tokens is not None and tokens:
+                    wait = max(wait, self._tokens.reserve(tokens))
+                if wait:
+                    self._count(wait_s=wait)
+                    time.sleep(wait)
+
+                self._count(requests=1)
+                try:
+                    response = fn(**kwargs)
+                except Exception as e:
+                    if self._tokens is not None and tokens:
+                        self._tokens.adjust(tokens) #a rejected request used no budget
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+                    delay = self._backoff(e, attempt)
+                    throttled = getattr(e, "status_code", None) == 429
+                    if throttled:
+                        #the limit is shared, so every caller holds off, not only this one
+                        with self._lock:
+                            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                    self._count(retries=1, throttled=int(throttled))
+                    error = e
+                else:
+                    if self._tokens is not None and tokens and usage_tokens is not None:
+                        used = usage_tokens(response)
+                        if used is not None:
+                            self._tokens.adjust(tokens - used)
+                    return response
+
+            #back off outside the slot, so other requests can go meanwhile
+            if getattr(error, "status_code", None) != 429:
+                self._count(wait_s=delay)
+                time.sleep(delay)
+            attempt += 1
+
+    def batch_tokens(self, default: int, minimum: int=256) -> int:
+        '''
+        Tokens per request batch that suit the configured budget: default, lowered to what the
+        token bucket holds (so one request never has to wait for more than a full bucket) and to
+        tpm / rpm, beyond which bigger batches only make requests burstier, since the token limit
+        is hit before the request limit. Never below minimum.
+
+        Depends only on the configured limits, not on the current bucket level, so the batches of
+        a run are the same every time it is repeated with the same limits.
+        '''
+        if self._tokens is None:
+            return default
+        size = self._tokens.capacity
+        if self.rpm:
+            size = min(size, self.tpm / self.rpm)
+        return int(max(minimum, min(default, size)))
+
+    def stats(self) -> dict:
+        '''
+        Requests sent (attempts), retries, 429s and total seconds spent waiting on limits and backoff.
+        '''
+        with self._lock:
+            return dict(self._stats)
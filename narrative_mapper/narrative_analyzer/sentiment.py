@@ -0,0 +1,280 @@
+import threading
+import platform
+import os
+
+SENTIMENT_MODEL = "distilbert-base-uncased-finetuned-sst-2-english"
+SENTIMENT_BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "narrative_mapper")
+
+UNKNOWN_SENTIMENT = {"label": "UNKNOWN", "score": 0}
+
+_sentiment_config = {"backend": "torch", "intra_op_threads": None, "inter_op_threads": None}
+_sentiment_analyzers = {} #backend -> pipeline
+_sentiment_lock = threading.Lock()
+
+def set_sentiment_backend(backend: str="torch", intra_op_threads: int=None, inter_op_threads: int=None):
+    '''
+    Chooses how the process runs the sentiment model. Models already loaded are dropped and the
+    next call loads the new backend.
+
+        'torch'      fp32 PyTorch (the default)
+        'int8'       PyTorch with dynamic int8 quantization of the Linear layers (CPU)
+        'onnx'       fp32 ONNX Runtime export (needs NarrativeMapper[onnx])
+        'onnx-int8'  ONNX Runtime export with dynamic int8 quantization (needs NarrativeMapper[onnx]),
+                     quantized once and kept in ~/.cache/narrative_mapper
+
+    Quantized backends give slightly different scores (and now and then labels), so their results
+    are checkpointed and cached apart from the fp32 model's (see sentiment_model_id).
+
+    Parameters:
+        backend (str): One of SENTIMENT_BACKENDS.
+        intra_op_threads (int): Threads one operator (e.g. a matmul) may use. None keeps the library default.
+        inter_op_threads (int): Threads for running independent operators at once. None keeps the
+            library default. PyTorch only accepts this before its first parallel work in the process.
+    '''
+    if backend not in SENTIMENT_BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(SENTIMENT_BACKENDS)}, got {backend!r}.")
+    with _sentiment_lock:
+        _sentiment_config.update(backend=backend, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+        _sentiment_analyzers.clear()
+
+def get_sentiment_backend() -> str:
+    return _sentiment_config["backend"]
+
+def sentiment_model_id(backend: str=None) -> str:
+    '''
+    Model name results are keyed by: SENTIMENT_MODEL for 'torch', with the backend appended otherwise.
+    '''
+    backend = backend or get_sentiment_backend()
+    return SENTIMENT_MODEL if backend == "torch" else f"{SENTIMENT_MODEL}:{backend}"
+
+def _set_torch_threads(intra_op_threads, inter_op_threads):
+    import torch
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            pass #already fixed by earlier parallel work in this process
+
+def _load_onnx_model(quantize: bool, intra_op_threads, inter_op_threads):
+    try:
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as e:
+        raise ImportError("The ONNX sentiment backends need optimum and onnxruntime: pip install 'NarrativeMapper[onnx]'") from e
+
+    options = onnxruntime.SessionOptions()
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    if inter_op_threads:
+        options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL if inter_op_threads and inter_op_threads > 1 else onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    session_kwargs = {"session_options": options, "provider": "CPUExecutionProvider"}
+
+    if not quantize:
+        return ORTModelForSequenceClassification.from_pretrained(SENTIMENT_MODEL, export=True, **session_kwargs)
+
+    save_dir = os.path.join(ONNX_CACHE_DIR, f"{SENTIMENT_MODEL}-onnx-int8")
+    if not os.path.exists(os.path.join(save_dir, "model_quantized.onnx")):
+        from optimum.onnxruntime import ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        #dynamic quantization: int8 weights, activations quantized on the fly, no calibration data
+        is_arm = platform.machine().lower() in ("arm64", "aarch64")
+        qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False) if is_arm else AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        quantizer = ORTQuantizer.from_pretrained(ORTModelForSequenceClassification.from_pretrained(SENTIMENT_MODEL, export=True))
+        quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+    return ORTModelForSequenceClassification.from_pretrained(save_dir, file_name="model_quantized.onnx", **session_kwargs)
+
+def build_sentiment_analyzer(backend: str="torch", intra_op_threads: int=None, inter_op_threads: int=None):
+    '''
+    Builds a Hugging Face sentiment pipeline for backend (see set_sentiment_backend). Every backend
+    but 'torch' runs on CPU; 'torch' uses the GPU if there is one.
+    '''
+    from transformers import pipeline
+
+    if backend == "torch":
+        import torch
+
+        _set_torch_threads(intra_op_threads, inter_op_threads)
+        device = 0 if torch.cuda.is_available() else -1
+        return pipeline("sentiment-analysis", model=SENTIMENT_MODEL, device=device)
+
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(SENTIMENT_MODEL)
+    if backend == "int8":
+        from transformers import AutoModelForSequenceClassification
+        import torch
+
+        _set_torch_threads(intra_op_threads, inter_op_threads)
+        model = AutoModelForSequenceClassification.from_pretrained(SENTIMENT_MODEL).eval()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        model = _load_onnx_model(backend == "onnx-int8", intra_op_threads, inter_op_threads)
+    return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer, device=-1)
+
+def get_sentiment_analyzer(backend: str=None):
+    '''
+    Returns the shared sentiment pipeline of backend (default: the one set with
+    set_sentiment_backend), building it on first use.
+
+    torch and transformers are only imported here, so importing the package stays cheap.
+    '''
+    backend = backend or get_sentiment_backend()
+    analyzer = _sentiment_analyzers.get(backend)
+    if analyzer is None:
+        with _sentiment_lock:
+            analyzer = _sentiment_analyzers.get(backend)
+            if analyzer is None:
+                analyzer = build_sentiment_analyzer(backend, _sentiment_config["intra_op_threads"], _sentiment_config["inter_op_threads"])
+                _sentiment_analyzers[backend] = analyzer
+    return analyzer
+
+def warm_up(backend: str=None):
+    '''
+    Loads the sentiment model and runs one inference so the first real request does not pay
+    for model loading. Intended for long-lived services and worker processes.
+    '''
+    get_sentiment_analyzer(backend)("warm up", truncation=True)
+
+def aggregate_sentiments(sentiments: list[dict], weights: list=None) -> str:
+    '''
+    Majority vote over individual sentiment results: 'POSITIVE' if positives outnumber
+    negatives 2 to 1, 'NEGATIVE' if the reverse, otherwise 'NEUTRAL'. With weights (e.g. duplicate
+    counts), each result counts as many votes as its weight.
+    '''
+    if weights is None:
+        weights = [1] * len(sentiments)
+
+    #aggregate by majority label: count POSITIVE and NEGATIVE, then decide overall
+    pos_count = sum(w for s, w in zip(sentiments, weights) if s["label"] == "POSITIVE")
+    neg_count = sum(w for s, w in zip(sentiments, weights) if s["label"] == "NEGATIVE")
+
+    if neg_count == 0 and pos_count == 0: raise Exception("No sentiments calculated in batch")
+    count_ratio = 2 if (neg_count == 0) else pos_count/neg_count
+
+    if count_ratio >= 2:
+        return "POSITIVE"
+    elif count_ratio <= 0.5:
+        return "NEGATIVE"
+    return "NEUTRAL"
+
+def _run_batch(batch: list[str], batch_size: int, backend: str=None) -> list[dict]:
+    sentiment_analyzer = get_sentiment_analyzer(backend)
+    try:
+        return sentiment_analyzer(batch, truncation=True, batch_size=batch_size)
+    except Exception:
+        #fall back to one text at a time so a bad input only marks itself as unknown
+        results = []
+        for text in batch:
+            try:
+                results.append(sentiment_analyzer(text, truncation=True)[0])
+            except Exception:
+                results.append(dict(UNKNOWN_SENTIMENT))
+        return results
+
+def _cache_results(cache, texts, model_id, results):
+    #an UNKNOWN result may be a transient failure, so it is scored again next time
+    known = [(text, result) for text, result in zip(texts, results) if result["label"] != UNKNOWN_SENTIMENT["label"]]
+    cache.store([text for text, _ in known], model_id, [result for _, result in known])
+
+def score_texts(texts: list[str], batch_size: int=32, on_batch_done=None, checkpoint=None, backend: str=None, cache=None) -> list[dict]:
+    """
+    Scores every text with the sentiment pipeline using batched inference.
+
+    Duplicate texts are scored once. Unique texts are sorted by token length before
+    batching so each batch pads to a similar length. Results are returned aligned with texts.
+
+    With a cache, texts are looked up by a hash of their content and the model ID first, and only
+    texts it has never seen are scored. Each finished batch is written back to the cache, except
+    'UNKNOWN' results, which may come from a transient failure.
+
+    Parameters:
+        texts (list[str]): Texts to score.
+        batch_size (int): Texts per forward pass.
+        on_batch_done (callable): Called with the number of texts in each finished batch.
+        checkpoint (RunCheckpoint): Reuses texts scored by an interrupted run and appends each
+            finished batch, if given.
+        backend (str): Sentiment backend (see set_sentiment_backend). Default is the process-wide one.
+        cache (SentimentCache): Per-text sentiment cache, if given.
+
+    Returns:
+        list[dict]: One {'label', 'score'} dict per input text.
+    """
+    backend = backend or get_sentiment_backend()
+    model_id = sentiment_model_id(backend)
+    unique_texts = list(dict.fromkeys(texts))
+    scores = {}
+    if cache is not None:
+        cached = cache.lookup(unique_texts, model_id)
+        scores.update((text, result) for text, result in zip(unique_texts, cached) if result is not None)
+        unique_texts = [text for text in unique_texts if text not in scores]
+    if checkpoint is not None and unique_texts:
+        done = checkpoint.lookup_sentiments(unique_texts, model_id)
+        resumed = [(text, result) for text, result in zip(unique_texts, done) if result is not None]
+        scores.update(resumed)
+        if cache is not None and resumed:
+            _cache_results(cache, [text for text, _ in resumed], model_id, [result for _, result in resumed])
+        unique_texts = [text for text in unique_texts if text not in scores]
+    if on_batch_done and scores:
+        on_batch_done(len(scores)) #texts already scored count as done
+    if not unique_texts:
+        return [dict(scores[text]) for text in texts]
+
+    tokenizer = getattr(get_sentiment_analyzer(backend), "tokenizer", None)
+    if tokenizer is not None:
+        lengths = [len(ids) for ids in tokenizer(unique_texts, truncation=True)["input_ids"]]
+    else:
+        lengths = [len(text) for text in unique_texts]
+    ordered = [unique_texts[i] for i in sorted(range(len(unique_texts)), key=lengths.__getitem__)]
+
+    for start in range(0, len(ordered), batch_size):
+        batch = ordered[start:start + batch_size]
+        results = _run_batch(batch, batch_size, backend)
+        if checkpoint is not None:
+            checkpoint.store_sentiments(batch, model_id, results)
+        if cache is not None:
+            _cache_results(cache, batch, model_id, results)
+        scores.update(zip(batch, results))
+        if on_batch_done:
+            on_batch_done(len(batch))
+
+    return [dict(scores[text]) for text in texts]
+
+def analyze_sentiments_for_clusters(text_lists: list[list[str]], batch_size: int=32, on_batch_done=None, weight_lists: list[list]=None, checkpoint=None, backend: str=None, cache=None) -> list[tuple]:
+    '''
+    Scores the texts of all clusters in one deduplicated, batched pass and splits the
+    results back out per cluster. Returns (overall, sentiments) for each cluster. weight_lists,
+    aligned with text_lists, weights each text's vote in the overall label. checkpoint
+    (RunCheckpoint) records and reuses finished batches. backend overrides the process-wide
+    sentiment backend. cache (SentimentCache) skips texts scored by earlier runs.
+    '''
+    flat_texts = [text for texts in text_lists for text in texts]
+    flat_sentiments = score_texts(flat_texts, batch_size=batch_size, on_batch_done=on_batch_done, checkpoint=checkpoint, backend=backend, cache=cache)
+
+    results = []
+    start = 0
+    for i, texts in enumerate(text_lists):
+        sentiments = flat_sentiments[start:start + len(texts)]
+        start += len(texts)
+        weights = weight_lists[i] if weight_lists is not None else None
+        results.append((aggregate_sentiments(sentiments, weights), sentiments))
+    return results
+
+def analyze_sentiments_for_texts(texts, batch_size: int=32, backend: str=None, cache=None) -> (str, list[dict]):
+    """
+    Analyze sentiment for a list of texts using the Hugging Face sentiment pipeline.
+    Returns an overall aggregated sentiment and a list of individual sentiment results.
+    backend ('torch', 'int8', 'onnx' or 'onnx-int8') overrides the process-wide backend
+    (see set_sentiment_backend). With cache (SentimentCache), only texts it has never seen are scored.
+    """
+    try:
+        sentiments = score_texts(list(texts), batch_size=batch_size, backend=backend, cache=cache)
+        return aggregate_sentiments(sentiments), sentiments
+
+    except Exception as e:
+        raise RuntimeError(f"Unexpected error during cluster sentiment analysis") from e
@@ -0,0 +1,133 @@
+from .embeddings import get_embeddings, clean_texts
+from .embedders import OpenAIEmbedder
+from .artifacts import EmbeddingArtifactWriter, load_embedding_set
+from .cache import EmbeddingCache
+from .checkpoint import RunCheckpoint
+from .embedding_set import EmbeddingSet
+from .utils import progress_bars
+from queue import Queue, Full
+import pandas as pd
+import threading
+
+_DONE = object()
+
+def read_text_chunks(path, chunk_size: int=10000, **read_csv_kwargs):
+    '''
+    Yields the CSV at path as DataFrames of up to chunk_size rows, without reading the whole file.
+
+    Rows whose 'text' is missing, not a string, or empty after clean_texts are dropped, since they
+    cannot be embedded. Extra keyword arguments go to pd.read_csv.
+    '''
+    for chunk in pd.read_csv(path, chunksize=chunk_size, **read_csv_kwargs):
+        if 'text' not in chunk.columns:
+            raise ValueError("Input file must contain a 'text' column.")
+
+        is_text = chunk['text'].map(lambda text: isinstance(text, str))
+        chunk = chunk[is_text]
+        non_empty = [bool(text) for text in clean_texts(chunk['text'].tolist())]
+        yield chunk[non_empty].reset_index(drop=True)
+
+def embed_csv(
+    path,
+    output_dir,
+    chunk_size: int=10000,
+    verbose=False,
+    cache=None,
+    max_concurrency: int=1,
+    metrics=None,
+    mmap=True,
+    embedder=None,
+    checkpoint=None,
+    load=True
+    ) -> EmbeddingSet:
+    """
+    Streams a CSV through get_embeddings chunk by chunk and writes the results to an embedding
+    artifact directory (see save_embedding_set).
+
+    A background thread parses and filters the next chunk while the current one is being
+    embedded, and at most two parsed chunks wait in memory. Each embedded chunk is appended to
+    the on-disk matrix right away and nothing is kept per row between chunks (the cache and the
+    checkpoint index live on disk), so memory stays bounded by chunk_size however large the input
+    is. When the file is done, the artifact is opened with the matrix memory-mapped, ready for
+    cluster_embeddings; only its rows table is read into memory, and load=False skips even that.
+
+    Parameters:
+        path (str): CSV file with a 'text' column.
+        output_dir (str): Artifact directory to write (rows.jsonl, embeddings.npy, manifest.json).
+        chunk_size (int): Rows read and embedded at a time.
+        verbose (bool): Shows a running row count if True.
+        cache (EmbeddingCache or str): Optional embedding cache, or a path to its sqlite file.
+        max_concurrency (int): Max embedding requests in flight at once (within a chunk).
+        metrics (PipelineMetrics): Records one 'embedding' stage per chunk if given.
+        mmap (bool): Return the matrix as a read-only np.memmap instead of reading it into RAM.
+        embedder (Embedder): Embedding backend. Defaults to OpenAIEmbedder().
+        checkpoint (RunCheckpoint or str): Run directory that every embedded request batch is
+            appended to. Rerunning with it after a failure re-reads the file but only embeds
+            texts of unfinished batches.
+        load (bool): Load the finished artifact. If False, nothing is read back and None is
+            returned; open output_dir later with load_embedding_set.
+
+    Returns:
+        EmbeddingSet: every kept row of the file and its embedding, loaded from output_dir
+            (None if load is False).
+    """
+    if isinstance(cache, str):
+        cache = EmbeddingCache(cache) #opened once for all chunks
+    if isinstance(checkpoint, str):
+        checkpoint = RunCheckpoint(checkpoint)
+    if embedder is None:
+        embedder = OpenAIEmbedder()
+
+    chunks = Queue(maxsize=2)
+    stop = threading.Event()
+
+    def put(item):
+        #gives up once the consumer has stopped, so the reader never blocks forever on a full queue
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def read():
+        try:
+            for chunk in read_text_chunks(path, chunk_size):
+                if not put(chunk):
+                    return
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+
+    progress_context = progress_bars(verbose, bars=False)
+    try:
+        with progress_context as progress, EmbeddingArtifactWriter(output_dir, model=embedder.model) as writer:
+            if verbose:
+                task = progress.add_task("[cyan]Streaming embeddings... 0 rows", total=None)
+
+            while True:
+                chunk = chunks.get()
+                if chunk is _DONE:
+                    break
+                if isinstance(chunk, Exception):
+                    raise RuntimeError(f"Failed to read CSV file") from chunk
+                if chunk.empty:
+                    continue
+
+                writer.append(get_embeddings(chunk, cache=cache, max_concurrency=max_concurrency, metrics=metrics, embedder=embedder, checkpoint=checkpoint))
+                if verbose:
+                    progress.update(task, description=f"[cyan]Streaming embeddings... {writer.rows} rows")
+    finally:
+        stop.set()
+        reader.join()
+
+    if writer.rows == 0:
+        raise RuntimeError("The 'text' column is empty.")
+    if not load:
+        return None
+
+    return load_embedding_set(output_dir, mmap=mmap, model=embedder.model)
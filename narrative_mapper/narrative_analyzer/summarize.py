@@ -1,61 +1,22 @@
-from transformers import pipeline
-from openai import OpenAI
-from openai._exceptions import OpenAIError
-from .utils import get_openai_key, batch_list, progress_bars
+from .utils import get_openai_client, get_token_counter, batch_list, progress_bars
+from .sentiment import analyze_sentiments_for_clusters
+from .embedding_set import EmbeddingSet
+from .cache import SummaryCache, SentimentCache
+from .checkpoint import RunCheckpoint
+from .metrics import stage
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
 import pandas as pd
-import torch
+import numpy as np
 
-device = 0 if torch.cuda.is_available() else -1
-sentiment_analyzer = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english", device=device)
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_BATCH_TOKENS = 7000 #max tokens of texts per map call
+SAMPLING_MODES = ("random", "mmr")
 
-def analyze_sentiments_for_texts(texts) -> (str, list[dict]):
-    """
-    Analyze sentiment for a list of texts using the Hugging Face sentiment pipeline.
-    Returns an overall aggregated sentiment and a list of individual sentiment results.
-    """
-    try:
-        sentiments = []
-        for text in texts:
-            try:
-                result = sentiment_analyzer(text, truncation=True)
-                #result is typically a list with one dict: [{'label': 'POSITIVE', 'score': 0.99}]
-                sentiments.append(result[0])
-            except Exception as e:
-                #an case of error, mark it as unknown
-                sentiments.append({"label": "UNKNOWN", "score": 0})
-        #aggregate by majority label: count POSITIVE and NEGATIVE, then decide overall
-        pos_count = sum(1 for s in sentiments if s["label"] == "POSITIVE")
-        neg_count = sum(1 for s in sentiments if s["label"] == "NEGATIVE")
-
-        if neg_count == 0 and pos_count == 0: raise Exception("No sentiments calculated in batch")
-        count_ratio = 2 if (neg_count == 0) else pos_count/neg_count
-
-        if count_ratio >= 2:
-            overall = "POSITIVE"
-        elif count_ratio <= 0.5:
-            overall = "NEGATIVE"
-        else:
-            overall = "NEUTRAL"
-        return overall, sentiments
-
-    except Exception as e:
-        raise RuntimeError(f"Unexpected error during cluster sentiment analysis") from e
-
-def extract_summary_for_cluster(texts: list[str]) -> str:
-    """
-    Summarizes a cluster of semantically similar texts into one precise sentence.
-    Uses a two-stage summarization strategy to handle token limits and improve accuracy.
-    """
-    try:
-        client = OpenAI(api_key=get_openai_key())
-        
-        summary_batches = []
-        batches = batch_list(texts, model="gpt-4o-mini", max_tokens=7000)
-        
-        for batch in batches:
-            joined_batch = "\n".join(batch)
-
-            prompt = f"""
+def build_batch_prompt(batch: list[str]) -> str:
+    joined_batch = "\n".join(batch)
+    #prompt whitespace is kept as-is so summaries match earlier versions
+    return f"""
             You are an expert in discourse analysis and topic summarization.
             Your task is to analyze the following user-generated messages, which were grouped together by semantic similarity using embeddings and clustering.
             Summarize the *LARGEST recurring themes or central topic(s)* discussed in this cluster using **one short sentence**.
@@ -65,17 +26,9 @@ def extract_summary_for_cluster(texts: list[str]) -> str:
             ---
             """
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3
-            )
-            summary = response.choices[0].message.content.strip()
-            summary_batches.append(summary)
-
-        combined_summaries = "\n".join(summary_batches)
-
-        final_prompt = f"""
+def build_final_prompt(summaries: list[str]) -> str:
+    combined_summaries = "\n".join(summaries)
+    return f"""
         You are an expert in summarization.
         Here are partial summaries of different batches from a single conversation cluster:
         ---
@@ -85,13 +38,117 @@ def extract_summary_for_cluster(texts: list[str]) -> str:
         Avoid redundancy and avoid vague language. Be specific. If summaries are too broadly unrelated, mention this (call it noisy cluster).
         """
 
-        final_response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": final_prompt}],
-            temperature=0.2
-        )
+def chat_completion(client, prompt: str, temperature: float, cache=None, metrics=None, checkpoint=None) -> str:
+    '''
+    One chat completion for prompt. With a SummaryCache, a previous result for the same prompt,
+    model and temperature is returned without calling the API. Only real API calls are counted
+    in metrics. With a RunCheckpoint, completions finished by an interrupted run are reused and
+    each new one is appended to the run directory as soon as it arrives.
+    '''
+    if checkpoint is not None:
+        done = checkpoint.lookup_summary(prompt, SUMMARY_MODEL, temperature)
+        if done is not None:
+            return done
+
+    if cache is not None:
+        cached = cache.lookup(prompt, SUMMARY_MODEL, temperature)
+        if cached is not None:
+            return cached
+
+    response = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature
+    )
+    if metrics is not None:
+        metrics.record_usage(response)
+    completion = response.choices[0].message.content.strip()
 
-        return final_response.choices[0].message.content.strip()
+    if checkpoint is not None:
+        checkpoint.store_summary(prompt, SUMMARY_MODEL, temperature, completion)
+    if cache is not None:
+        cache.store(prompt, SUMMARY_MODEL, temperature, completion)
+    return completion
+
+def summarize_batch(client, batch: list[str], cache=None, metrics=None, checkpoint=None) -> str:
+    '''
+    Map stage: one partial summary for one token-limited batch of texts.
+    '''
+    return chat_completion(client, build_batch_prompt(batch), temperature=0.3, cache=cache, metrics=metrics, checkpoint=checkpoint)
+
+def reduce_summaries(client, summaries: list[str], cache=None, metrics=None, checkpoint=None) -> str:
+    '''
+    Reduce stage: synthesizes a cluster's partial summaries into one sentence.
+    '''
+    return chat_completion(client, build_final_prompt(summaries), temperature=0.2, cache=cache, metrics=metrics, checkpoint=checkpoint)
+
+def select_representatives(matrix, token_counts, token_budget: int=SUMMARY_BATCH_TOKENS, diversity: float=0.3, centroid=None) -> list[int]:
+    '''
+    Picks texts for a cluster summary by maximal marginal relevance. Each step takes the text with
+    the best (1 - diversity) * similarity to the cluster centroid - diversity * max similarity to
+    the texts already picked, among texts that still fit in token_budget. The result is a central
+    but varied set that fits in one summary call.
+
+    Parameters:
+        matrix (np.ndarray): Embeddings of the candidate texts.
+        token_counts (list[int]): Tokens of each candidate text.
+        token_budget (int): Max total tokens of the picked texts.
+        diversity (float): 0 picks the most central texts, higher values favour variety.
+        centroid (np.ndarray): Cluster centre to measure centrality against. Defaults to the candidates' mean.
+
+    Returns:
+        list[int]: Positions of the picked candidates, in pick order. If no text fits on its own,
+        the most central one is returned (batching then splits it).
+    '''
+    from sklearn.preprocessing import normalize
+
+    vectors = normalize(np.asarray(matrix, dtype=np.float32), norm='l2')
+    if centroid is None:
+        centroid = vectors.mean(axis=0)
+    centroid = np.asarray(centroid, dtype=np.float32)
+    centroid = centroid / (np.linalg.norm(centroid) or 1.0)
+
+    relevance = vectors @ centroid
+    tokens = np.asarray(token_counts, dtype=np.int64)
+    redundancy = np.zeros(len(vectors), dtype=np.float32) #max similarity to any picked text
+    available = tokens <= token_budget
+    remaining = token_budget
+    picked = []
+
+    while True:
+        candidates = np.flatnonzero(available & (tokens <= remaining))
+        if not len(candidates):
+            break
+        scores = (1 - diversity) * relevance[candidates] - diversity * redundancy[candidates]
+        best = int(candidates[np.argmax(scores)])
+        picked.append(best)
+        available[best] = False
+        remaining -= tokens[best]
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+
+    if not picked and len(vectors):
+        picked = [int(np.argmax(relevance))]
+    return picked
+
+def extract_summary_for_cluster(texts: list[str], cache=None, checkpoint=None, single_call: bool=False) -> str:
+    """
+    Summarizes a cluster of semantically similar texts into one precise sentence.
+    Uses a two-stage summarization strategy to handle token limits and improve accuracy.
+    With single_call=True, texts that fit in one batch get a single call, without the reduce stage.
+    Partial and final summaries are reused from cache (SummaryCache) when given, and are
+    checkpointed call by call to checkpoint (RunCheckpoint or run directory path) when given.
+    """
+    from openai import OpenAIError #imported lazily to keep package import cheap
+
+    try:
+        if isinstance(checkpoint, str):
+            checkpoint = RunCheckpoint(checkpoint)
+        client = get_openai_client()
+        batches = batch_list(texts, model=SUMMARY_MODEL, max_tokens=SUMMARY_BATCH_TOKENS, oversized="split")
+        summary_batches = [summarize_batch(client, batch, cache=cache, checkpoint=checkpoint) for batch in batches]
+        if single_call and len(summary_batches) == 1:
+            return summary_batches[0] #nothing to reduce
+        return reduce_summaries(client, summary_batches, cache=cache, checkpoint=checkpoint)
 
     except OpenAIError as e:
         raise RuntimeError(f"OpenAI request failed") from e
@@ -99,20 +156,139 @@ def extract_summary_for_cluster(texts: list[str]) -> str:
     except Exception as e:
         raise RuntimeError(f"Unexpected error during cluster summarization") from e
 
+def extract_summaries_for_clusters(text_lists: list[list[str]], max_concurrency: int=4, on_cluster_done=None, cache=None, metrics=None, checkpoint=None, single_call: bool=False) -> list[str]:
+    """
+    Summarizes many clusters concurrently with the same two-stage strategy as
+    extract_summary_for_cluster, and returns summaries in the order of text_lists.
+
+    The batch-level map calls of all clusters share one pool of max_concurrency requests in
+    flight. As soon as every map call of a cluster has finished, that cluster's reduce call
+    jumps ahead of the remaining map calls. With single_call=True, a cluster with a single batch
+    takes its map result as the summary, with no reduce call. All calls reuse one pooled client.
+
+    Parameters:
+        text_lists (list[list[str]]): Sampled texts of each cluster.
+        max_concurrency (int): Max chat completion requests in flight at once.
+        on_cluster_done (callable): Called (from the calling thread) each time a cluster finishes.
+        cache (SummaryCache): Optional cache of partial and final summaries.
+        metrics (PipelineMetrics): Counts the chat completion requests and tokens if given.
+        checkpoint (RunCheckpoint): Reuses and records finished map/reduce calls if given.
+        single_call (bool): Skip the reduce call of single-batch clusters (used by sampling='mmr').
+
+    Returns:
+        list[str]: One summary per cluster.
+    """
+    from openai import OpenAIError #imported lazily to keep package import cheap
+
+    try:
+        client = get_openai_client()
+        get_token_counter(SUMMARY_MODEL).count([text for texts in text_lists for text in texts]) #tokenize every cluster in one threaded pass
+        cluster_batches = [batch_list(texts, model=SUMMARY_MODEL, max_tokens=SUMMARY_BATCH_TOKENS, oversized="split") for texts in text_lists]
+        partials = [[None] * len(batches) for batches in cluster_batches]
+        remaining = [len(batches) for batches in cluster_batches]
+        summaries = [None] * len(text_lists)
+
+        map_jobs = deque((c, b) for c, batches in enumerate(cluster_batches) for b in range(len(batches)))
+        reduce_jobs = deque(c for c, count in enumerate(remaining) if count == 0) #empty clusters go straight to reduce
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            in_flight = {}
+
+            def fill_slots():
+                #reduce calls first, so finished clusters are not stuck behind queued map calls
+                while len(in_flight) < max(1, max_concurrency) and (reduce_jobs or map_jobs):
+                    if reduce_jobs:
+                        c = reduce_jobs.popleft()
+                        in_flight[executor.submit(reduce_summaries, client, partials[c], cache, metrics, checkpoint)] = ("reduce", c, None)
+                    else:
+                        c, b = map_jobs.popleft()
+                        in_flight[executor.submit(summarize_batch, client, cluster_batches[c][b], cache, metrics, checkpoint)] = ("map", c, b)
+
+            fill_slots()
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, c, b = in_flight.pop(future)
+                    result = future.result()
+                    if kind == "map":
+                        partials[c][b] = result
+                        remaining[c] -= 1
+                        if remaining[c] == 0 and single_call and len(partials[c]) == 1:
+                            summaries[c] = result #single batch: nothing to reduce
+                            if on_cluster_done:
+                                on_cluster_done()
+                        elif remaining[c] == 0:
+                            reduce_jobs.append(c)
+                    else:
+                        summaries[c] = result
+                        if on_cluster_done:
+                            on_cluster_done()
+                fill_slots()
+
+        return summaries
+
+    except OpenAIError as e:
+        raise RuntimeError(f"OpenAI request failed") from e
+
+    except Exception as e:
+        raise RuntimeError(f"Unexpected error during cluster summarization") from e
 
-def summarize_clusters(df: pd.DataFrame, max_sample_size: int=500, verbose=False) -> pd.DataFrame:
+def summarize_clusters(
+    df,
+    max_sample_size: int=500,
+    verbose=False,
+    sentiment_batch_size: int=32,
+    max_concurrency: int=1,
+    summary_cache=None,
+    metrics=None,
+    sampling="random",
+    summary_token_budget: int=SUMMARY_BATCH_TOKENS,
+    diversity: float=0.3,
+    checkpoint=None,
+    sentiment_backend: str=None,
+    sentiment_cache=None
+    ) -> pd.DataFrame:
     """
     Summarizes each text cluster by extracting the narrative and sentiment analysis of each cluster.
 
     Given a DataFrame of clustered text (as returned by `cluster_embeddings`), this function:
     - Samples up to max_sample_size messages per cluster
-    - Uses OpenAI Chat Completions to generate a one-line summary of each cluster's main theme (2-stages)
-    - Applies a Hugging Face sentiment model to determine overall cluster sentiment
+    - Uses OpenAI Chat Completions to generate a one-line summary of each cluster's main theme (2-stages),
+      with up to max_concurrency requests in flight across all clusters
+    - Applies a Hugging Face sentiment model to determine overall cluster sentiment. The sampled
+      texts of all clusters are deduplicated and scored together in length-sorted batches.
+
+    If df has a 'weight' column (see collapse_duplicates), texts are sampled with probability
+    proportional to their weight, each text's sentiment vote counts its weight, and the sampled
+    weights are returned in a 'weights' column.
+
+    With sampling='mmr' (needs embeddings), only a token-budgeted subset of each cluster's sample
+    goes into the summary prompt: texts are picked by maximal marginal relevance against the
+    cluster centroid (see select_representatives), so the summary sees central but varied texts and
+    most clusters need one chat call instead of several map calls plus a reduce call. Sentiment
+    still uses the whole sample.
+
+    With a sentiment_cache, texts scored by any earlier run (same model and backend) are not scored
+    again; the 'sentiment' stage records its hits, misses and hit rate.
+
+    With a checkpoint (RunCheckpoint), every finished chat completion and sentiment batch is
+    appended to the run directory. Sampling is seeded, so rerunning with the same checkpoint after
+    a failure rebuilds the same prompts and only calls the API for the unfinished ones.
 
     Parameters:
-        df (DataFrame): DataFrame containing clustered text data with a 'cluster' and 'text' column.
+        df (EmbeddingSet or DataFrame): Clustered text data with a 'cluster' and 'text' column.
         max_sample_size (int): max length of text list for each cluster being sampled.
         verbose (bool): show progress bars if True.
+        sentiment_batch_size (int): texts per sentiment model forward pass.
+        max_concurrency (int): max chat completion requests in flight at once. Default is 1 (sequential).
+        summary_cache (SummaryCache or str): reuse partial/final summaries of identical prompts, or a path to its sqlite file.
+        metrics (PipelineMetrics): records the 'summarization' and 'sentiment' stages if given.
+        sampling (str): 'random' summarizes the whole sample; 'mmr' a representative subset of it.
+        summary_token_budget (int): Max tokens of texts summarized per cluster with sampling='mmr'.
+        diversity (float): MMR trade-off with sampling='mmr', 0 (most central) to 1 (most varied).
+        checkpoint (RunCheckpoint or str): Run directory to checkpoint calls/batches to and resume from.
+        sentiment_backend (str): 'torch', 'int8', 'onnx' or 'onnx-int8' (see set_sentiment_backend). Default is the process-wide backend.
+        sentiment_cache (SentimentCache or str): reuse per-text sentiment results, or a path to its sqlite file.
 
     Returns:
         pd.DataFrame: A new DataFrame with columns:
@@ -121,55 +297,142 @@ def summarize_clusters(df: pd.DataFrame, max_sample_size: int=500, verbose=False
             - 'cluster_summary': Cluster summary (from GPT)
             - 'aggregated_sentiment': Overall sentiment label
             - 'all_sentiments': List of individual sentiment results per text
+            - 'weights': Weight of each sampled text (only if df has a 'weight' column)
     """
-    df = df.copy()
-    df = df.drop(columns=['embeddings']) #drop embeddings to reduce memory; not needed for summarization
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"sampling must be one of {SAMPLING_MODES}, got {sampling!r}.")
+    if isinstance(summary_cache, str):
+        summary_cache = SummaryCache(summary_cache)
+    if isinstance(sentiment_cache, str):
+        sentiment_cache = SentimentCache(sentiment_cache)
+    if isinstance(checkpoint, str):
+        checkpoint = RunCheckpoint(checkpoint)
+
+    matrix = None
+    if isinstance(df, EmbeddingSet):
+        matrix = df.matrix if sampling == "mmr" else None
+        df = df.df #embeddings only needed for mmr sampling
+    elif sampling == "mmr" and 'embeddings' in df.columns:
+        matrix = np.array(df['embeddings'].tolist(), dtype=np.float32)
+    if sampling == "mmr" and matrix is None:
+        raise ValueError("sampling='mmr' needs embeddings: pass an EmbeddingSet or a DataFrame with an 'embeddings' column.")
+    df = df.drop(columns=['embeddings'], errors='ignore') #drop embeddings to reduce memory; not needed for summarization
+
+    weighted = 'weight' in df.columns
 
     #group texts by cluster and sample up to max_sample texts per cluster
     grouped_texts = {}
-    grouped = df.groupby('cluster')
+    grouped_weights = {}
+    summary_texts = {}
+    grouped = df.assign(_row=np.arange(len(df))).groupby('cluster')
     for cluster, group in grouped:
         sample_size = min(max_sample_size, len(group))
-        grouped_texts[cluster] = group['text'].sample(n=sample_size, random_state=42).tolist()
+        if weighted:
+            #weighted sampling without replacement (Efraimidis-Spirakis): keep the largest u**(1/w)
+            keys = np.random.default_rng(42).random(len(group)) ** (1.0 / group['weight'].to_numpy(dtype=np.float64))
+            sample = group.iloc[np.argsort(-keys)[:sample_size]]
+            grouped_weights[cluster] = sample['weight'].tolist()
+        else:
+            sample = group.sample(n=sample_size, random_state=42)
+        grouped_texts[cluster] = sample['text'].tolist()
+
+        if sampling == "mmr":
+            #centroid of the whole cluster (by weight), candidates from the sample
+            rows = group['_row'].to_numpy()
+            weights = group['weight'].to_numpy(dtype=np.float64) if weighted else None
+            centroid = np.average(matrix[rows], axis=0, weights=weights)
+            token_counts = get_token_counter(SUMMARY_MODEL).count(grouped_texts[cluster])
+            picked = select_representatives(matrix[sample['_row'].to_numpy()], token_counts, token_budget=summary_token_budget, diversity=diversity, centroid=centroid)
+            summary_texts[cluster] = [grouped_texts[cluster][i] for i in picked]
     
 
     grouped_df = pd.DataFrame(list(grouped_texts.items()), columns=['cluster', 'text'])
     
+    if summary_cache is not None:
+        hits_before, misses_before = summary_cache.hits, summary_cache.misses
+    if checkpoint is not None:
+        reused_before = dict(checkpoint.reused)
+
     #use OpenAI Chat Completions to extract a concise summary (cluster label) for each cluster
-    cluster_summary = []
-    
     progress_context_summary = progress_bars(verbose, bars=True)
-    with progress_context_summary as progress:
+    with progress_context_summary as progress, stage(metrics, "summarization", rows_in=len(df)) as record:
+        on_cluster_done = None
         if verbose:
             task = progress.add_task("[cyan]Extracting summaries...", total=len(grouped_df['text']))
-            
-        for texts in grouped_df['text']:
-            summary = extract_summary_for_cluster(texts)
-            cluster_summary.append(summary)
+            on_cluster_done = lambda: progress.update(task, advance=1)
+
+        cluster_summary = extract_summaries_for_clusters(
+            [summary_texts[cluster] for cluster in grouped_df['cluster']] if sampling == "mmr" else grouped_df['text'].tolist(),
+            max_concurrency=max_concurrency,
+            on_cluster_done=on_cluster_done,
+            cache=summary_cache,
+            metrics=metrics,
+            checkpoint=checkpoint,
+            single_call=sampling == "mmr" #the default path keeps map -> reduce, so its output is unchanged
+        )
+        record["rows_out"] = len(cluster_summary)
+        if summary_cache is not None:
+            record["cache_hits"] = summary_cache.hits - hits_before
+            record["cache_misses"] = summary_cache.misses - misses_before
+        if checkpoint is not None:
+            record["checkpoint_hits"] = checkpoint.reused["summaries"] - reused_before["summaries"]
 
-            if verbose:
-                progress.update(task, advance=1)
+    if verbose and summary_cache is not None:
+        print(f"[SUMMARY CACHE]")
+        print(f"Hits: {summary_cache.hits - hits_before}")
+        print(f"Misses: {summary_cache.misses - misses_before}")
 
     grouped_df['cluster_summary'] = cluster_summary
     
-    #analyze sentiments for each cluster
-    aggregated_sentiments = []
-    all_sentiments = []
-
+    #analyze sentiments for all clusters in one batched pass
     progress_context_sentiment = progress_bars(verbose, bars=True)
-    with progress_context_sentiment as progress:
+    num_sampled = sum(len(texts) for texts in grouped_df['text'])
+    with progress_context_sentiment as progress, stage(metrics, "sentiment", rows_in=num_sampled) as record:
+        on_batch_done = None
         if verbose:
-            task = progress.add_task("[cyan]Extracting sentiments...", total=len(grouped_df['text']))
+            num_unique = len(set(text for texts in grouped_df['text'] for text in texts))
+            task = progress.add_task("[cyan]Extracting sentiments...", total=num_unique)
+            on_batch_done = lambda batch_len: progress.update(task, advance=batch_len)
+
+        if sentiment_cache is not None:
+            sentiment_hits_before, sentiment_misses_before = sentiment_cache.hits, sentiment_cache.misses
+        try:
+            cluster_sentiments = analyze_sentiments_for_clusters(
+                grouped_df['text'].tolist(),
+                batch_size=sentiment_batch_size,
+                on_batch_done=on_batch_done,
+                weight_lists=[grouped_weights[cluster] for cluster in grouped_df['cluster']] if weighted else None,
+                checkpoint=checkpoint,
+                backend=sentiment_backend,
+                cache=sentiment_cache
+            )
+        except Exception as e:
+            raise RuntimeError(f"Unexpected error during cluster sentiment analysis") from e
+        record["rows_out"] = len(cluster_sentiments)
+        if sentiment_cache is not None:
+            record["cache_hits"] = sentiment_cache.hits - sentiment_hits_before
+            record["cache_misses"] = sentiment_cache.misses - sentiment_misses_before
+            lookups = record["cache_hits"] + record["cache_misses"]
+            record["cache_hit_rate"] = record["cache_hits"] / lookups if lookups else 0.0
+        if checkpoint is not None:
+            record["checkpoint_hits"] = checkpoint.reused["sentiments"] - reused_before["sentiments"]
+
+    if verbose and sentiment_cache is not None:
+        print(f"[SENTIMENT CACHE]")
+        print(f"Hits: {sentiment_cache.hits - sentiment_hits_before}")
+        print(f"Misses: {sentiment_cache.misses - sentiment_misses_before}")
 
-        for texts in grouped_df['text']:
-            overall, sentiments = analyze_sentiments_for_texts(texts)
-            aggregated_sentiments.append(overall)
-            all_sentiments.append(sentiments)
+    if verbose and checkpoint is not None:
+        print(f"[CHECKPOINT]")
+        print(f"Summary calls reused: {checkpoint.reused['summaries'] - reused_before['summaries']}")
+        print(f"Sentiments reused: {checkpoint.reused['sentiments'] - reused_before['sentiments']}")
 
-            if verbose:
-                progress.update(task, advance=1)
+    aggregated_sentiments = [overall for overall, _ in cluster_sentiments]
+    all_sentiments = [sentiments for _, sentiments in cluster_sentiments]
     
     grouped_df['aggregated_sentiment'] = aggregated_sentiments
     grouped_df['all_sentiments'] = all_sentiments
+    if weighted:
+        grouped_df['weights'] = [grouped_weights[cluster] for cluster in grouped_df['cluster']]
     
     return grouped_df
\ No newline at end of file
@@ -0,0 +1,330 @@
+from .embedding_set import EmbeddingSet
+from .clustering import get_param_calcs, fit_pca_kwargs
+from .cache import hash_key
+from .metrics import stage
+from .utils import progress_bars
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import pandas as pd
+import numpy as np
+import tempfile
+import hashlib
+import shutil
+import json
+import time
+import os
+
+SWEEP_STAGES = ("pca", "umap", "hdbscan")
+SCORES = ("relative_validity", "dbcv")
+
+class StageCache:
+    """
+    Directory of intermediate clustering results, one file per key: arrays as .npy (read back
+    memory-mapped) and scores as .json. Files are written under a temporary name and renamed,
+    so parallel workers never see a partial result.
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def _write(self, path, write):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def load_array(self, key):
+        path = self._path(key, ".npy")
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+    def save_array(self, key, array):
+        self._write(self._path(key, ".npy"), lambda f: np.save(f, np.ascontiguousarray(array, dtype=np.float32)))
+
+    def load_json(self, key):
+        path = self._path(key, ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_json(self, key, value):
+        self._write(self._path(key, ".json"), lambda f: f.write(json.dumps(value).encode("utf-8")))
+
+def matrix_fingerprint(matrix, chunk_rows: int=65536) -> str:
+    '''
+    sha256 of the matrix shape and contents, read in chunks so memory-mapped matrices stay on disk.
+    '''
+    h = hashlib.sha256(str(matrix.shape).encode("utf-8"))
+    for start in range(0, len(matrix), chunk_rows):
+        h.update(np.ascontiguousarray(matrix[start:start + chunk_rows], dtype=np.float32).tobytes())
+    return h.hexdigest()
+
+def expand_grid(param_grid: dict) -> list[dict]:
+    '''
+    Every combination of param_grid, split by stage. Keys are '<stage>__<parameter>' with stage
+    one of pca, umap, hdbscan (e.g. 'umap__n_neighbors': [15, 30]).
+    '''
+    keys = sorted(param_grid)
+    for key in keys:
+        stage_name, _, name = key.partition("__")
+        if stage_name not in SWEEP_STAGES or not name:
+            raise ValueError(f"Grid key '{key}' must look like 'pca__...', 'umap__...' or 'hdbscan__...'.")
+
+    points = []
+    for values in product(*(param_grid[key] for key in keys)):
+        point = {stage_name: {} for stage_name in SWEEP_STAGES}
+        for key, value in zip(keys, values):
+            stage_name, _, name = key.partition("__")
+            point[stage_name][name] = value
+        points.append(point)
+    return points
+
+def score_clustering(reduced, labels, clusterer=None, score="relative_validity", sample_size: int=2000, random_state=42) -> float:
+    '''
+    Cluster quality of one HDBSCAN result, higher is better. 'relative_validity' is HDBSCAN's fast
+    DBCV approximation (needs gen_min_span_tree=True); 'dbcv' is the full density-based validity
+    index on a random sample of sample_size rows. Fewer than two clusters scores -1.
+    '''
+    if len(set(labels.tolist()) - {-1}) < 2:
+        return -1.0
+    if score == "relative_validity":
+        return float(clusterer.relative_validity_)
+
+    from hdbscan.validity import validity_index
+
+    rows = np.arange(len(labels))
+    if len(rows) > sample_size:
+        rows = np.sort(np.random.default_rng(random_state).choice(len(rows), sample_size, replace=False))
+    if len(set(labels[rows].tolist()) - {-1}) < 2:
+        return -1.0
+    return float(validity_index(np.asarray(reduced[rows], dtype=np.float64), labels[rows]))
+
+def _run_umap_group(cache_dir, pca_key, umap_key, umap_params, hdbscan_points, score, dbcv_sample_size):
+    '''
+    Process pool task: fits (or loads) one UMAP setting, then every HDBSCAN setting on top of it.
+    Returns (umap_cached, [(hdbscan_key, record, hdbscan_cached), ...]).
+    '''
+    import hdbscan
+
+    cache = StageCache(cache_dir)
+    reduced = cache.load_array(umap_key)
+    umap_cached = reduced is not None
+    if reduced is None:
+        import umap.umap_ as umap
+        import warnings
+
+        warnings.filterwarnings("ignore", message=".*n_jobs value 1 overridden.*")
+        reduced = umap.UMAP(**umap_params).fit_transform(cache.load_array(pca_key))
+        cache.save_array(umap_key, reduced)
+
+    results = []
+    for hdbscan_key, hdbscan_params in hdbscan_points:
+        record = cache.load_json(hdbscan_key)
+        hdbscan_cached = record is not None
+        if record is None:
+            start = time.perf_counter()
+            clusterer = hdbscan.HDBSCAN(**hdbscan_params)
+            labels = clusterer.fit_predict(reduced)
+            record = {
+                "score": score_clustering(reduced, labels, clusterer, score=score, sample_size=dbcv_sample_size),
+                "n_clusters": int(len(set(labels.tolist()) - {-1})),
+                "noise_fraction": float((labels == -1).mean()),
+                "hdbscan_time_s": time.perf_counter() - start
+            }
+            cache.save_json(hdbscan_key, record)
+        results.append((hdbscan_key, record, hdbscan_cached))
+    return umap_cached, results
+
+class SweepResult:
+    """
+    Outcome of sweep_clustering.
+
+    Attributes:
+        results (DataFrame): One row per grid point, best first: the swept parameters, score,
+            n_clusters, noise_fraction, and whether its UMAP/HDBSCAN results came from the cache.
+        best_params (dict): use_pca, pca_kwargs, umap_kwargs and hdbscan_kwargs of the best grid point,
+            ready for cluster_embeddings(embeddings, **best_params) or NarrativeMapper.cluster(**best_params).
+        best_score (float): Its score.
+        cache_dir (str): Where the intermediates are kept (None if they were removed).
+    """
+    def __init__(self, results: pd.DataFrame, best_params: dict, best_score: float, cache_dir=None):
+        self.results = results
+        self.best_params = best_params
+        self.best_score = best_score
+        self.cache_dir = cache_dir
+
+def sweep_clustering(
+    df,
+    param_grid: dict,
+    umap_kwargs=None,
+    hdbscan_kwargs=None,
+    pca_kwargs=None,
+    use_pca=True,
+    score="relative_validity",
+    dbcv_sample_size: int=2000,
+    max_workers: int=None,
+    cache_dir=None,
+    verbose=False,
+    metrics=None
+    ) -> SweepResult:
+    """
+    Runs the cluster_embeddings preprocessing (L2 normalization, PCA), UMAP and HDBSCAN for every
+    combination of param_grid, scores each result and recommends the best configuration.
+
+    Every intermediate is cached under a key of its input and parameters: the normalized PCA
+    projection per PCA setting, the UMAP embedding per (PCA, UMAP) setting, and the score per full
+    setting. A grid point therefore only recomputes from the first stage whose parameters changed,
+    and a repeated sweep with the same cache_dir reuses everything it already computed. PCA runs
+    once per setting in this process; each distinct UMAP setting is a task in a process pool that
+    fits UMAP once and then every HDBSCAN setting on top of it.
+
+    Parameters not in the grid come from umap_kwargs/hdbscan_kwargs/pca_kwargs, then from
+    get_param_calcs, as in cluster_embeddings. Only the euclidean metric is supported. Merging
+    is not part of the sweep: scores describe the raw HDBSCAN clusters.
+
+    Parameters:
+        df (EmbeddingSet or DataFrame): Embedded texts.
+        param_grid (dict): Lists of values keyed '<stage>__<parameter>', e.g.
+            {'umap__n_neighbors': [15, 30], 'hdbscan__min_cluster_size': [15, 50],
+             'hdbscan__cluster_selection_method': ['eom', 'leaf']}.
+        umap_kwargs, hdbscan_kwargs, pca_kwargs (dict): Base parameters shared by all grid points.
+        use_pca (bool): Apply PCA before UMAP (pca__ grid keys are ignored if False).
+        score (str): 'relative_validity' (fast DBCV approximation) or 'dbcv' (on a sample).
+        dbcv_sample_size (int): Rows scored with score='dbcv'.
+        max_workers (int): Processes for UMAP/HDBSCAN. 1 runs everything in this process. Defaults to the CPU count.
+        cache_dir (str): Keep intermediates here across sweeps. Defaults to a temporary directory removed afterwards.
+        verbose (bool): Shows a progress bar if True.
+        metrics (PipelineMetrics): Records 'sweep_pca' and 'sweep' stages if given.
+
+    Returns:
+        SweepResult: Scores of every grid point and the recommended parameters.
+    """
+    if score not in SCORES:
+        raise ValueError(f"score must be one of {SCORES}.")
+
+    if isinstance(df, EmbeddingSet):
+        matrix = df.matrix
+        df = df.df
+    else:
+        matrix = np.array(df['embeddings'].tolist(), dtype=np.float32)
+
+    base_umap = {'min_dist': 0.0, 'random_state': 42, 'metric': 'euclidean', **(umap_kwargs or {})}
+    base_hdbscan = {'metric': 'euclidean', **(hdbscan_kwargs or {})}
+    base_pca = {'n_components': 100, 'random_state': 42, **(pca_kwargs or {})}
+
+    keep_cache = cache_dir is not None
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix="narrative_mapper_sweep_")
+    cache = StageCache(cache_dir)
+    input_key = matrix_fingerprint(matrix)
+
+    #resolve every grid point to full parameters and stage keys
+    points = []
+    for overrides in expand_grid(param_grid):
+        pca_params = fit_pca_kwargs({**base_pca, **overrides['pca']}, len(matrix), matrix.shape[1]) if use_pca else None
+        umap_params = {**base_umap, **overrides['umap']}
+        hdbscan_params = {**base_hdbscan, **overrides['hdbscan']}
+        get_param_calcs(df, umap_kwargs=umap_params, hdbscan_kwargs=hdbscan_params)
+        if umap_params['metric'] != 'euclidean' or hdbscan_params['metric'] != 'euclidean':
+            raise ValueError("Parameter sweeps support the euclidean metric only.")
+        if score == "relative_validity":
+            hdbscan_params['gen_min_span_tree'] = True #needed for relative_validity_
+
+        pca_key = hash_key(input_key, "pca", json.dumps(pca_params, sort_keys=True, default=str))
+        umap_key = hash_key(pca_key, "umap", json.dumps(umap_params, sort_keys=True, default=str))
+        hdbscan_key = hash_key(umap_key, "hdbscan", json.dumps(hdbscan_params, sort_keys=True, default=str), score, dbcv_sample_size)
+        points.append({
+            "overrides": overrides, "pca": pca_params, "umap": umap_params, "hdbscan": hdbscan_params,
+            "pca_key": pca_key, "umap_key": umap_key, "hdbscan_key": hdbscan_key
+        })
+
+    try:
+        #normalization + PCA once per distinct PCA setting, in this process
+        from sklearn.decomposition import PCA
+        from sklearn.preprocessing import normalize
+
+        pca_settings = {point["pca_key"]: point["pca"] for point in points}
+        with stage(metrics, "sweep_pca", rows_in=len(matrix)) as record:
+            record["cache_hits"] = 0
+            for pca_key, pca_params in pca_settings.items():
+                if os.path.exists(cache._path(pca_key, ".npy")):
+                    record["cache_hits"] += 1
+                    continue
+                try:
+                    projected = normalize(matrix, norm='l2')
+                    if pca_params is not None:
+                        projected = PCA(**pca_params).fit_transform(projected)
+                    cache.save_array(pca_key, projected)
+
+                except Exception as e:
+                    raise RuntimeError(f"Error during PCA") from e
+            record["rows_out"] = len(pca_settings)
+
+        #one task per distinct UMAP setting, carrying every HDBSCAN setting that builds on it
+        groups = {}
+        for point in points:
+            group = groups.setdefault(point["umap_key"], {"pca_key": point["pca_key"], "umap": point["umap"], "hdbscan": {}})
+            group["hdbscan"][point["hdbscan_key"]] = point["hdbscan"]
+
+        records = {}
+        progress_context = progress_bars(verbose)
+        with stage(metrics, "sweep", rows_in=len(points)) as record, progress_context as progress:
+            if verbose:
+                task = progress.add_task("[cyan]Sweeping clustering parameters...", total=len(points))
+
+            def collect(umap_key, outcome):
+                umap_cached, results = outcome
+                for hdbscan_key, result, hdbscan_cached in results:
+                    records[hdbscan_key] = {**result, "umap_cached": umap_cached, "hdbscan_cached": hdbscan_cached}
+                if verbose:
+                    progress.update(task, advance=len(results))
+
+            tasks = [
+                (cache_dir, group["pca_key"], umap_key, group["umap"], list(group["hdbscan"].items()), score, dbcv_sample_size)
+                for umap_key, group in groups.items()
+            ]
+            try:
+                if max_workers == 1 or len(tasks) == 1:
+                    for args in tasks:
+                        collect(args[2], _run_umap_group(*args))
+                else:
+                    with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count(), len(tasks))) as executor:
+                        futures = {executor.submit(_run_umap_group, *args): args[2] for args in tasks}
+                        for future in as_completed(futures):
+                            collect(futures[future], future.result())
+
+            except Exception as e:
+                raise RuntimeError(f"Error during parameter sweep") from e
+            record["rows_out"] = len(records)
+            record["cache_hits"] = sum(result["hdbscan_cached"] for result in records.values())
+
+    finally:
+        if not keep_cache:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    rows = []
+    for i, point in enumerate(points):
+        row = {f"{stage_name}__{name}": value for stage_name in SWEEP_STAGES for name, value in point["overrides"][stage_name].items()}
+        row.update(records[point["hdbscan_key"]])
+        row["grid_index"] = i
+        rows.append(row)
+    results = pd.DataFrame(rows).sort_values(["score", "noise_fraction"], ascending=[False, True], kind="stable").reset_index(drop=True)
+
+    best = points[int(results.loc[0, "grid_index"])]
+    best_hdbscan = {key: value for key, value in best["hdbscan"].items() if key != 'gen_min_span_tree'}
+    best_params = {
+        'use_pca': best["pca"] is not None,
+        'pca_kwargs': best["pca"],
+        'umap_kwargs': best["umap"],
+        'hdbscan_kwargs': best_hdbscan
+    }
+
+    if verbose:
+        print(f"[SWEEP]")
+        print(f"Grid points: {len(points)} ({len(groups)} UMAP fits)")
+        print(f"Best score ({score}): {results.loc[0, 'score']:.4f}")
+        print(f"Best params: {', '.join(f'{key}={value}' for key, value in results.loc[0].items() if '__' in key)}")
+
+    return SweepResult(results, best_params, float(results.loc[0, "score"]), cache_dir=cache_dir if keep_cache else None)
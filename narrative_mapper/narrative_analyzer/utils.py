@@ -1,7 +1,10 @@
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeElapsedColumn, TimeRemainingColumn
 from contextlib import nullcontext
+from types import SimpleNamespace
+from collections import OrderedDict
+from .scheduler import RequestScheduler
+import threading
 import os
-import tiktoken
 
 def progress_bars(verbose, bars=True):
     '''
@@ -33,34 +36,227 @@ def get_openai_key():
         )
     return key
 
-def batch_list(big_list, model="gpt-4o-mini", max_tokens=2000):
+CHAT_COMPLETION_RESERVE = 256 #tokens budgeted for a chat completion that sets no max_tokens
+
+def _estimate_tokens(model, texts) -> int:
+    #tiktoken count for known models, else the usual ~4 characters per token
+    try:
+        return sum(get_token_counter(model).count(texts))
+    except Exception:
+        return sum(len(text) for text in texts) // 4 + 1
+
+def _usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+class _LimitedEndpoint:
+    def __init__(self, scheduler, endpoint, kind):
+        self._scheduler = scheduler
+        self._endpoint = endpoint
+        self._kind = kind
+
+    def _estimate(self, kwargs) -> int:
+        if self._kind == "embeddings":
+            texts = kwargs.get("input", [])
+            return _estimate_tokens(kwargs.get("model"), [texts] if isinstance(texts, str) else list(texts))
+        prompt = [str(message.get("content") or "") for message in kwargs.get("messages", [])]
+        completion = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or CHAT_COMPLETION_RESERVE
+        return _estimate_tokens(kwargs.get("model"), prompt) + completion
+
+    def create(self, **kwargs):
+        #tokens are only counted when there is a tpm budget to take them from
+        tokens = self._estimate(kwargs) if self._scheduler.tpm else 0
+        return self._scheduler.call(self._endpoint.create, tokens=tokens, usage_tokens=_usage_tokens, **kwargs)
+
+class RateLimitedClient:
+    """
+    Wraps an OpenAI client so that every embeddings/chat completions request made through it, from
+    any thread, goes through one RequestScheduler: a shared cap on requests in flight, optional
+    requests- and tokens-per-minute budgets, and retries of rate limits and transient errors.
+    Other attributes pass through to the wrapped client.
+
+    Parameters:
+        client (OpenAI): Client to wrap. Its own retries should be off (max_retries=0).
+        scheduler (RequestScheduler): Scheduler shared by all requests.
+    """
+    def __init__(self, client, scheduler: RequestScheduler):
+        self._client = client
+        self.scheduler = scheduler
+        self.embeddings = _LimitedEndpoint(scheduler, client.embeddings, "embeddings")
+        self.chat = SimpleNamespace(completions=_LimitedEndpoint(scheduler, client.chat.completions, "chat"))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+_clients = {}
+_clients_lock = threading.Lock()
+_scheduler = RequestScheduler()
+
+def set_openai_rate_limit(max_in_flight: int=None, rpm: int=None, tpm: int=None, max_retries: int=None):
+    '''
+    Replaces the process-wide RequestScheduler, so all OpenAI requests of the process share
+    max_in_flight, rpm and tpm, however many pipelines run at once. None leaves a limit off
+    (max_in_flight defaults to 64, max_retries to 6). Embedding batches shrink to suit tpm (see
+    RequestScheduler.batch_tokens).
+    '''
+    global _scheduler
+    settings = {"max_in_flight": max_in_flight or 64, "rpm": rpm, "tpm": tpm}
+    if max_retries is not None:
+        settings["max_retries"] = max_retries
+    with _clients_lock:
+        _scheduler = RequestScheduler(**settings)
+        for client_key, client in list(_clients.items()):
+            _clients[client_key] = RateLimitedClient(client._client, _scheduler)
+
+def get_openai_scheduler() -> RequestScheduler:
+    '''
+    Returns the RequestScheduler all OpenAI requests of the process go through.
+    '''
+    return _scheduler
+
+def get_openai_client():
+    '''
+    Returns a process-wide OpenAI client, so every request reuses one HTTP connection pool.
+    Clients are keyed by API key and OPENAI_BASE_URL, so changing either gets a new client.
+    Requests are paced and retried by the shared RequestScheduler (see set_openai_rate_limit).
+    '''
+    key = get_openai_key()
+    client_key = (key, os.getenv("OPENAI_BASE_URL"))
+    with _clients_lock:
+        if client_key not in _clients:
+            from openai import OpenAI #imported lazily to keep package import cheap
+            client = OpenAI(api_key=key, max_retries=0) #retries are left to the scheduler
+            _clients[client_key] = RateLimitedClient(client, _scheduler)
+        return _clients[client_key]
+
+class TokenCounter:
+    """
+    Token counts for one tiktoken encoding, memoized per text in a bounded LRU.
+
+    Texts not seen before are encoded together with encode_ordinary_batch across threads. Models
+    that share an encoding share one counter (see get_token_counter), so texts counted recently
+    (e.g. for sampling and then for batching) are not tokenized again. At most max_entries counts
+    are kept, so a long or streamed run does not keep every text it has seen alive.
+
+    Parameters:
+        encoding (tiktoken.Encoding): Encoding to count with.
+        num_threads (int): Threads used by tiktoken for bulk encoding.
+        max_entries (int): Most recently used texts whose counts are kept.
+    """
+    def __init__(self, encoding, num_threads=8, max_entries=100000):
+        self.encoding = encoding
+        self.num_threads = num_threads
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, texts: list[str]) -> list[int]:
+        '''
+        Returns the token count of each text, aligned with texts.
+        '''
+        counts = {}
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                if text in self._counts:
+                    self._counts.move_to_end(text)
+                    counts[text] = self._counts[text]
+        missing = [text for text in dict.fromkeys(texts) if text not in counts]
+        if missing:
+            #encode_ordinary treats special-token strings like '<|endoftext|>' as plain text instead of raising
+            tokens = self.encoding.encode_ordinary_batch(missing, num_threads=self.num_threads)
+            counts.update(zip(missing, map(len, tokens)))
+            with self._lock:
+                #only the most recent texts are kept; this call's counts are in counts either way
+                for text in missing[-self.max_entries:]:
+                    self._counts[text] = counts[text]
+                    self._counts.move_to_end(text)
+                while len(self._counts) > self.max_entries:
+                    self._counts.popitem(last=False)
+        return [counts[text] for text in texts]
+
+    def split(self, text: str, max_tokens: int) -> list[str]:
+        '''
+        Cuts text into consecutive pieces of at most max_tokens tokens each.
+        '''
+        tokens = self.encoding.encode_ordinary(text)
+        return [self.encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        '''
+        Keeps the first max_tokens tokens of text.
+        '''
+        return self.encoding.decode(self.encoding.encode_ordinary(text)[:max_tokens])
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+_token_counters = {}
+_token_counters_lock = threading.Lock()
+
+def get_token_counter(model: str) -> TokenCounter:
+    '''
+    Returns the process-wide TokenCounter for model's encoding, creating it on first use.
+    '''
+    counter = _token_counters.get(model)
+    if counter is None:
+        import tiktoken #imported lazily to keep package import cheap
+
+        encoding = tiktoken.encoding_for_model(model)
+        with _token_counters_lock:
+            #keyed by model and by encoding name, so models with the same encoding share counts
+            counter = _token_counters.setdefault(("encoding", encoding.name), TokenCounter(encoding))
+            _token_counters[model] = counter
+    return counter
+
+def batch_list(big_list, model="gpt-4o-mini", max_tokens=2000, oversized="truncate", max_text_tokens=None):
     """
     Splits a list of text strings into batches, ensuring each batch stays under the token limit.
 
+    Token counts come from the shared TokenCounter of the model, so texts are tokenized in bulk
+    and recently counted texts are not tokenized again.
+
     Args:
         big_list (list): List of text strings to be batched.
         model (str): Model name for tiktoken encoding.
         max_tokens (int): Max tokens allowed per batch (including some buffer).
+        oversized (str): What to do with a single text longer than max_tokens:
+            'truncate' keeps its first max_tokens tokens (one text in, one text out),
+            'split' cuts it into several texts of at most max_tokens tokens,
+            'keep' leaves it whole in a batch of its own (over the limit).
+        max_text_tokens (int): Length at which oversized applies, if above max_tokens. A text
+            between max_tokens and max_text_tokens gets a batch of its own instead, so batches
+            can be made smaller without cutting texts shorter.
 
     Returns:
         List[List[str]]: A list of batches.
     """
-    encoding = tiktoken.encoding_for_model(model)
+    if oversized not in ("truncate", "split", "keep"):
+        raise ValueError(f"oversized must be 'truncate', 'split' or 'keep', got {oversized!r}.")
+
+    text_limit = max(max_tokens, max_text_tokens or max_tokens)
+    counter = get_token_counter(model)
     batches = []
     current_batch = []
     current_tokens = 0
 
-    for text in big_list:
-        text_tokens = len(encoding.encode(text))
+    for text, text_tokens in zip(big_list, counter.count(big_list)):
+        pieces = [(text, text_tokens)]
+        if text_tokens > text_limit and oversized == "truncate":
+            pieces = [(counter.truncate(text, text_limit), text_limit)]
+        elif text_tokens > text_limit and oversized == "split":
+            parts = counter.split(text, text_limit)
+            pieces = list(zip(parts, counter.count(parts)))
 
-        #if adding this text exceeds the limit, start a new batch
-        if current_tokens + text_tokens > max_tokens:
-            batches.append(current_batch)
-            current_batch = []
-            current_tokens = 0
+        for piece, piece_tokens in pieces:
+            #if adding this text exceeds the limit, start a new batch
+            if current_batch and current_tokens + piece_tokens > max_tokens:
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
 
-        current_batch.append(text)
-        current_tokens += text_tokens
+            current_batch.append(piece)
+            current_tokens += piece_tokens
 
     #add any leftover batch
     if current_batch:
@@ -0,0 +1,201 @@
+from .cli import load_data, clustering_kwargs, build_embedder, write_log, create_map
+from narrative_mapper.narrative_analyzer.embeddings import get_embeddings
+from narrative_mapper.narrative_analyzer.summarize import summarize_clusters
+from narrative_mapper.narrative_analyzer.formatters import format_to_dict, write_by_text
+from narrative_mapper.narrative_analyzer.cache import EmbeddingCache, SummaryCache, SentimentCache
+from narrative_mapper.narrative_analyzer.artifacts import save_embedding_set
+from narrative_mapper.narrative_analyzer.dedup import collapse_duplicates
+from narrative_mapper.narrative_analyzer.sentiment import warm_up as warm_up_sentiment_model, set_sentiment_backend, SENTIMENT_BACKENDS
+from narrative_mapper.narrative_analyzer.utils import set_openai_rate_limit, get_openai_scheduler
+from narrative_mapper.narrative_analyzer.checkpoint import RunCheckpoint
+from .cluster_worker import init_cluster_worker, cluster_community
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import traceback
+import re
+import argparse
+import time
+import os
+import pandas as pd
+
+def parse_args():
+    #INPUT ARGUMENTS
+    parser = argparse.ArgumentParser(description="Run NarrativeMapper on every community in a manifest.")
+    parser.add_argument("manifest", type=str, help="Text file with one CSV path, or r/<subreddit>, per line.")
+
+    #FLAGS
+    parser.add_argument("--cache", action="store_true", help="Cache embeddings and summary pkl files to working directory.")
+    parser.add_argument("--embedding-cache", type=str, nargs="?", const="", default=None, help="Reuse embeddings of previously seen texts from an on-disk cache. Optionally takes the cache file path.")
+    parser.add_argument("--summary-cache", type=str, nargs="?", const="", default=None, help="Reuse partial and final cluster summaries from an on-disk cache. Optionally takes the cache file path.")
+    parser.add_argument("--sentiment-cache", type=str, nargs="?", const="", default=None, help="Reuse sentiment results of previously scored texts from an on-disk cache. Optionally takes the cache file path.")
+    parser.add_argument("--file-output", action="store_true", help="Output summaries to a text file per community in working directory.")
+    parser.add_argument("--export-format", type=str, choices=["parquet", "csv", "jsonl"], default=None, help="Also write one row per text to {name}_texts.<format> per community, cluster by cluster.")
+    parser.add_argument("--max-samples", type=int, default=500, help="Max amount of texts samples from clusters being used in summarization. Default is 500.")
+    parser.add_argument("--summary-sampling", type=str, choices=["random", "mmr"], default="random", help="'mmr' summarizes a token-budgeted set of central, varied texts per cluster (usually one chat call). Default is random.")
+    parser.add_argument("--random-state", type=int, default=42, help="Changes value to UMAP and PCA random state. Default value is 42.")
+    parser.add_argument("--no-pca", action="store_true", help="Allows user to skip PCA and go straight to UMAP.")
+    parser.add_argument("--dim-pca", type=int, default=100, help="Allows user to change PCA dim. Default is 100.")
+    parser.add_argument("--merge-threshold", type=float, default=0.25, help="Cosine distance below which cluster centroids are merged. Default is 0.25.")
+    parser.add_argument("--landmarks", type=int, default=None, help="Fit UMAP/HDBSCAN on this many landmark texts and assign the rest, for very large corpora.")
+    parser.add_argument("--dedup", type=str, choices=["exact", "near"], default=None, help="Collapse exact (or also near-duplicate) texts before embedding; counts are kept as weights.")
+    parser.add_argument("--near-dup-threshold", type=float, default=0.8, help="Jaccard similarity for --dedup near. Default is 0.8.")
+    parser.add_argument("--embedder", type=str, choices=["openai", "local", "onnx"], default="openai", help="Embedding backend: OpenAI API, or a local sentence-transformers model on CPU (PyTorch or ONNX). Default is openai.")
+    parser.add_argument("--embedding-model", type=str, default=None, help="Model for --embedder (OpenAI model name or sentence-transformers name/path).")
+    parser.add_argument("--embed-threads", type=int, default=None, help="CPU threads for local embedding inference.")
+    parser.add_argument("--sentiment-backend", type=str, choices=SENTIMENT_BACKENDS, default="torch", help="Sentiment model runtime: fp32 PyTorch, int8-quantized PyTorch, or ONNX Runtime (fp32 or int8). Default is torch.")
+    parser.add_argument("--sentiment-threads", type=int, default=None, help="Intra-op CPU threads for the sentiment model.")
+    parser.add_argument("--sentiment-interop-threads", type=int, default=None, help="Inter-op CPU threads for the sentiment model.")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Max OpenAI requests in flight at once, across all communities. Default is 8.")
+    parser.add_argument("--rpm", type=int, default=None, help="Max OpenAI requests per minute, across all communities.")
+    parser.add_argument("--tpm", type=int, default=None, help="Max OpenAI tokens per minute, across all communities. Embedding requests are made smaller to suit it.")
+    parser.add_argument("--parallel", type=int, default=4, help="Communities embedded/summarized at the same time. Default is 4.")
+    parser.add_argument("--run-dir", type=str, default=None, help="Checkpoint each community to <run-dir>/<name>/. Rerunning the same command resumes from it.")
+    parser.add_argument("--cluster-workers", type=int, default=None, help="Clustering processes. Default is the CPU count (at most one per community).")
+
+    return parser.parse_args()
+
+def read_manifest(path):
+    '''
+    One community per line: a CSV path, or r/<subreddit> to scrape it. Blank lines and lines
+    starting with # are skipped. Group names follow the single-run CLI (file path without
+    extension, or the subreddit name) and must be unique.
+    '''
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            source = line.strip()
+            if not source or source.startswith("#"):
+                continue
+            if source.startswith("r/"):
+                entries.append({'source': source[2:], 'name': source[2:], 'reddit': True})
+            else:
+                entries.append({'source': source, 'name': os.path.splitext(os.path.normpath(source))[0], 'reddit': False})
+
+    names = [entry['name'] for entry in entries]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Manifest has duplicate group names: {', '.join(duplicates)}")
+    return entries
+
+def open_checkpoint(entry, args):
+    '''
+    RunCheckpoint of one community under --run-dir (None without it). An existing one is resumed.
+    '''
+    if args.run_dir is None:
+        return None
+    directory = os.path.join(args.run_dir, re.sub(r"[^\w.-]+", "_", entry['name']))
+    return RunCheckpoint(directory, config={'source': entry['source'], 'reddit': entry['reddit']})
+
+def embed_community(entry, args, embedding_cache, embedder):
+    '''
+    Loads (or scrapes) one community and embeds it with the shared embedder (for OpenAI, through
+    the shared, rate-limited client).
+    '''
+    df = load_data(entry['source'], is_reddit_scrape=entry['reddit'])
+    if args.dedup:
+        df, _ = collapse_duplicates(df, near_duplicates=args.dedup == 'near', threshold=args.near_dup_threshold)
+    embeddings_df = get_embeddings(df, cache=embedding_cache, max_concurrency=args.max_concurrency, embedder=embedder, checkpoint=entry['checkpoint'])
+    if args.cache:
+        save_embedding_set(embeddings_df, f"{entry['name']}_embeddings") #cache embeddings artifact directory
+    return embeddings_df
+
+def summarize_community(entry, cluster_df, args, summary_cache, sentiment_cache):
+    summary_df = summarize_clusters(cluster_df, max_sample_size=args.max_samples, max_concurrency=args.max_concurrency, summary_cache=summary_cache, sampling=args.summary_sampling, checkpoint=entry['checkpoint'], sentiment_cache=sentiment_cache)
+    if args.cache:
+        summary_df.to_pickle(f"{entry['name']}_summary.pkl") #cache summary df
+    return summary_df
+
+def run_batch(entries, args):
+    '''
+    Runs every community through the pipeline in one process.
+
+    Embedding and summarization of up to args.parallel communities run on threads that share one
+    rate-limited OpenAI client (args.max_concurrency requests in flight, args.rpm requests and
+    args.tpm tokens per minute, in total) and one sentiment model, loaded once. Each community is clustered in a process pool as
+    soon as its embeddings are done, so API-bound and CPU-bound stages of different communities
+    overlap. A community that fails at any stage is reported and skipped; the others carry on.
+
+    Returns:
+        (dict, dict): cluster count of each finished community, and (stage, error) of each failed one.
+    '''
+    set_openai_rate_limit(max_in_flight=args.max_concurrency, rpm=args.rpm, tpm=args.tpm)
+    set_sentiment_backend(args.sentiment_backend, intra_op_threads=args.sentiment_threads, inter_op_threads=args.sentiment_interop_threads)
+    warm_up_sentiment_model()
+
+    embedding_cache = EmbeddingCache(args.embedding_cache or None) if args.embedding_cache is not None else None
+    summary_cache = SummaryCache(args.summary_cache or None) if args.summary_cache is not None else None
+    sentiment_cache = SentimentCache(args.sentiment_cache or None) if args.sentiment_cache is not None else None
+    embedder = build_embedder(args) #one instance, so a local model is loaded once
+    kwargs = clustering_kwargs({
+        'dim_pca': args.dim_pca,
+        'random_state': args.random_state,
+        'no_pca': args.no_pca,
+        'merge_threshold': args.merge_threshold,
+        'landmarks': args.landmarks
+    })
+
+    for entry in entries:
+        entry['checkpoint'] = open_checkpoint(entry, args)
+
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(args.cluster_workers or cpu_count, len(entries)))
+    finished, failed = {}, {}
+
+    #spawned, not forked: by now this process runs threads and has torch loaded, which a fork would copy mid-state
+    with ThreadPoolExecutor(max_workers=args.parallel) as io_pool, \
+         ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_cluster_worker, initargs=(max(1, cpu_count // workers),)) as cluster_pool:
+        pending = {io_pool.submit(embed_community, entry, args, embedding_cache, embedder): ("embedding", entry) for entry in entries}
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, entry = pending.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    failed[entry['name']] = (step, e)
+                    print(f"[FAILED] {entry['name']} ({step}): {e}")
+                    traceback.print_exception(type(e), e, e.__traceback__)
+                    continue
+
+                if step == "embedding":
+                    pending[cluster_pool.submit(cluster_community, value, kwargs)] = ("clustering", entry)
+                elif step == "clustering":
+                    pending[io_pool.submit(summarize_community, entry, value, args, summary_cache, sentiment_cache)] = ("summarization", entry)
+                else:
+                    try:
+                        output = format_to_dict(value)['clusters']
+                        write_log(output, entry['name'], args.file_output)
+                        create_map(pd.DataFrame(output), entry['name'])
+                        if args.export_format:
+                            write_by_text(value, f"{entry['name']}_texts.{args.export_format}", entry['name'])
+                    except Exception as e:
+                        failed[entry['name']] = ("output", e)
+                        print(f"[FAILED] {entry['name']} (output): {e}")
+                        continue
+                    finished[entry['name']] = len(output)
+                    print(f"[DONE] {entry['name']}: {len(output)} clusters")
+
+    return finished, failed
+
+def main():
+    '''
+    Batch entry point: runs every community of a manifest, then reports which ones failed.
+    '''
+    try:
+        args = parse_args()
+        entries = read_manifest(args.manifest)
+        start = time.perf_counter()
+        finished, failed = run_batch(entries, args)
+
+        print(f"[BATCH] {len(finished)} of {len(entries)} communities done in {time.perf_counter() - start:.1f}s")
+        stats = get_openai_scheduler().stats()
+        print(f"[BATCH] OpenAI requests: {stats['requests']} sent, {stats['retries']} retried ({stats['throttled']} rate limited), {stats['wait_s']:.1f}s waited")
+        for name, (step, error) in failed.items():
+            print(f"[BATCH] {name} failed during {step}: {error}")
+
+    except Exception as e:
+        raise RuntimeError(f"Error running batch CLI") from e
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(entries)} communities failed: {', '.join(failed)}")
@@ -13,7 +13,17 @@ if not openai_key:
 from narrative_mapper.narrative_analyzer.embeddings import get_embeddings
 from narrative_mapper.narrative_analyzer.clustering import cluster_embeddings
 from narrative_mapper.narrative_analyzer.summarize import summarize_clusters
-from narrative_mapper.narrative_analyzer.formatters import format_to_dict
+from narrative_mapper.narrative_analyzer.formatters import format_to_dict, write_by_text
+from narrative_mapper.narrative_analyzer.cache import EmbeddingCache, SummaryCache, SentimentCache
+from narrative_mapper.narrative_analyzer.embedding_set import EmbeddingSet
+from narrative_mapper.narrative_analyzer.artifacts import save_embedding_set, load_embedding_set, is_embedding_artifact
+from narrative_mapper.narrative_analyzer.embedders import get_embedder, EMBEDDING_MODEL
+from narrative_mapper.narrative_analyzer.metrics import PipelineMetrics
+from narrative_mapper.narrative_analyzer.streaming import embed_csv
+from narrative_mapper.narrative_analyzer.dedup import collapse_duplicates
+from narrative_mapper.narrative_analyzer.checkpoint import RunCheckpoint, is_run_dir
+from narrative_mapper.narrative_analyzer.utils import set_openai_rate_limit, get_openai_scheduler
+from narrative_mapper.narrative_analyzer.sentiment import set_sentiment_backend, SENTIMENT_BACKENDS
 from .cli_utils import scrape_subreddit, create_map
 from datetime import datetime
 import logging
@@ -25,26 +35,96 @@ import pickle
 def parse_args():
     #INPUT ARGUMENTS
     parser = argparse.ArgumentParser(description="Run NarrativeMapper on this file.")
-    parser.add_argument("file_name", type=str, help="file path")
+    parser.add_argument("file_name", type=str, nargs="?", help="file path (optional with --resume)")
     
     #FLAGS
     parser.add_argument("--verbose", action="store_true", help="Print/show detailed parameter scaling info and progress bars.")
     parser.add_argument("--cache", action="store_true", help="Cache embeddings and summary pkl files to working directory.")
+    parser.add_argument("--embedding-cache", type=str, nargs="?", const="", default=None, help="Reuse embeddings of previously seen texts from an on-disk cache. Optionally takes the cache file path.")
+    parser.add_argument("--summary-cache", type=str, nargs="?", const="", default=None, help="Reuse partial and final cluster summaries from an on-disk cache. Optionally takes the cache file path.")
+    parser.add_argument("--sentiment-cache", type=str, nargs="?", const="", default=None, help="Reuse sentiment results of previously scored texts from an on-disk cache. Optionally takes the cache file path.")
     parser.add_argument("--load-embeddings", action="store_true", help="Use embeddings pkl as file-path. Skips previous parts of the pipeline.")
     parser.add_argument("--load-summary", action="store_true", help="Use summary pkl as file-path. Skips previous parts of the pipeline.")
     parser.add_argument("--file-output", action="store_true", help="Output summaries to text file in working directory.")
     parser.add_argument("--max-samples", type=int, default=500, help="Max amount of texts samples from clusters being used in summarization. Default is 500.")
+    parser.add_argument("--summary-sampling", type=str, choices=["random", "mmr"], default="random", help="'mmr' summarizes a token-budgeted set of central, varied texts per cluster (usually one chat call). Default is random.")
     parser.add_argument("--random-state", type=int, default=42, help="Changes value to UMAP and PCA random state. Default value is 42.")
     parser.add_argument("--no-pca", action="store_true", help="Allows user to skip PCA and go straight to UMAP.")
     parser.add_argument("--dim-pca", type=int, default=100, help="Allows user to change PCA dim. Default is 100.")
+    parser.add_argument("--merge-threshold", type=float, default=0.25, help="Cosine distance below which cluster centroids are merged. Default is 0.25.")
+    parser.add_argument("--landmarks", type=int, default=None, help="Fit UMAP/HDBSCAN on this many landmark texts and assign the rest, for very large corpora.")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Max OpenAI requests in flight at once. Default is 4.")
+    parser.add_argument("--rpm", type=int, default=None, help="Max OpenAI requests per minute. Requests over the budget wait instead of being rejected.")
+    parser.add_argument("--tpm", type=int, default=None, help="Max OpenAI tokens per minute. Embedding requests are made smaller to suit it.")
+    parser.add_argument("--embedder", type=str, choices=["openai", "local", "onnx"], default="openai", help="Embedding backend: OpenAI API, or a local sentence-transformers model on CPU (PyTorch or ONNX). Default is openai.")
+    parser.add_argument("--embedding-model", type=str, default=None, help="Model for --embedder (OpenAI model name or sentence-transformers name/path).")
+    parser.add_argument("--embed-threads", type=int, default=None, help="CPU threads for local embedding inference.")
+    parser.add_argument("--sentiment-backend", type=str, choices=SENTIMENT_BACKENDS, default="torch", help="Sentiment model runtime: fp32 PyTorch, int8-quantized PyTorch, or ONNX Runtime (fp32 or int8). Default is torch.")
+    parser.add_argument("--sentiment-threads", type=int, default=None, help="Intra-op CPU threads for the sentiment model.")
+    parser.add_argument("--sentiment-interop-threads", type=int, default=None, help="Inter-op CPU threads for the sentiment model.")
+    parser.add_argument("--stream", action="store_true", help="Read and embed the CSV in chunks into a {file}_embeddings/ artifact, for files too large to load at once.")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Rows per chunk with --stream. Default is 10000.")
+    parser.add_argument("--dedup", type=str, choices=["exact", "near"], default=None, help="Collapse exact (or also near-duplicate) texts before embedding; counts are kept as weights. Not available with --stream.")
+    parser.add_argument("--near-dup-threshold", type=float, default=0.8, help="Jaccard similarity for --dedup near. Default is 0.8.")
+    parser.add_argument("--export", type=str, default=None, help="Also write one row per text (cluster, summary, sentiment) to this .parquet, .csv or .jsonl file, cluster by cluster.")
+    parser.add_argument("--profile", type=str, default=None, help="Write per-stage time, memory, row counts and API usage to this JSON file.")
     parser.add_argument("--reddit", action="store_true", help="Full reddit pipeline. Replace file-path with subreddit name.")
+    parser.add_argument("--run-dir", type=str, default=None, help="Checkpoint finished embedding batches, summary calls and sentiment batches to this append-only run directory.")
+    parser.add_argument("--resume", type=str, default=None, help="Continue the run in this run directory with its recorded file and options, reusing every finished batch.")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.file_name is None and args.resume is None:
+        parser.error("file_name is required unless --resume is given.")
+    if args.stream and args.dedup:
+        #dedup needs every text at once, which --stream exists to avoid
+        parser.error("--dedup cannot be combined with --stream.")
+    return args
 
-def load_data(file_path, load_embeddings=False, load_summary=False, is_reddit_scrape=False):
+RUN_ARGS_EXCLUDED = ("verbose", "profile", "resume", "run_dir") #per-invocation flags, not part of a run
+
+def open_run_dir(args):
+    '''
+    RunCheckpoint for --run-dir or --resume (None without either). A new run directory records
+    the run's file and options; --resume restores them into args, so the resumed run rebuilds
+    the same batches and prompts.
+    '''
+    if args.resume is not None:
+        if not is_run_dir(args.resume):
+            raise ValueError(f"{args.resume} is not a run directory (no run.json). Start one with --run-dir.")
+        checkpoint = RunCheckpoint(args.resume)
+        recorded = checkpoint.config.get("args", {})
+        if args.file_name is not None and args.file_name != recorded.get("file_name"):
+            raise ValueError(f"{args.resume} is a run of {recorded.get('file_name')!r}, not {args.file_name!r}.")
+        for key, value in recorded.items():
+            setattr(args, key, value)
+        print(f"[RESUME] {args.resume}: {checkpoint.stats()}")
+        return checkpoint
+
+    if args.run_dir is not None:
+        if is_run_dir(args.run_dir):
+            raise ValueError(f"{args.run_dir} already holds a run. Use --resume {args.run_dir} to continue it.")
+        recorded = {key: value for key, value in vars(args).items() if key not in RUN_ARGS_EXCLUDED}
+        return RunCheckpoint(args.run_dir, config={"args": recorded})
+    return None
+
+def build_embedder(args):
+    '''
+    Embedder for the --embedder, --embedding-model and --embed-threads flags.
+    '''
+    if args.embedder == "openai":
+        return get_embedder("openai", model=args.embedding_model)
+    return get_embedder(args.embedder, model=args.embedding_model, num_threads=args.embed_threads)
+
+def load_data(file_path, load_embeddings=False, load_summary=False, is_reddit_scrape=False, model=EMBEDDING_MODEL):
     try:
-        if load_embeddings: 
-            df = pd.read_pickle(file_path)
+        if load_embeddings and is_embedding_artifact(file_path):
+            df = load_embedding_set(file_path, mmap=True, model=model) #matrix is memory-mapped, not read into RAM
+            if 'text' not in df.df.columns:
+                raise ValueError("Input file must contain a 'text' column.")
+            return df
+
+        elif load_embeddings: 
+            df = pd.read_pickle(file_path) #legacy pickle cache
             if 'embeddings' not in df.columns:
                 raise ValueError("Input file must contain a 'embeddings' column.")
 
@@ -69,6 +149,33 @@ def load_data(file_path, load_embeddings=False, load_summary=False, is_reddit_sc
 
     return df
 
+def clustering_kwargs(mapper_args):
+    '''
+    cluster_embeddings keyword arguments for the CLI flags.
+    '''
+    pca_kwargs = {
+        'n_components': mapper_args['dim_pca'], 
+        'random_state': mapper_args['random_state']
+        }
+    umap_kwargs = {
+        'random_state': mapper_args['random_state'],
+        'min_dist': 0.0, 
+        'low_memory': True,
+        'metric': 'euclidean'
+        }
+    hdbscan_kwargs = {
+        'metric': 'euclidean',
+        'cluster_selection_method': 'leaf'
+    }
+    return {
+        'umap_kwargs': umap_kwargs,
+        'hdbscan_kwargs': hdbscan_kwargs,
+        'pca_kwargs': pca_kwargs,
+        'use_pca': not mapper_args['no_pca'], #since no_pca == True means we dont want PCA
+        'merge_threshold': mapper_args['merge_threshold'],
+        'landmark_size': mapper_args['landmarks']
+    }
+
 def run_mapper(df, group_name, verbose, **mapper_args):
     '''
     Runs NarrativeMapper logic to obtain main narratives/topics and sentiments.
@@ -77,38 +184,58 @@ def run_mapper(df, group_name, verbose, **mapper_args):
         summary_df = df #skip pipeline if user loads summary_df
     else:
         if mapper_args['load_embeddings']: 
-            embeddings_df = df #skip embeddings if user loads embeddings df
+            #skip embeddings if user loads embeddings artifact (or legacy df)
+            embeddings_df = df if isinstance(df, EmbeddingSet) else EmbeddingSet.from_frame(df, model=mapper_args['embedder'].model)
         else: 
-            embeddings_df = get_embeddings(df, verbose=verbose)
+            embedding_cache = mapper_args['embedding_cache']
+            if embedding_cache is not None:
+                embedding_cache = EmbeddingCache(embedding_cache or None) #empty flag value means default location
 
-            if mapper_args['cache']:
-                embeddings_df.to_pickle(f"{group_name}_embeddings.pkl") #cache embeddings df
+            if mapper_args['stream']:
+                #df is the CSV path here; the artifact doubles as the on-disk matrix, so it is always written
+                embeddings_df = embed_csv(
+                    df,
+                    f"{group_name}_embeddings",
+                    chunk_size=mapper_args['chunk_size'],
+                    verbose=verbose,
+                    cache=embedding_cache,
+                    max_concurrency=mapper_args['max_concurrency'],
+                    metrics=mapper_args['metrics'],
+                    embedder=mapper_args['embedder'],
+                    checkpoint=mapper_args['checkpoint']
+                )
+            else:
+                if mapper_args['dedup']:
+                    df, _ = collapse_duplicates(df, near_duplicates=mapper_args['dedup'] == 'near', threshold=mapper_args['near_dup_threshold'])
+                embeddings_df = get_embeddings(df, verbose=verbose, cache=embedding_cache, max_concurrency=mapper_args['max_concurrency'], metrics=mapper_args['metrics'], embedder=mapper_args['embedder'], checkpoint=mapper_args['checkpoint'])
+
+                if mapper_args['cache']:
+                    save_embedding_set(embeddings_df, f"{group_name}_embeddings") #cache embeddings artifact directory
 
-        pca_kwargs = {
-            'n_components': mapper_args['dim_pca'], 
-            'random_state': mapper_args['random_state']
-            }
-        umap_kwargs = {
-            'random_state': mapper_args['random_state'],
-            'min_dist': 0.0, 
-            'low_memory': True,
-            'metric': 'euclidean'
-            }
-        hdbscan_kwargs = {
-            'metric': 'euclidean',
-            'cluster_selection_method': 'leaf'
-        }
-        
         cluster_df = cluster_embeddings(
             df=embeddings_df,
             verbose=verbose,
-            umap_kwargs=umap_kwargs,
-            hdbscan_kwargs=hdbscan_kwargs,
-            pca_kwargs=pca_kwargs,
-            use_pca= not mapper_args['no_pca'] #since no_pca == True means we dont want PCA
+            metrics=mapper_args['metrics'],
+            **clustering_kwargs(mapper_args)
         )
     
-        summary_df = summarize_clusters(df=cluster_df, verbose=verbose, max_sample_size=mapper_args['max_sample_size'])
+        summary_cache = mapper_args['summary_cache']
+        if summary_cache is not None:
+            summary_cache = SummaryCache(summary_cache or None) #empty flag value means default location
+        sentiment_cache = mapper_args['sentiment_cache']
+        if sentiment_cache is not None:
+            sentiment_cache = SentimentCache(sentiment_cache or None)
+        summary_df = summarize_clusters(
+            df=cluster_df,
+            verbose=verbose,
+            max_sample_size=mapper_args['max_sample_size'],
+            max_concurrency=mapper_args['max_concurrency'],
+            summary_cache=summary_cache,
+            sentiment_cache=sentiment_cache,
+            metrics=mapper_args['metrics'],
+            sampling=mapper_args['summary_sampling'],
+            checkpoint=mapper_args['checkpoint']
+        )
 
         if mapper_args['cache']:
             summary_df.to_pickle(f"{group_name}_summary.pkl") #cache summary df
@@ -124,15 +251,27 @@ def write_log(output, group_name, file_output):
     if file_output:
         handlers.append(logging.FileHandler(log_path, mode='w', encoding='utf-8'))
 
-    logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=handlers)
-    logging.info(f"Run Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    logging.info(f"Online Group Name: {group_name}\n")
+    #own logger per call, so batch runs write each group to its own file
+    logger = logging.getLogger(f"narrative_mapper.output.{group_name}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+
+    try:
+        logger.info(f"Run Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        logger.info(f"Online Group Name: {group_name}\n")
 
-    for cluster in output:
-        logging.info(f"Summary: {cluster['cluster_summary']}")
-        logging.info(f"Sentiment: {cluster['sentiment']}")
-        logging.info(f"Text Samples: {cluster['text_count']}")
-        logging.info("---")
+        for cluster in output:
+            logger.info(f"Summary: {cluster['cluster_summary']}")
+            logger.info(f"Sentiment: {cluster['sentiment']}")
+            logger.info(f"Text Samples: {cluster['text_count']}")
+            logger.info("---")
+    finally:
+        for handler in handlers:
+            logger.removeHandler(handler)
+            handler.close()
 
 def main():
     '''
@@ -140,24 +279,55 @@ def main():
     '''
     try:
         args = parse_args()
+        checkpoint = open_run_dir(args) #with --resume, restores the run's options into args first
+        if args.rpm or args.tpm:
+            set_openai_rate_limit(rpm=args.rpm, tpm=args.tpm)
+        set_sentiment_backend(args.sentiment_backend, intra_op_threads=args.sentiment_threads, inter_op_threads=args.sentiment_interop_threads)
         load_embeddings = args.load_embeddings
         load_summary = args.load_summary
         is_reddit_scrape = args.reddit
         mapper_args = {
             'random_state': args.random_state,
             'max_sample_size': args.max_samples,
+            'summary_sampling': args.summary_sampling,
             'no_pca': args.no_pca,
             'dim_pca': args.dim_pca,
             'cache': args.cache,
+            'embedding_cache': args.embedding_cache,
+            'summary_cache': args.summary_cache,
+            'sentiment_cache': args.sentiment_cache,
+            'max_concurrency': args.max_concurrency,
+            'merge_threshold': args.merge_threshold,
+            'landmarks': args.landmarks,
             'load_embeddings': load_embeddings,
-            'load_summary': load_summary
+            'load_summary': load_summary,
+            'stream': args.stream,
+            'chunk_size': args.chunk_size,
+            'dedup': args.dedup,
+            'near_dup_threshold': args.near_dup_threshold,
+            'metrics': PipelineMetrics() if args.profile else None,
+            'embedder': build_embedder(args),
+            'checkpoint': checkpoint
             }
-        online_group_name = os.path.splitext(args.file_name)[0]
+        online_group_name = os.path.splitext(os.path.normpath(args.file_name))[0]
 
-        df = load_data(args.file_name, load_embeddings=load_embeddings, load_summary=load_summary, is_reddit_scrape=args.reddit)
+        if args.stream:
+            df = args.file_name #read chunk by chunk inside run_mapper
+        else:
+            df = load_data(args.file_name, load_embeddings=load_embeddings, load_summary=load_summary, is_reddit_scrape=args.reddit, model=mapper_args['embedder'].model)
         summary_df = run_mapper(df, online_group_name, verbose=args.verbose, **mapper_args)
+        if args.profile:
+            mapper_args['metrics'].to_json(args.profile)
+        if args.verbose:
+            stats = get_openai_scheduler().stats()
+            print(f"[OPENAI REQUESTS]")
+            print(f"Sent: {stats['requests']}")
+            print(f"Retried: {stats['retries']} ({stats['throttled']} rate limited)")
+            print(f"Waited: {stats['wait_s']:.1f}s")
         output = format_to_dict(summary_df)['clusters']
         write_log(output, online_group_name, args.file_output)
+        if args.export:
+            write_by_text(summary_df, args.export, online_group_name)
 
         map_df = pd.DataFrame(output)
         create_map(map_df, online_group_name)
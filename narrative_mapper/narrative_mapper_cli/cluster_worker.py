@@ -0,0 +1,16 @@
+from narrative_mapper.narrative_analyzer.clustering import cluster_embeddings
+import os
+
+#entry points of the batch CLI's clustering processes. They are spawned, so they import this module
+#instead of the CLI (and with it the OpenAI client, the sentiment model and scraping)
+
+def init_cluster_worker(threads):
+    #split the machine between clustering processes instead of each using every core
+    for var in ("NUMBA_NUM_THREADS", "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    #numpy's BLAS is already loaded by the time this runs (numba is not), so limit it directly
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(threads)
+
+def cluster_community(embeddings_df, kwargs):
+    return cluster_embeddings(embeddings_df, **kwargs)
@@ -0,0 +1,103 @@
+import numpy as np
+
+from narrative_mapper.narrative_analyzer import sentiment
+from narrative_mapper.narrative_analyzer.cache import EmbeddingCache, SummaryCache, SentimentCache
+
+def vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+def test_embedding_hit_returns_stored_vector(tmp_path):
+    texts = ["first text", "second text", "third text"]
+    stored = vectors(len(texts))
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    cache.store(texts, "model-a", stored)
+    cache.close()
+
+    reopened = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    found = reopened.lookup(["second text", "unseen text", "first text"], "model-a")
+    assert np.array_equal(found[0], stored[1])
+    assert found[1] is None
+    assert np.array_equal(found[2], stored[0])
+    assert reopened.stats()["hits"] == 2 and reopened.stats()["misses"] == 1
+    reopened.close()
+
+def test_embedding_key_depends_on_model(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    cache.store(["same text"], "model-a", vectors(1))
+    assert cache.lookup(["same text"], "model-b") == [None]
+    assert cache.lookup(["same text"], "model-a")[0] is not None
+    cache.close()
+
+def test_summary_hit_returns_stored_summary(tmp_path):
+    cache = SummaryCache(str(tmp_path / "summaries.sqlite"))
+    cache.store("Summarize these comments: a, b", "gpt-4o-mini", 0.5, "People argue about a and b.")
+    cache.close()
+
+    reopened = SummaryCache(str(tmp_path / "summaries.sqlite"))
+    assert reopened.lookup("Summarize these comments: a, b", "gpt-4o-mini", 0.5) == "People argue about a and b."
+    reopened.close()
+
+def test_summary_key_depends_on_prompt_model_and_temperature(tmp_path):
+    cache = SummaryCache(str(tmp_path / "summaries.sqlite"))
+    cache.store("Summarize these comments: a, b", "gpt-4o-mini", 0.5, "summary")
+    assert cache.lookup("Summarize these comments: a, c", "gpt-4o-mini", 0.5) is None
+    assert cache.lookup("Summarize the comments: a, b", "gpt-4o-mini", 0.5) is None
+    assert cache.lookup("Summarize these comments: a, b", "gpt-4o", 0.5) is None
+    assert cache.lookup("Summarize these comments: a, b", "gpt-4o-mini", 0.2) is None
+    cache.close()
+
+def test_eviction_keeps_size_under_max_bytes(tmp_path):
+    dim = 8 #32 bytes a vector
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_bytes=10 * dim * 4)
+    cache.store([f"old {i}" for i in range(10)], "model", vectors(10, dim))
+    cache.lookup(["old 9"], "model") #recently used, so it outlives the rest of its batch
+    cache.store([f"new {i}" for i in range(6)], "model", vectors(6, dim, seed=1))
+
+    stats = cache.stats()
+    assert stats["bytes"] <= cache.max_bytes
+    assert stats["entries"] == 10
+    assert cache.lookup(["old 9"], "model")[0] is not None
+    assert all(vector is not None for vector in cache.lookup([f"new {i}" for i in range(6)], "model"))
+    cache.close()
+
+def test_eviction_keeps_count_under_max_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"), max_entries=5)
+    for i in range(8):
+        cache.store([f"text {i}"], "model", vectors(1, seed=i))
+    assert cache.stats()["entries"] == 5
+    assert cache.lookup(["text 0", "text 7"], "model")[0] is None
+    cache.close()
+
+def test_sentiment_hit_returns_stored_result(tmp_path):
+    cache = SentimentCache(str(tmp_path / "sentiments.sqlite"))
+    cache.store(["good", "bad"], "model", [{"label": "POSITIVE", "score": 0.987654321}, {"label": "NEGATIVE", "score": 0.5}])
+    cache.close()
+
+    reopened = SentimentCache(str(tmp_path / "sentiments.sqlite"))
+    assert reopened.lookup(["bad", "good", "other"], "model") == [
+        {"label": "NEGATIVE", "score": 0.5},
+        {"label": "POSITIVE", "score": 0.987654321},
+        None
+    ]
+    assert reopened.lookup(["good"], "model:int8") == [None] #other backends have their own entries
+    reopened.close()
+
+def test_unknown_sentiment_is_not_cached(tmp_path, monkeypatch):
+    scored = []
+    def run_batch(batch, batch_size, backend=None):
+        scored.extend(batch)
+        return [dict(sentiment.UNKNOWN_SENTIMENT) if text.startswith("broken") else {"label": "POSITIVE", "score": 0.9} for text in batch]
+    monkeypatch.setattr(sentiment, "_run_batch", run_batch)
+    monkeypatch.setattr(sentiment, "get_sentiment_analyzer", lambda backend=None: None)
+    cache = SentimentCache(str(tmp_path / "sentiments.sqlite"))
+    texts = ["fine 1", "broken 1", "fine 2", "fine 1"]
+
+    first = sentiment.score_texts(texts, batch_size=2, cache=cache)
+    scored.clear()
+    second = sentiment.score_texts(texts, batch_size=2, cache=cache)
+
+    assert first == second
+    assert [result["label"] for result in second] == ["POSITIVE", "UNKNOWN", "POSITIVE", "POSITIVE"]
+    assert scored == ["broken 1"] #scored again, the others came from the cache
+    assert cache.stats()["entries"] == 2
+    cache.close()
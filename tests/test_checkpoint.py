@@ -0,0 +1,174 @@
+from types import ModuleType, SimpleNamespace
+import importlib
+import zlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from narrative_mapper.narrative_analyzer import summarize, sentiment
+from narrative_mapper.narrative_analyzer.checkpoint import RunCheckpoint
+from narrative_mapper.narrative_analyzer.cache import EmbeddingCache
+from narrative_mapper.narrative_analyzer.embedders import Embedder
+from narrative_mapper.narrative_analyzer.embeddings import get_embeddings
+
+class Interrupted(Exception):
+    pass
+
+class BatchEmbedder(Embedder):
+    '''
+    Embeds "text <i>" to [i, -i] in batches of 4 and raises before batch number fail_at.
+    '''
+    model = "batch-embedder"
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.embedded = []
+
+    def embed(self, texts, max_concurrency=1, on_batch_done=None, metrics=None, on_batch_result=None):
+        rows = []
+        for number, start in enumerate(range(0, len(texts), 4)):
+            if number == self.fail_at:
+                raise Interrupted(f"stopped before batch {number}")
+            batch = texts[start:start + 4]
+            vectors = np.array([[float(text.split()[1]), -float(text.split()[1])] for text in batch], dtype=np.float32)
+            self.embedded.extend(batch)
+            if on_batch_result:
+                on_batch_result(batch, vectors)
+            rows.append(vectors)
+        return np.vstack(rows)
+
+def test_embeddings_resume_only_embeds_unfinished_batches(tmp_path):
+    df = pd.DataFrame({"text": [f"text {i}" for i in range(20)]})
+
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        with pytest.raises(RuntimeError):
+            get_embeddings(df, embedder=BatchEmbedder(fail_at=3), checkpoint=checkpoint)
+
+    resumed = BatchEmbedder()
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        assert checkpoint.resumed
+        result = get_embeddings(df, embedder=resumed, checkpoint=checkpoint, cache=cache)
+        assert checkpoint.stats()["reused"]["embeddings"] == 12
+
+    assert resumed.embedded == [f"text {i}" for i in range(12, 20)]
+    assert result.matrix.tolist() == [[float(i), -float(i)] for i in range(20)]
+    #texts restored from the checkpoint are written to the cache too
+    assert all(vector is not None for vector in cache.lookup(df["text"].tolist(), BatchEmbedder.model))
+    cache.close()
+
+class FakeChatClient:
+    '''
+    Stands in for OpenAI().chat. Each completion is derived from its prompt; call number fail_at
+    (counting from 0) raises.
+    '''
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature):
+        if len(self.prompts) == self.fail_at:
+            raise Interrupted("chat call failed")
+        prompt = messages[0]["content"]
+        self.prompts.append(prompt)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"summary {zlib.crc32(prompt.encode())}"))], usage=None)
+
+def use_chat_client(monkeypatch, client):
+    monkeypatch.setattr(summarize, "get_openai_client", lambda: client)
+    monkeypatch.setattr(summarize, "get_token_counter", lambda model: SimpleNamespace(count=lambda texts: [len(text) for text in texts]))
+    monkeypatch.setattr(summarize, "batch_list", lambda texts, **kwargs: [texts[start:start + 2] for start in range(0, len(texts), 2)])
+
+def test_summaries_resume_only_calls_unfinished_prompts(tmp_path, monkeypatch):
+    #3 clusters of 2 batches: 2 map calls and 1 reduce call each
+    text_lists = [[f"cluster {c} text {i}" for i in range(4)] for c in range(3)]
+
+    use_chat_client(monkeypatch, FakeChatClient(fail_at=4))
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        with pytest.raises(RuntimeError):
+            summarize.extract_summaries_for_clusters(text_lists, max_concurrency=1, checkpoint=checkpoint)
+
+    resumed = FakeChatClient()
+    use_chat_client(monkeypatch, resumed)
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        summaries = summarize.extract_summaries_for_clusters(text_lists, max_concurrency=1, checkpoint=checkpoint)
+        assert checkpoint.stats()["reused"]["summaries"] == 4
+
+    fresh = FakeChatClient()
+    use_chat_client(monkeypatch, fresh)
+    assert summaries == summarize.extract_summaries_for_clusters(text_lists, max_concurrency=1)
+    assert len(resumed.prompts) == 5
+    assert resumed.prompts == fresh.prompts[4:]
+
+def test_sentiments_resume_only_scores_unfinished_batches(tmp_path, monkeypatch):
+    texts = [f"text {i}" for i in range(10)] + ["text 3", "text 4"]
+    scored = []
+    limit = {"texts": 6}
+    def run_batch(batch, batch_size, backend=None):
+        if limit["texts"] is not None and len(scored) >= limit["texts"]:
+            raise Interrupted("sentiment batch failed")
+        scored.extend(batch)
+        return [{"label": "POSITIVE", "score": int(text.split()[1]) / 10} for text in batch]
+    monkeypatch.setattr(sentiment, "_run_batch", run_batch)
+    monkeypatch.setattr(sentiment, "get_sentiment_analyzer", lambda backend=None: None) #no tokenizer: ordered by length
+
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        with pytest.raises(Interrupted):
+            sentiment.score_texts(texts, batch_size=3, checkpoint=checkpoint)
+    done = list(scored)
+
+    limit["texts"] = None
+    scored.clear()
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        results = sentiment.score_texts(texts, batch_size=3, checkpoint=checkpoint)
+        assert checkpoint.stats()["reused"]["sentiments"] == 6
+
+    assert len(done) == 6
+    assert sorted(scored) == sorted(set(texts) - set(done))
+    assert [result["score"] for result in results] == [int(text.split()[1]) / 10 for text in texts]
+
+@pytest.fixture
+def cli(monkeypatch, tmp_path):
+    '''
+    The CLI module, imported with an API key set and a stand-in for its scraping/plotting helpers.
+    '''
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.chdir(tmp_path)
+    cli_utils = ModuleType("narrative_mapper.narrative_mapper_cli.cli_utils")
+    cli_utils.scrape_subreddit = lambda *args, **kwargs: None
+    cli_utils.create_map = lambda *args, **kwargs: None
+    monkeypatch.setitem(sys.modules, cli_utils.__name__, cli_utils)
+    monkeypatch.delitem(sys.modules, "narrative_mapper.narrative_mapper_cli.cli", raising=False)
+    return importlib.import_module("narrative_mapper.narrative_mapper_cli.cli")
+
+def parse(cli, monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["narrativemapper", *argv])
+    return cli.parse_args()
+
+def test_resume_restores_the_run_options(cli, monkeypatch, tmp_path):
+    run_dir = str(tmp_path / "run")
+    args = parse(cli, monkeypatch, "comments.csv", "--run-dir", run_dir, "--max-samples", "123", "--summary-sampling", "mmr", "--verbose")
+    cli.open_run_dir(args).close()
+
+    args = parse(cli, monkeypatch, "--resume", run_dir)
+    checkpoint = cli.open_run_dir(args)
+    checkpoint.close()
+
+    assert args.file_name == "comments.csv"
+    assert args.max_samples == 123
+    assert args.summary_sampling == "mmr"
+    assert args.verbose is False #per-invocation flags are not restored
+    assert args.run_dir is None
+
+def test_resume_rejects_a_different_file(cli, monkeypatch, tmp_path):
+    run_dir = str(tmp_path / "run")
+    cli.open_run_dir(parse(cli, monkeypatch, "comments.csv", "--run-dir", run_dir)).close()
+
+    with pytest.raises(ValueError, match="comments.csv"):
+        cli.open_run_dir(parse(cli, monkeypatch, "other.csv", "--resume", run_dir))
+    #the same file is accepted, and starting a new run over it is not
+    cli.open_run_dir(parse(cli, monkeypatch, "comments.csv", "--resume", run_dir)).close()
+    with pytest.raises(ValueError, match="--resume"):
+        cli.open_run_dir(parse(cli, monkeypatch, "comments.csv", "--run-dir", run_dir))
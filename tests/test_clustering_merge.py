@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_distances
+
+from narrative_mapper.narrative_analyzer.clustering import merge_clusters_union_find, find_merge_pairs
+
+def baseline_merge(df, threshold, embedding_col='embeddings', cluster_col='cluster'):
+    '''
+    merge_clusters_union_find as it was before vectorizing: per-cluster centroids, a full
+    distance matrix and a dict-based union-find.
+    '''
+    parent = {}
+
+    def find(x):
+        if parent[x] != x:
+            parent[x] = find(parent[x])
+        return parent[x]
+
+    centroids = {}
+    for c_id in df[cluster_col].unique():
+        centroids[c_id] = np.vstack(df.loc[df[cluster_col] == c_id, embedding_col]).mean(axis=0)
+    ids = list(centroids.keys())
+    dists = cosine_distances([centroids[c_id] for c_id in ids])
+    parent.update({c_id: c_id for c_id in ids})
+    for i in range(len(ids)):
+        for j in range(i + 1, len(ids)):
+            if dists[i, j] < threshold:
+                root_i, root_j = find(ids[i]), find(ids[j])
+                if root_i != root_j:
+                    parent[root_j] = root_i
+
+    df = df.copy()
+    df[cluster_col] = [find(c) for c in df[cluster_col]]
+    return df
+
+def planted_clusters(seed=0, dim=64, rows_per_cluster=4):
+    '''
+    Groups of clusters whose centroids lie along an arc, 0.45 rad apart: neighbours on the arc
+    are within cosine distance 0.1 of each other, the ends of longer arcs are not, so only
+    transitive merging joins them. Unrelated groups are near-orthogonal. Cluster ids are
+    shuffled, so members of one group sit far apart in the centroid order.
+    '''
+    rng = np.random.default_rng(seed)
+    group_sizes = [1, 2, 3, 4, 1, 5, 2, 1, 3, 6, 1, 2, 4, 1, 3]
+    ids = rng.permutation(sum(group_sizes)) * 3 + 1
+    texts, labels, vectors, groups = [], [], [], []
+    position = 0
+    for size in group_sizes:
+        u, v = np.linalg.qr(rng.normal(size=(dim, 2)))[0].T
+        members = []
+        for k in range(size):
+            c_id = int(ids[position])
+            position += 1
+            center = np.cos(0.45 * k) * u + np.sin(0.45 * k) * v
+            for r in range(rows_per_cluster):
+                texts.append(f"cluster {c_id} row {r}")
+                labels.append(c_id)
+                vectors.append(center + rng.normal(scale=0.002, size=dim))
+            members.append(c_id)
+        groups.append(frozenset(members))
+
+    order = rng.permutation(len(labels)) #first appearance of each id no longer follows id order
+    df = pd.DataFrame({
+        "text": np.array(texts)[order],
+        "cluster": np.array(labels)[order],
+        "embeddings": [vectors[i].astype(np.float32).tolist() for i in order]
+    })
+    return df, set(groups)
+
+def partition(original, merged, cluster_col='cluster'):
+    members = {}
+    for old, new in zip(original[cluster_col], merged[cluster_col]):
+        members.setdefault(new, set()).add(old)
+    return {frozenset(group) for group in members.values()}
+
+def test_merge_matches_baseline_partition_across_blocks():
+    df, groups = planted_clusters()
+    expected = baseline_merge(df, threshold=0.2)
+    assert partition(df, expected) == groups
+
+    for block_size in (1, 3, 7, 2048): #small blocks put merged pairs in different row blocks
+        merged = merge_clusters_union_find(df.copy(), threshold=0.2, block_size=block_size)
+        assert partition(df, merged) == groups
+        assert merged["text"].tolist() == df["text"].tolist()
+
+def test_merged_group_takes_smallest_id():
+    df, groups = planted_clusters(seed=1)
+    merged = merge_clusters_union_find(df.copy(), threshold=0.2, block_size=5)
+    for old, new in zip(df["cluster"], merged["cluster"]):
+        group = next(group for group in groups if old in group)
+        assert new == min(group)
+
+def test_find_merge_pairs_is_independent_of_block_size():
+    centroids = np.random.default_rng(2).normal(size=(50, 16)).astype(np.float32)
+    centroids[10:20] = centroids[40] + 0.01 * centroids[10:20] #close to row 40, in a later block
+    full = set(zip(*find_merge_pairs(centroids, 0.2, block_size=2048)))
+    assert (10, 40) in full and (10, 19) in full
+    for block_size in (1, 4, 16):
+        assert set(zip(*find_merge_pairs(centroids, 0.2, block_size=block_size))) == full
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from narrative_mapper.narrative_analyzer.dedup import collapse_duplicates, expand_duplicates
+
+BASE = "the city council voted to raise the minimum wage again this year after a long debate"
+
+def test_exact_duplicates_collapse_with_counts():
+    df = pd.DataFrame({
+        "text": ["a b c", "  a b c ", "x y z", "a b c", "<b>x y z</b>", "other"],
+        "source": range(6)
+    })
+    collapsed, groups = collapse_duplicates(df)
+
+    assert collapsed["text"].tolist() == ["a b c", "x y z", "other"] #first row of each group
+    assert collapsed["source"].tolist() == [0, 2, 5]
+    assert collapsed["weight"].tolist() == [3, 2, 1]
+    assert collapsed["dedup_id"].tolist() == [0, 1, 2]
+    assert groups.tolist() == [0, 0, 1, 0, 1, 2]
+
+def test_existing_weights_are_summed():
+    df = pd.DataFrame({"text": ["a", "b", "a"], "weight": [2, 1, 5]})
+    collapsed, _ = collapse_duplicates(df)
+    assert collapsed["weight"].tolist() == [7, 1]
+
+def test_near_duplicates_collapse_only_when_asked():
+    df = pd.DataFrame({"text": [BASE, BASE + "!", "something else entirely, about the weather", BASE.replace("debate", "debates")]})
+
+    exact, _ = collapse_duplicates(df)
+    assert len(exact) == 4
+
+    near, groups = collapse_duplicates(df, near_duplicates=True, threshold=0.8)
+    assert near["text"].tolist() == [BASE, "something else entirely, about the weather"]
+    assert near["weight"].tolist() == [3, 1]
+    assert groups.tolist() == [0, 0, 1, 0]
+
+def test_expand_duplicates_reverses_collapse():
+    df = pd.DataFrame({"text": ["a", "b", "a", "c", "b", "a"], "source": range(6)})
+    collapsed, groups = collapse_duplicates(df)
+    result = collapsed.assign(cluster=collapsed["dedup_id"] * 10)
+    result = result[result["text"] != "c"] #dropped as noise
+
+    expanded = expand_duplicates(result, df, groups, columns=["cluster"])
+
+    assert expanded[["text", "source"]].equals(df)
+    assert expanded["cluster"].tolist()[:3] == [0, 10, 0]
+    assert np.isnan(expanded["cluster"].iloc[3])
+    assert expanded["cluster"].tolist()[4:] == [10, 0]
+
+def test_collapse_against_existing_rows():
+    first, _ = collapse_duplicates(pd.DataFrame({"text": ["a", "b", "a"]}))
+    new = pd.DataFrame({"text": ["b", "d", "a", "d", "e"]})
+
+    collapsed, groups = collapse_duplicates(new, existing=first)
+
+    #repeats of kept rows get their dedup_id and no row; new groups are numbered after them
+    assert groups.tolist() == [1, 2, 0, 2, 3]
+    assert collapsed["text"].tolist() == ["d", "e"]
+    assert collapsed["weight"].tolist() == [2, 1]
+    assert collapsed["dedup_id"].tolist() == [2, 3]
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from narrative_mapper.narrative_analyzer import embedders
+from narrative_mapper.narrative_analyzer.embedders import embed_batches
+from narrative_mapper.narrative_analyzer.embeddings import get_embeddings
+
+class FlakyError(Exception):
+    pass
+
+class FakeClient:
+    '''
+    Stands in for OpenAI().embeddings. Each text "text <i>" embeds to [i, -i]. Earlier batches
+    answer more slowly, so with several requests in flight they finish last. Texts in fail_times
+    make their batch raise that many times.
+    '''
+    def __init__(self, fail_times=None):
+        self.fail_times = dict(fail_times or {})
+        self.calls = []
+        self.finished = []
+        self._lock = threading.Lock()
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, input, model, **kwargs):
+        first = int(input[0].split()[1])
+        with self._lock:
+            self.calls.append(first)
+            failing = [text for text in input if self.fail_times.get(text, 0) > 0]
+            for text in failing:
+                self.fail_times[text] -= 1
+        if failing:
+            raise FlakyError(f"batch starting at {first} failed")
+        time.sleep(0.02 * max(0, 10 - first) / 10)
+        with self._lock:
+            self.finished.append(first)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[float(text.split()[1]), -float(text.split()[1])]) for text in input])
+
+def make_batches(n, size):
+    texts = [f"text {i}" for i in range(n)]
+    return [texts[start:start + size] for start in range(0, n, size)]
+
+def expected_rows(n):
+    return [[float(i), -float(i)] for i in range(n)]
+
+def test_embed_batches_keep_order_when_finished_out_of_order():
+    client = FakeClient()
+    done = []
+    rows = embed_batches(client, make_batches(30, 3), max_concurrency=4, on_batch_done=done.append)
+
+    assert client.finished != sorted(client.finished)
+    assert [list(row) for row in rows] == expected_rows(30)
+    assert sum(done) == 30
+
+def test_batch_failing_once_is_retried_alone():
+    client = FakeClient(fail_times={"text 7": 1})
+    rows = embed_batches(client, make_batches(30, 3), max_concurrency=4)
+
+    assert [list(row) for row in rows] == expected_rows(30)
+    assert client.calls.count(6) == 2 #the batch holding "text 7" was sent again
+    assert len(client.calls) == 11 #and no other batch was
+
+def use_fake_client(monkeypatch, client):
+    monkeypatch.setattr(embedders, "get_openai_client", lambda: client)
+    monkeypatch.setattr(embedders, "batch_list", lambda texts, **kwargs: [texts[start:start + 4] for start in range(0, len(texts), 4)])
+
+def test_get_embeddings_rows_line_up_with_text(monkeypatch):
+    client = FakeClient(fail_times={"text 13": 1})
+    use_fake_client(monkeypatch, client)
+    df = pd.DataFrame({"text": [f"text {i}" for i in range(40)], "source": range(40)})
+
+    result = get_embeddings(df, max_concurrency=5)
+
+    assert client.finished != sorted(client.finished)
+    assert result.matrix.tolist() == expected_rows(40)
+    assert result.df["source"].tolist() == list(range(40))
+
+def test_get_embeddings_raises_when_a_batch_fails_twice(monkeypatch):
+    client = FakeClient(fail_times={"text 13": 2})
+    use_fake_client(monkeypatch, client)
+    df = pd.DataFrame({"text": [f"text {i}" for i in range(40)]})
+
+    with pytest.raises(RuntimeError) as excinfo:
+        get_embeddings(df, max_concurrency=5)
+    assert isinstance(excinfo.value.__cause__, FlakyError)
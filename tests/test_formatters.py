@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from narrative_mapper.narrative_analyzer.formatters import format_by_text, write_by_text
+
+def summary_df(weighted=False, sizes=(3, 0, 5, 1, 4)):
+    '''
+    Output of summarize_clusters for clusters of the given sizes (0 gives a cluster with no texts).
+    '''
+    rng = np.random.default_rng(0)
+    rows = []
+    for cluster, size in enumerate(sizes):
+        row = {
+            "cluster": cluster,
+            "cluster_summary": f"summary {cluster}",
+            "text": [f"text {cluster} {i}, with \"quotes\"\nand a newline" for i in range(size)],
+            "all_sentiments": [{"label": "POSITIVE" if i % 2 else "NEGATIVE", "score": float(rng.random())} for i in range(size)],
+            "aggregated_sentiment": "NEUTRAL"
+        }
+        if weighted:
+            row["weights"] = [int(w) for w in rng.integers(1, 5, size=size)]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+@pytest.mark.parametrize("weighted", [False, True])
+def test_csv_matches_format_by_text(tmp_path, weighted):
+    df = summary_df(weighted)
+    expected = format_by_text(df, "group")
+    path = tmp_path / "texts.csv"
+
+    written = write_by_text(df, str(path), "group", chunk_rows=4)
+    back = pd.read_csv(path)
+
+    assert written == len(expected) == 13
+    position = list(expected.columns).index("sentiment")
+    columns = list(expected.columns)
+    columns[position:position + 1] = ["sentiment_label", "sentiment_score"]
+    assert list(back.columns) == columns
+    assert back["text"].tolist() == expected["text"].tolist()
+    assert back["cluster"].tolist() == expected["cluster"].tolist()
+    assert back["sentiment_label"].tolist() == [result["label"] for result in expected["sentiment"]]
+    assert np.allclose(back["sentiment_score"], [result["score"] for result in expected["sentiment"]])
+    if weighted:
+        assert back["weight"].tolist() == expected["weight"].tolist()
+
+def test_csv_with_no_texts_writes_the_header(tmp_path):
+    path = tmp_path / "texts.csv"
+    assert write_by_text(summary_df().iloc[:0], str(path), "group") == 0
+    assert "sentiment_label,sentiment_score" in path.read_text()
+
+@pytest.mark.parametrize("weighted", [False, True])
+def test_jsonl_matches_format_by_text(tmp_path, weighted):
+    df = summary_df(weighted)
+    expected = format_by_text(df, "group")
+    path = tmp_path / "texts.jsonl"
+
+    written = write_by_text(df, str(path), "group", chunk_rows=4)
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+    assert written == len(records) == len(expected)
+    assert records == json.loads(expected.to_json(orient="records", double_precision=15))
+
+def test_parquet_matches_format_by_text(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    df = summary_df(weighted=True)
+    expected = format_by_text(df, "group")
+    path = tmp_path / "texts.parquet"
+
+    written = write_by_text(df, str(path), "group", chunk_rows=4)
+    table = pq.read_table(path)
+
+    assert written == table.num_rows == len(expected)
+    assert pq.ParquetFile(path).num_row_groups > 1
+    assert table.column_names == list(expected.columns)
+    for column in expected.columns:
+        assert table.column(column).to_pylist() == expected[column].tolist()
+
+def test_unknown_extension_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        write_by_text(summary_df(), str(tmp_path / "texts.txt"))
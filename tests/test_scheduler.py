@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import sys
+import os
+
+import pytest
+
+from narrative_mapper.narrative_analyzer.scheduler import RequestScheduler, TokenBucket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from fake_openai import FakeOpenAIServer
+
+@pytest.fixture
+def start_server():
+    servers = []
+    def start(**kwargs):
+        servers.append(FakeOpenAIServer(dim=8, **kwargs).start())
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.stop()
+
+def openai_client(server):
+    from openai import OpenAI
+    return OpenAI(api_key="fake", base_url=server.url, max_retries=0)
+
+class RecordingEndpoint:
+    '''
+    Sends embedding requests and records when each attempt started and ended, and the Retry-After
+    of each 429.
+    '''
+    def __init__(self, client):
+        self.client = client
+        self.attempts = []
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs):
+        from openai import RateLimitError
+
+        start = time.monotonic()
+        retry_after = None
+        try:
+            return self.client.embeddings.create(**kwargs)
+        except RateLimitError as e:
+            retry_after = float(e.response.headers["retry-after"])
+            raise
+        finally:
+            with self._lock:
+                self.attempts.append((start, time.monotonic(), retry_after))
+
+def test_429_holds_off_every_caller_until_retry_after(start_server):
+    server = start_server(rpm=120, window=0.5) #one request per half second
+    scheduler = RequestScheduler(max_in_flight=4, base_delay=0.01)
+    endpoint = RecordingEndpoint(openai_client(server))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(lambda i: scheduler.call(endpoint.create, input=[f"text {i}"], model="fake"), range(4)))
+
+    assert [len(response.data) for response in responses] == [1] * 4
+    assert scheduler.stats()["throttled"] > 0
+    throttled = [(end, retry_after) for _, end, retry_after in endpoint.attempts if retry_after is not None]
+    for start, _, _ in endpoint.attempts:
+        for end, retry_after in throttled:
+            if start > end + 0.05: #began after the 429 was seen, by this caller or another
+                assert start >= end + retry_after - 0.01
+
+def test_retries_stop_after_max_retries(start_server):
+    from openai import RateLimitError
+
+    server = start_server(rpm=12, window=5.0) #one request per five seconds
+    scheduler = RequestScheduler(max_retries=2, base_delay=0.01, max_delay=0.01)
+    client = openai_client(server)
+
+    scheduler.call(client.embeddings.create, input=["first"], model="fake")
+    with pytest.raises(RateLimitError):
+        scheduler.call(client.embeddings.create, input=["second"], model="fake")
+
+    assert server.stats["requests"] == 4 #the first request, then the second one 1 + 2 times
+    assert server.stats["throttled"] == 3
+    assert scheduler.stats()["retries"] == 2
+
+def test_token_estimate_is_corrected_from_usage(start_server):
+    server = start_server(tpm=1000000)
+    scheduler = RequestScheduler(tpm=6000) #bucket of 100 tokens
+    client = openai_client(server)
+
+    response = scheduler.call(client.embeddings.create, tokens=80, usage_tokens=lambda response: response.usage.total_tokens, input=["x" * 40], model="fake")
+
+    assert response.usage.total_tokens == 10
+    #only the 10 tokens used stay taken, not the 80 estimated
+    assert 89 <= scheduler._tokens.available() <= 100
+
+def test_oversize_request_leaves_a_debt():
+    bucket = TokenBucket(per_minute=600) #10 tokens a second, bucket of 10
+
+    assert bucket.reserve(25) == 0 #a full bucket lets it through
+    assert bucket.available() < -14
+    #the next request waits for the 15 token debt and its own 5 tokens
+    assert bucket.reserve(5) == pytest.approx(2.0, abs=0.05)
+
+def test_batch_tokens_suit_the_limits():
+    assert RequestScheduler().batch_tokens(8000) == 8000
+    assert RequestScheduler(tpm=60000).batch_tokens(8000) == 1000 #a one second bucket
+    assert RequestScheduler(tpm=3000000).batch_tokens(8000) == 8000
+    assert RequestScheduler(rpm=600, tpm=300000).batch_tokens(8000) == 500 #tpm / rpm
+    assert RequestScheduler(rpm=600, tpm=6000).batch_tokens(8000) == 256 #never below minimum
+    assert RequestScheduler(rpm=600, tpm=6000).batch_tokens(8000, minimum=1) == 10
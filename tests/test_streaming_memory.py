@@ -0,0 +1,81 @@
+import tracemalloc
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from narrative_mapper.narrative_analyzer.streaming import embed_csv
+from narrative_mapper.narrative_analyzer.embedders import Embedder
+from narrative_mapper.narrative_analyzer.artifacts import load_embedding_set
+from narrative_mapper.narrative_analyzer.cache import EmbeddingCache
+from narrative_mapper.narrative_analyzer.checkpoint import RunCheckpoint
+
+CHUNK_SIZE = 500
+CHUNKS = 24
+
+class HashEmbedder(Embedder):
+    '''
+    Deterministic stand-in for an embedding API. Records traced memory at the start of every call,
+    which embed_csv makes once per chunk.
+    '''
+    model = "hash-embedder"
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.traced = []
+
+    def embed(self, texts, max_concurrency=1, on_batch_done=None, metrics=None, on_batch_result=None):
+        self.traced.append(tracemalloc.get_traced_memory()[0])
+        matrix = np.array([np.frombuffer(hashlib.sha256(text.encode("utf-8")).digest()[:self.dim * 4], dtype=np.uint32) for text in texts], dtype=np.float32)
+        for start in range(0, len(texts), 100):
+            if on_batch_result:
+                on_batch_result(texts[start:start + 100], matrix[start:start + 100])
+            if on_batch_done:
+                on_batch_done(len(texts[start:start + 100]))
+        return matrix
+
+def write_csv(path, rows):
+    pd.DataFrame({
+        "text": [f"comment {i} about topic {i % 17} " + "word " * (i % 11) for i in range(rows)],
+        "source": [f"thread-{i % 23}" for i in range(rows)]
+    }).to_csv(path, index=False)
+
+def test_embed_csv_memory_does_not_grow_across_chunks(tmp_path):
+    csv_path = tmp_path / "comments.csv"
+    write_csv(csv_path, CHUNK_SIZE * CHUNKS)
+    embedder = HashEmbedder()
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite"))
+    checkpoint = RunCheckpoint(str(tmp_path / "run"))
+
+    tracemalloc.start()
+    try:
+        result = embed_csv(str(csv_path), str(tmp_path / "artifact"), chunk_size=CHUNK_SIZE, cache=cache, embedder=embedder, checkpoint=checkpoint, load=False)
+    finally:
+        tracemalloc.stop()
+
+    assert result is None
+    assert len(embedder.traced) == CHUNKS
+    #per-row state kept across chunks (e.g. an in-memory key per text) would add ~100+ bytes a row
+    warm, last = embedder.traced[2], embedder.traced[-1]
+    rows_after_warm_up = CHUNK_SIZE * (CHUNKS - 3)
+    assert last - warm < 20 * rows_after_warm_up, f"traced memory grew {last - warm} bytes over {rows_after_warm_up} rows"
+
+    checkpoint.close()
+    cache.close()
+
+def test_embed_csv_resume_and_load(tmp_path):
+    csv_path = tmp_path / "comments.csv"
+    write_csv(csv_path, CHUNK_SIZE * 4)
+    first = HashEmbedder()
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        embedded = embed_csv(str(csv_path), str(tmp_path / "artifact"), chunk_size=CHUNK_SIZE, embedder=first, checkpoint=checkpoint)
+
+    resumed = HashEmbedder()
+    with RunCheckpoint(str(tmp_path / "run")) as checkpoint:
+        again = embed_csv(str(csv_path), str(tmp_path / "artifact2"), chunk_size=CHUNK_SIZE, embedder=resumed, checkpoint=checkpoint)
+        assert checkpoint.stats()["reused"]["embeddings"] == CHUNK_SIZE * 4
+
+    assert resumed.traced == [] #every text came from the checkpoint
+    assert len(embedded) == CHUNK_SIZE * 4
+    assert np.array_equal(embedded.matrix, again.matrix)
+    assert embedded.df.equals(load_embedding_set(str(tmp_path / "artifact2"), mmap=False).df)
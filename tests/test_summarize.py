@@ -0,0 +1,36 @@
+import numpy as np
+
+from narrative_mapper.narrative_analyzer.summarize import select_representatives
+
+def unit(angle):
+    return [np.cos(angle), np.sin(angle)]
+
+def test_picks_fit_the_token_budget():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(200, 16))
+    tokens = rng.integers(20, 400, size=200)
+
+    for budget in (50, 500, 3000):
+        picked = select_representatives(matrix, tokens, token_budget=budget)
+        assert picked
+        assert len(set(picked)) == len(picked)
+        assert tokens[picked].sum() <= budget
+        #nothing left over would still have fit
+        left = np.setdiff1d(np.arange(200), picked)
+        assert tokens[left].min() > budget - tokens[picked].sum()
+
+def test_no_text_fits_returns_the_most_central():
+    matrix = np.array([unit(0.0), unit(0.1), unit(-0.1)])
+    assert select_representatives(matrix, [900, 800, 700], token_budget=100) == [0]
+
+def test_diversity_skips_near_duplicates():
+    #five copies of one central text, and two texts on either side of it
+    matrix = np.array([unit(0.0)] * 5 + [unit(0.6), unit(-0.6)])
+    tokens = [10] * 7
+
+    central = select_representatives(matrix, tokens, token_budget=30, diversity=0.0)
+    varied = select_representatives(matrix, tokens, token_budget=30, diversity=0.7)
+
+    assert sorted(central) == [0, 1, 2]
+    assert varied[0] in range(5)
+    assert sorted(varied[1:]) == [5, 6]
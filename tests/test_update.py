@@ -0,0 +1,92 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from narrative_mapper.narrative_analyzer import narrative_mapper as narrative_mapper_module
+from narrative_mapper.narrative_analyzer.narrative_mapper import NarrativeMapper
+from narrative_mapper.narrative_analyzer.embedding_set import EmbeddingSet
+
+DIM = 128 #over the 100 PCA components cluster() keeps
+CENTERS = np.random.default_rng(0).normal(size=(8, DIM))
+
+def fake_get_embeddings(df, verbose=False, **kwargs):
+    '''
+    Planted topics: each row embeds to the center of its 'topic' plus noise seeded by its text.
+    '''
+    noise = np.array([np.random.default_rng(zlib.crc32(text.encode())).normal(size=DIM) for text in df['text']])
+    return EmbeddingSet(df.copy(), CENTERS[df['topic'].to_numpy()] + 0.05 * noise, model="fake")
+
+def texts(prefix, topics):
+    return pd.DataFrame({"text": [f"{prefix} {i}" for i in range(len(topics))], "topic": topics})
+
+def fit(monkeypatch, **load_kwargs):
+    embedded = []
+    def recording_get_embeddings(df, verbose=False, **kwargs):
+        embedded.extend(df['text'])
+        return fake_get_embeddings(df, verbose, **kwargs)
+    monkeypatch.setattr(narrative_mapper_module, "get_embeddings", recording_get_embeddings)
+
+    mapper = NarrativeMapper(texts("comment", np.arange(1000) % 5), "test")
+    mapper.load_embeddings(**load_kwargs).cluster()
+    mapper.embedded = embedded
+    return mapper
+
+@pytest.fixture
+def mapper(monkeypatch):
+    mapper = fit(monkeypatch)
+
+    mapper.refits = 0
+    cluster = mapper.cluster
+    def counting_cluster(**kwargs):
+        mapper.refits += 1
+        return cluster(**kwargs)
+    mapper.cluster = counting_cluster
+    return mapper
+
+def test_update_on_known_topics_assigns_without_refit(mapper):
+    clusters_before = mapper.cluster_df.df['cluster'].nunique()
+    mapper.update(texts("new", np.r_[np.zeros(50, int), np.ones(10, int)]))
+
+    assert mapper.last_update['refit'] is False
+    assert mapper.last_update['drift'] <= 0.25
+    assert mapper.refits == 0
+    assert mapper.last_update['assigned'] == 60
+    assert len(mapper.cluster_df) == 1060
+    assert mapper.cluster_df.df['cluster'].nunique() == clusters_before
+
+def test_update_on_new_topic_refits_above_threshold(mapper):
+    mapper.update(texts("drift", np.full(300, 5)))
+
+    assert mapper.last_update['drift'] > 0.25
+    assert mapper.last_update['refit'] is True
+    assert mapper.refits == 1
+    assert len(mapper.embeddings_df) == 1300
+
+def test_update_below_raised_threshold_does_not_refit(mapper):
+    mapper.update(texts("drift", np.full(300, 5)), drift_threshold=1.0)
+
+    assert mapper.last_update['drift'] > 0.25
+    assert mapper.last_update['refit'] is False
+    assert mapper.refits == 0
+
+def test_update_dedups_against_texts_in_the_map(monkeypatch):
+    mapper = fit(monkeypatch, dedup='exact')
+    mapper.embedded.clear()
+    new = pd.DataFrame({
+        "text": ["comment 3", "fresh 0", "comment 3", "comment 7", "fresh 0", "fresh 1"],
+        "topic": [3, 0, 3, 2, 0, 1]
+    })
+
+    mapper.update(new)
+
+    assert mapper.embedded == ["fresh 0", "fresh 1"] #repeats of mapped texts are not embedded again
+    assert mapper.last_update['repeated_texts'] == 3
+    assert mapper.last_update['new_texts'] == 6
+    weights = mapper.embeddings_df.df.set_index('text')['weight']
+    assert len(mapper.embeddings_df) == 1002
+    assert weights['comment 3'] == 3 and weights['comment 7'] == 2
+    assert weights['fresh 0'] == 2 and weights['fresh 1'] == 1
+    assert weights.sum() == 1006 and weights.dtype.kind == 'i'
+    assert mapper.duplicate_groups.tolist()[-6:] == [3, 1000, 3, 7, 1000, 1001]